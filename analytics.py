@@ -0,0 +1,545 @@
+"""
+Columnar export of the Munder Difflin database and analytics over it.
+
+`export_warehouse` incrementally copies the `transactions` ledger and the `quotes`
+table into Apache Arrow IPC files partitioned by month, plus a snapshot of the
+`inventory` reference table. The analytics functions memory-map those files
+(zero-copy) and aggregate them with vectorized `pyarrow.compute` kernels, so
+reporting runs off the OLTP SQLite database and scales with the size of the
+months it touches rather than with the whole ledger.
+
+Layout:
+    warehouse/
+        _state.json                          # export watermarks per table
+        transactions/month=2025-01/part-<first_rowid>-<last_rowid>.arrow
+        quotes/month=2025-01/part-<first_rowid>-<last_rowid>.arrow
+        inventory/inventory.arrow
+
+Requires pyarrow (`pip install pyarrow`).
+
+Usage: python analytics.py [--warehouse DIR] [--as-of YYYY-MM-DD] [--full] [--check]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from project_starter import get_engine
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from sqlalchemy import Engine
+
+DEFAULT_WAREHOUSE_DIR = "warehouse"
+
+# Rows read from SQLite and written per Arrow record batch during export
+EXPORT_BATCH_SIZE = 100_000
+
+# Month-partitioned tables: (date column used for partitioning, columns to export)
+PARTITIONED_TABLES = {
+    "transactions": (
+        "transaction_date",
+        ["item_name", "transaction_type", "units", "price", "transaction_date"],
+    ),
+    "quotes": (
+        "order_date",
+        ["request_id", "total_amount", "quote_explanation", "order_date", "job_type", "order_size", "event_type"],
+    ),
+}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ImportError("The analytics module requires pyarrow. Install it with `pip install pyarrow`.") from e
+    return pa
+
+
+def _schema(table_name: str) -> pa.Schema:
+    pa = _require_pyarrow()
+    if table_name == "transactions":
+        return pa.schema([
+            ("id", pa.int64()),
+            ("item_name", pa.string()),
+            ("transaction_type", pa.string()),
+            ("units", pa.float64()),
+            ("price", pa.float64()),
+            ("transaction_date", pa.string()),
+        ])
+    if table_name == "quotes":
+        return pa.schema([
+            ("id", pa.int64()),
+            ("request_id", pa.int64()),
+            ("total_amount", pa.float64()),
+            ("quote_explanation", pa.string()),
+            ("order_date", pa.string()),
+            ("job_type", pa.string()),
+            ("order_size", pa.string()),
+            ("event_type", pa.string()),
+        ])
+    return pa.schema([
+        ("item_name", pa.string()),
+        ("category", pa.string()),
+        ("unit_price", pa.float64()),
+        ("current_stock", pa.float64()),
+        ("min_stock_level", pa.float64()),
+    ])
+
+
+# ----------------------------
+# Export
+# ----------------------------
+
+def _load_state(warehouse_dir: str) -> Dict:
+    path = os.path.join(warehouse_dir, "_state.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(warehouse_dir: str, state: Dict) -> None:
+    # Write then rename so a crash never leaves a half-written state file
+    path = os.path.join(warehouse_dir, "_state.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _part_files(table_dir: str) -> List[Tuple[str, int, int]]:
+    """List (path, first_rowid, last_rowid) for every part file under a table directory."""
+    parts = []
+    if not os.path.isdir(table_dir):
+        return parts
+    for month_dir in sorted(os.listdir(table_dir)):
+        month_path = os.path.join(table_dir, month_dir)
+        if not os.path.isdir(month_path):
+            continue
+        for name in sorted(os.listdir(month_path)):
+            if name.startswith("part-") and name.endswith(".arrow"):
+                first, last = name[len("part-"):-len(".arrow")].split("-")
+                parts.append((os.path.join(month_path, name), int(first), int(last)))
+    return parts
+
+
+def _ledger_generation(conn) -> Optional[str]:
+    """Return the generation marker `init_database` wrote, or None for databases without one."""
+    from sqlalchemy import inspect
+    from sqlalchemy.sql import text
+
+    if not inspect(conn).has_table("ledger_generation"):
+        return None
+    return conn.execute(text("SELECT generation FROM ledger_generation")).scalar()
+
+
+def _export_partitioned(
+    conn, table_name: str, warehouse_dir: str, state: Dict, full: bool, generation: Optional[str] = None
+) -> int:
+    """
+    Append the rows of `table_name` added since the last export as new monthly part files.
+
+    Rows are tracked by SQLite rowid. The table is re-exported in full if it was
+    re-created since the last export (the ledger generation changed, since rowids
+    restart in a new table) or compacted (the rows up to the watermark no longer match).
+
+    Returns:
+        int: Number of rows exported.
+    """
+    from sqlalchemy.sql import text
+
+    pa = _require_pyarrow()
+    import pyarrow.compute as pc
+
+    date_column, columns = PARTITIONED_TABLES[table_name]
+    schema = _schema(table_name)
+    table_dir = os.path.join(warehouse_dir, table_name)
+    table_state = state.get(table_name, {"watermark": 0, "rows": 0, "generation": generation})
+
+    if table_state.get("generation") != generation:
+        full = True
+    elif not full and table_state["watermark"]:
+        rows_at_watermark = conn.execute(
+            text(f"SELECT COUNT(*) FROM {table_name} WHERE rowid <= :wm"),
+            {"wm": table_state["watermark"]},
+        ).scalar()
+        full = rows_at_watermark != table_state["rows"]
+
+    if full:
+        table_state = {"watermark": 0, "rows": 0, "generation": generation}
+
+    # Drop parts past the watermark: leftovers of a crashed export, or everything on a full export
+    for path, first, _ in _part_files(table_dir):
+        if first > table_state["watermark"]:
+            os.remove(path)
+    if os.path.isdir(table_dir):
+        for month_dir in os.listdir(table_dir):
+            month_path = os.path.join(table_dir, month_dir)
+            for name in os.listdir(month_path) if os.path.isdir(month_path) else []:
+                if name.endswith(".tmp"):
+                    os.remove(os.path.join(month_path, name))
+
+    result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(
+        text(f"SELECT rowid AS id, {', '.join(columns)} FROM {table_name} WHERE rowid > :wm ORDER BY rowid"),
+        {"wm": table_state["watermark"]},
+    )
+
+    writers: Dict[str, Tuple] = {}  # month -> (writer, tmp path, first rowid, last rowid)
+    exported = 0
+    try:
+        for partition in result.partitions(EXPORT_BATCH_SIZE):
+            batch = pa.RecordBatch.from_pylist([dict(row._mapping) for row in partition], schema=schema)
+            months = pc.utf8_slice_codeunits(pc.cast(batch.column(date_column), pa.string()), 0, 7)
+            for month in pc.unique(months).to_pylist():
+                month_rows = batch.filter(pc.equal(months, month)) if month is not None else batch.filter(pc.is_null(months))
+                month = month or "unknown"
+                if month not in writers:
+                    month_dir = os.path.join(table_dir, f"month={month}")
+                    os.makedirs(month_dir, exist_ok=True)
+                    tmp_path = os.path.join(month_dir, f".part-{exported}.arrow.tmp")
+                    writers[month] = [pa.ipc.new_file(tmp_path, schema), tmp_path, None, None]
+                entry = writers[month]
+                entry[0].write_batch(month_rows)
+                ids = month_rows.column("id")
+                entry[2] = entry[2] if entry[2] is not None else pc.min(ids).as_py()
+                entry[3] = pc.max(ids).as_py()
+            exported += batch.num_rows
+            table_state["watermark"] = batch.column("id")[-1].as_py()
+    finally:
+        for writer, tmp_path, first, last in writers.values():
+            writer.close()
+            if first is not None:
+                os.replace(tmp_path, os.path.join(os.path.dirname(tmp_path), f"part-{first}-{last}.arrow"))
+
+    table_state["rows"] += exported
+    state[table_name] = table_state
+    return exported
+
+
+def _export_inventory(conn, warehouse_dir: str) -> int:
+    """Write a full snapshot of the (small) inventory reference table."""
+    from sqlalchemy.sql import text
+
+    pa = _require_pyarrow()
+    rows = [dict(r._mapping) for r in conn.execute(text(
+        "SELECT item_name, category, unit_price, current_stock, min_stock_level FROM inventory"
+    ))]
+    table = pa.Table.from_pylist(rows, schema=_schema("inventory"))
+
+    table_dir = os.path.join(warehouse_dir, "inventory")
+    os.makedirs(table_dir, exist_ok=True)
+    path = os.path.join(table_dir, "inventory.arrow")
+    with pa.ipc.new_file(path + ".tmp", table.schema) as writer:
+        writer.write_table(table)
+    os.replace(path + ".tmp", path)
+    return table.num_rows
+
+
+def export_warehouse(
+    warehouse_dir: str = DEFAULT_WAREHOUSE_DIR, full: bool = False, engine: Optional[Engine] = None
+) -> Dict[str, int]:
+    """
+    Incrementally export the ledger, quotes and inventory to month-partitioned Arrow files.
+
+    Only rows added since the previous export are read from SQLite, so the cost of an
+    export is proportional to the new rows, not to the size of the ledger.
+
+    Args:
+        warehouse_dir (str, optional): Output directory. Default is 'warehouse'.
+        full (bool, optional): Re-export everything instead of only new rows. Default is False.
+        engine (Engine, optional): Database to export. Defaults to `get_engine()`.
+
+    Returns:
+        Dict[str, int]: Number of rows exported per table.
+    """
+    os.makedirs(warehouse_dir, exist_ok=True)
+    state = _load_state(warehouse_dir)
+    counts = {}
+
+    with (engine or get_engine()).connect() as conn:
+        generation = _ledger_generation(conn)
+        for table_name in PARTITIONED_TABLES:
+            counts[table_name] = _export_partitioned(conn, table_name, warehouse_dir, state, full, generation)
+            # Persist the watermark as soon as each table's part files are in place
+            _save_state(warehouse_dir, state)
+        counts["inventory"] = _export_inventory(conn, warehouse_dir)
+
+    return counts
+
+
+# ----------------------------
+# Memory-mapped loading
+# ----------------------------
+
+def _read_mapped(path: str) -> pa.Table:
+    pa = _require_pyarrow()
+    with pa.memory_map(path, "r") as source:
+        # Buffers reference the mapped file directly; nothing is copied into memory
+        return pa.ipc.open_file(source).read_all()
+
+
+def load_table(
+    table_name: str,
+    warehouse_dir: str = DEFAULT_WAREHOUSE_DIR,
+    as_of_date: Optional[str] = None,
+) -> pa.Table:
+    """
+    Memory-map the exported files of a table into a single Arrow table.
+
+    For month-partitioned tables, partitions after `as_of_date` are skipped without
+    being opened, and the remaining rows are filtered to the inclusive cutoff using the
+    same string comparison as the SQL queries in `project_starter`.
+
+    Args:
+        table_name (str): 'transactions', 'quotes' or 'inventory'.
+        warehouse_dir (str, optional): Directory written by `export_warehouse`.
+        as_of_date (str, optional): Inclusive cutoff date (YYYY-MM-DD).
+
+    Returns:
+        pa.Table: The table's rows.
+    """
+    pa = _require_pyarrow()
+    import pyarrow.compute as pc
+
+    if table_name == "inventory":
+        path = os.path.join(warehouse_dir, "inventory", "inventory.arrow")
+        return _read_mapped(path) if os.path.exists(path) else _schema("inventory").empty_table()
+
+    date_column, _ = PARTITIONED_TABLES[table_name]
+    tables = []
+    for path, _, _ in _part_files(os.path.join(warehouse_dir, table_name)):
+        month = os.path.basename(os.path.dirname(path))[len("month="):]
+        if as_of_date is not None and month != "unknown" and month > as_of_date[:7]:
+            continue
+        tables.append(_read_mapped(path))
+
+    if not tables:
+        return _schema(table_name).empty_table()
+    table = pa.concat_tables(tables)
+    if as_of_date is not None:
+        table = table.filter(pc.less_equal(table.column(date_column), as_of_date))
+    return table
+
+
+# ----------------------------
+# Analytics
+# ----------------------------
+
+def top_sellers(as_of_date: Optional[str] = None, limit: int = 5, warehouse_dir: str = DEFAULT_WAREHOUSE_DIR) -> pa.Table:
+    """
+    Top products by sales revenue as of a date.
+
+    The opening cash entry, which is recorded as a sale with no item, is excluded.
+
+    Args:
+        as_of_date (str, optional): Inclusive cutoff date (YYYY-MM-DD). Default is all time.
+        limit (int, optional): Number of products to return. Default is 5.
+        warehouse_dir (str, optional): Directory written by `export_warehouse`.
+
+    Returns:
+        pa.Table: Columns item_name, total_units, total_revenue, sorted by revenue.
+    """
+    import pyarrow.compute as pc
+
+    ledger = load_table("transactions", warehouse_dir, as_of_date)
+    sales = ledger.filter(pc.and_(
+        pc.equal(ledger.column("transaction_type"), "sales"),
+        pc.is_valid(ledger.column("item_name")),
+    ))
+    totals = sales.group_by("item_name").aggregate([("units", "sum"), ("price", "sum")])
+    totals = totals.rename_columns(["item_name", "total_units", "total_revenue"])
+    return totals.sort_by([("total_revenue", "descending")]).slice(0, limit)
+
+
+def revenue_by_category(as_of_date: Optional[str] = None, warehouse_dir: str = DEFAULT_WAREHOUSE_DIR) -> pa.Table:
+    """
+    Sales revenue and units per inventory category as of a date.
+
+    Args:
+        as_of_date (str, optional): Inclusive cutoff date (YYYY-MM-DD). Default is all time.
+        warehouse_dir (str, optional): Directory written by `export_warehouse`.
+
+    Returns:
+        pa.Table: Columns category, total_units, total_revenue, sorted by revenue.
+    """
+    import pyarrow.compute as pc
+
+    ledger = load_table("transactions", warehouse_dir, as_of_date)
+    sales = ledger.filter(pc.and_(
+        pc.equal(ledger.column("transaction_type"), "sales"),
+        pc.is_valid(ledger.column("item_name")),
+    ))
+    categories = load_table("inventory", warehouse_dir).select(["item_name", "category"])
+    joined = sales.join(categories, "item_name")
+    totals = joined.group_by("category").aggregate([("units", "sum"), ("price", "sum")])
+    totals = totals.rename_columns(["category", "total_units", "total_revenue"])
+    return totals.sort_by([("total_revenue", "descending")])
+
+
+def sell_through(as_of_date: Optional[str] = None, warehouse_dir: str = DEFAULT_WAREHOUSE_DIR) -> pa.Table:
+    """
+    Per-item sell-through and stock position against `min_stock_level` as of a date.
+
+    Sell-through is units sold divided by units received through stock orders.
+
+    Args:
+        as_of_date (str, optional): Inclusive cutoff date (YYYY-MM-DD). Default is all time.
+        warehouse_dir (str, optional): Directory written by `export_warehouse`.
+
+    Returns:
+        pa.Table: Columns item_name, category, units_received, units_sold, sell_through,
+                  stock, min_stock_level and below_min, for every inventory item.
+    """
+    pa = _require_pyarrow()
+    import pyarrow.compute as pc
+
+    ledger = load_table("transactions", warehouse_dir, as_of_date)
+    ledger = ledger.filter(pc.is_valid(ledger.column("item_name")))
+    is_sale = pc.equal(ledger.column("transaction_type"), "sales")
+    is_order = pc.equal(ledger.column("transaction_type"), "stock_orders")
+    units = pc.fill_null(ledger.column("units"), 0.0)
+
+    flows = pa.table({
+        "item_name": ledger.column("item_name"),
+        "received": pc.if_else(is_order, units, 0.0),
+        "sold": pc.if_else(is_sale, units, 0.0),
+    })
+    totals = flows.group_by("item_name").aggregate([("received", "sum"), ("sold", "sum")])
+
+    inventory = load_table("inventory", warehouse_dir).select(["item_name", "category", "min_stock_level"])
+    joined = inventory.join(totals, "item_name", join_type="left outer")
+
+    received = pc.fill_null(joined.column("received_sum"), 0.0)
+    sold = pc.fill_null(joined.column("sold_sum"), 0.0)
+    stock = pc.subtract(received, sold)
+    ratio = pc.if_else(pc.greater(received, 0.0), pc.divide(sold, pc.max_element_wise(received, 1e-12)), 0.0)
+
+    return pa.table({
+        "item_name": joined.column("item_name"),
+        "category": joined.column("category"),
+        "units_received": received,
+        "units_sold": sold,
+        "sell_through": ratio,
+        "stock": stock,
+        "min_stock_level": joined.column("min_stock_level"),
+        "below_min": pc.less(stock, joined.column("min_stock_level")),
+    }).sort_by([("sell_through", "descending")])
+
+
+# ----------------------------
+# Export check
+# ----------------------------
+
+def check_export(n_sales: int = 200, seed: int = 0) -> List[Dict]:
+    """
+    Check that incremental exports give the same analytics as full ones, including after a re-init.
+
+    Works on a scratch database in a temporary directory. It is initialized with
+    `init_database` and exported incrementally after each of these steps:
+    - the initial load plus `n_sales` random sales
+    - `n_sales` more sales
+    - `init_database` again plus `3 * n_sales` sales, so the new ledger's rowids run
+      past the previous watermark and its row count below the watermark matches
+
+    After each step, the analytics of the incremental warehouse are compared with those
+    of a fresh full export.
+
+    Args:
+        n_sales (int, optional): Sales added per step. Default is 200.
+        seed (int, optional): Seed for the generated sales. Default is 0.
+
+    Returns:
+        List[Dict]: Per step, the transactions exported incrementally and whether the
+                    analytics matched the full export.
+    """
+    import math
+    import random
+    import tempfile
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.sql import text
+
+    from project_starter import init_database
+
+    rng = random.Random(seed)
+
+    def add_sales(engine, n: int) -> None:
+        with engine.begin() as conn:
+            items = [row[0] for row in conn.execute(text("SELECT item_name FROM inventory"))]
+            conn.execute(
+                text("""
+                    INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date)
+                    VALUES (:item_name, 'sales', :units, :price, :transaction_date)
+                """),
+                [
+                    {
+                        "item_name": rng.choice(items),
+                        "units": rng.randint(1, 50),
+                        "price": round(rng.uniform(1, 100), 2),
+                        "transaction_date": f"2025-{rng.randint(1, 4):02d}-{rng.randint(1, 28):02d}",
+                    }
+                    for _ in range(n)
+                ],
+            )
+
+    def analytics(warehouse_dir: str) -> List[List[Dict]]:
+        tables = [top_sellers(limit=1000, warehouse_dir=warehouse_dir),
+                  revenue_by_category(warehouse_dir=warehouse_dir),
+                  sell_through(warehouse_dir=warehouse_dir)]
+        return [sorted(table.to_pylist(), key=lambda row: str(row.get("item_name") or row.get("category")))
+                for table in tables]
+
+    def same(a, b) -> bool:
+        if isinstance(a, list) and isinstance(b, list):
+            return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+        if isinstance(a, dict) and isinstance(b, dict):
+            return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+        if isinstance(a, float) and isinstance(b, float):
+            return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+        return a == b
+
+    steps = [("initial", 1), ("more sales", 1), ("re-init", 3)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'check.db')}")
+        incremental_dir = os.path.join(tmp, "incremental")
+        for i, (step, multiple) in enumerate(steps):
+            if i == 0 or step == "re-init":
+                init_database(engine)
+            add_sales(engine, multiple * n_sales)
+            exported = export_warehouse(incremental_dir, engine=engine)["transactions"]
+            full_dir = os.path.join(tmp, f"full-{i}")
+            export_warehouse(full_dir, full=True, engine=engine)
+            results.append({
+                "step": step,
+                "exported_transactions": exported,
+                "matches_full_export": same(analytics(incremental_dir), analytics(full_dir)),
+            })
+        engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the database to Arrow files and print analytics")
+    parser.add_argument("--warehouse", default=DEFAULT_WAREHOUSE_DIR, help="Warehouse directory (default: warehouse)")
+    parser.add_argument("--as-of", help="Inclusive cutoff date (YYYY-MM-DD) for the analytics")
+    parser.add_argument("--full", action="store_true", help="Re-export everything instead of only new rows")
+    parser.add_argument("--check", action="store_true",
+                        help="Compare incremental and full exports on a scratch database, including after a re-init")
+    args = parser.parse_args()
+
+    if args.check:
+        for step in check_export():
+            print(step)
+        raise SystemExit(0)
+
+    counts = export_warehouse(args.warehouse, full=args.full)
+    print(f"Exported rows: {counts}")
+    print("\nTop sellers:")
+    print(top_sellers(args.as_of, warehouse_dir=args.warehouse).to_pandas())
+    print("\nRevenue by category:")
+    print(revenue_by_category(args.as_of, warehouse_dir=args.warehouse).to_pandas())
+    print("\nSell-through:")
+    print(sell_through(args.as_of, warehouse_dir=args.warehouse).to_pandas())
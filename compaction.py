@@ -0,0 +1,370 @@
+"""
+Ledger compaction: roll old transactions into opening-balance rows and archive them.
+
+The `transactions` ledger only grows, and every stock, cash and report query sums it
+from the start of time. `compact_ledger(cutoff)` replaces every transaction dated
+before the cutoff with one opening-balance row per (item, transaction type). Each
+opening row holds the group's total units and total price and is dated at the
+group's last archived transaction. The cash rows (no item) are rolled up the same
+way. The queries only ever sum units and prices per item and type up to a date, so
+every as-of query for a date on or after the cutoff sees the same totals.
+
+The original rows are moved to `transactions_archive`, tagged with the compaction
+and their original rowid, so nothing is lost for audits. The opening rows are listed
+in `ledger_openings`. The view `transactions_full` is the archive plus the hot
+table without its opening rows, i.e. the ledger as it would be without compaction.
+`project_starter` answers as-of queries for dates before the latest cutoff from that
+view (see `ledger_table`), so archived periods stay queryable on demand.
+
+Compacting again with a later cutoff folds the previous opening rows into the new
+ones, so the hot table holds at most one row per (item, type) before the cutoff, plus
+the transactions after it, however many years of history are archived.
+
+Notes:
+- Row counts before the cutoff (e.g. `query_db.py transactions --count`) shrink, since
+  the opening rows stand in for many transactions. Sums of units and prices don't change.
+- Opening prices are sums of many prices, so float totals can differ from the
+  uncompacted ones in the last bits (far below a cent).
+- `analytics.export_warehouse` notices the removed rows and re-exports in full.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+
+from project_starter import get_engine
+
+if TYPE_CHECKING:
+    from sqlalchemy import Connection, Engine
+
+ARCHIVE_TABLE = "transactions_archive"
+OPENINGS_TABLE = "ledger_openings"
+COMPACTIONS_TABLE = "ledger_compactions"
+FULL_LEDGER_VIEW = "transactions_full"
+
+LEDGER_COLUMNS = "id, item_name, transaction_type, units, price, transaction_date"
+
+CREATE_COMPACTION_TABLES = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {COMPACTIONS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        cutoff TEXT NOT NULL,
+        archived_rows INTEGER NOT NULL DEFAULT 0,
+        opening_rows INTEGER NOT NULL DEFAULT 0,
+        compacted_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+        compaction_id INTEGER NOT NULL,
+        source_rowid INTEGER NOT NULL,
+        id FLOAT,
+        item_name TEXT,
+        transaction_type TEXT,
+        units INTEGER,
+        price FLOAT,
+        transaction_date TEXT
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_{ARCHIVE_TABLE}_date ON {ARCHIVE_TABLE} (transaction_date)",
+    f"CREATE INDEX IF NOT EXISTS idx_{ARCHIVE_TABLE}_item ON {ARCHIVE_TABLE} (item_name, transaction_date)",
+    f"""
+    CREATE TABLE IF NOT EXISTS {OPENINGS_TABLE} (
+        row_id INTEGER PRIMARY KEY,
+        compaction_id INTEGER NOT NULL
+    )
+    """,
+    # Views have no rowid of their own, so the original transaction ids are a column
+    f"DROP VIEW IF EXISTS {FULL_LEDGER_VIEW}",
+    f"""
+    CREATE VIEW {FULL_LEDGER_VIEW} AS
+        SELECT source_rowid AS row_id, {LEDGER_COLUMNS} FROM {ARCHIVE_TABLE}
+        UNION ALL
+        SELECT rowid AS row_id, {LEDGER_COLUMNS} FROM transactions
+        WHERE rowid NOT IN (SELECT row_id FROM {OPENINGS_TABLE})
+    """,
+]
+
+
+def create_compaction_tables(conn: Connection) -> None:
+    """Create the archive, openings and compaction log tables if they don't exist, and (re)create the full-ledger view."""
+    from sqlalchemy import text
+
+    for statement in CREATE_COMPACTION_TABLES:
+        conn.execute(text(statement))
+
+
+def drop_compaction_tables(conn: Connection) -> None:
+    """Drop the archive, openings and compaction log tables and the full-ledger view."""
+    from sqlalchemy import text
+
+    conn.execute(text(f"DROP VIEW IF EXISTS {FULL_LEDGER_VIEW}"))
+    for table in (ARCHIVE_TABLE, OPENINGS_TABLE, COMPACTIONS_TABLE):
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+def compact_ledger(cutoff_date: str, engine: Optional[Engine] = None, vacuum: bool = False) -> Dict[str, Any]:
+    """
+    Archive the transactions dated before `cutoff_date` and replace them with opening-balance rows.
+
+    Runs in one database transaction, so concurrent readers see the ledger either
+    before or after the compaction.
+
+    Args:
+        cutoff_date (str): First day (YYYY-MM-DD) kept in full. Transactions dated before
+                           it are compacted.
+        engine (Engine, optional): Engine to compact. Defaults to `get_engine()`.
+        vacuum (bool, optional): Run VACUUM afterwards to give the freed pages back to
+                                 the file system. Default is False.
+
+    Returns:
+        Dict with the compaction id, the cutoff, the rows archived, the opening rows
+        written, and the rows left in the hot table.
+
+    Raises:
+        ValueError: If `cutoff_date` is not a YYYY-MM-DD date or is before an earlier cutoff.
+    """
+    from datetime import date
+
+    from sqlalchemy import text
+
+    try:
+        cutoff = date.fromisoformat(cutoff_date).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"cutoff_date must be a YYYY-MM-DD date, got {cutoff_date!r}") from None
+    engine = engine or get_engine()
+
+    with engine.begin() as conn:
+        create_compaction_tables(conn)
+        previous = conn.execute(text(f"SELECT MAX(cutoff) FROM {COMPACTIONS_TABLE}")).scalar()
+        if previous is not None and cutoff < previous:
+            raise ValueError(f"Cutoff {cutoff} is before the previous compaction cutoff {previous}")
+
+        compaction_id = conn.execute(
+            text(f"INSERT INTO {COMPACTIONS_TABLE} (cutoff) VALUES (:cutoff)"), {"cutoff": cutoff}
+        ).lastrowid
+
+        # Originals go to the archive; earlier opening rows are already represented there
+        archived = conn.execute(text(f"""
+            INSERT INTO {ARCHIVE_TABLE} (compaction_id, source_rowid, {LEDGER_COLUMNS})
+            SELECT :compaction_id, rowid, {LEDGER_COLUMNS}
+            FROM transactions
+            WHERE transaction_date < :cutoff
+            AND rowid NOT IN (SELECT row_id FROM {OPENINGS_TABLE})
+            ORDER BY rowid
+        """), {"compaction_id": compaction_id, "cutoff": cutoff}).rowcount
+
+        # One opening row per (item, type), folding in the previous opening rows
+        openings = conn.execute(text("""
+            SELECT item_name, transaction_type, SUM(units) AS units, SUM(price) AS price,
+                   MAX(transaction_date) AS transaction_date
+            FROM transactions
+            WHERE transaction_date < :cutoff
+            GROUP BY item_name, transaction_type
+            ORDER BY MAX(transaction_date), item_name
+        """), {"cutoff": cutoff}).fetchall()
+
+        conn.execute(text("DELETE FROM transactions WHERE transaction_date < :cutoff"), {"cutoff": cutoff})
+        conn.execute(text(f"DELETE FROM {OPENINGS_TABLE}"))
+
+        for opening in openings:
+            row_id = conn.execute(text("""
+                INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date)
+                VALUES (:item_name, :transaction_type, :units, :price, :transaction_date)
+            """), dict(opening._mapping)).lastrowid
+            conn.execute(
+                text(f"INSERT INTO {OPENINGS_TABLE} (row_id, compaction_id) VALUES (:row_id, :compaction_id)"),
+                {"row_id": row_id, "compaction_id": compaction_id},
+            )
+
+        conn.execute(
+            text(f"UPDATE {COMPACTIONS_TABLE} SET archived_rows = :archived, opening_rows = :openings WHERE id = :id"),
+            {"archived": archived, "openings": len(openings), "id": compaction_id},
+        )
+        hot_rows = conn.execute(text("SELECT COUNT(*) FROM transactions")).scalar()
+
+    if vacuum:
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+    return {
+        "compaction_id": compaction_id,
+        "cutoff": cutoff,
+        "archived_rows": archived,
+        "opening_rows": len(openings),
+        "hot_rows": hot_rows,
+    }
+
+
+def list_compactions(engine: Optional[Engine] = None) -> List[Dict[str, Any]]:
+    """
+    Return the compaction log, oldest first.
+
+    Args:
+        engine (Engine, optional): Engine to query. Defaults to `get_engine()`.
+
+    Returns:
+        List[Dict]: One entry per compaction with id, cutoff, archived_rows,
+                    opening_rows and compacted_at. Empty if the ledger was never compacted.
+    """
+    from sqlalchemy import inspect, text
+
+    engine = engine or get_engine()
+    if not inspect(engine).has_table(COMPACTIONS_TABLE):
+        return []
+    with engine.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(text(f"SELECT * FROM {COMPACTIONS_TABLE} ORDER BY id"))]
+
+
+@contextmanager
+def _using_engine(engine: Engine) -> Iterator[None]:
+    """Point the project_starter query functions at another engine, with memoization off."""
+    import project_starter
+    from memo import set_memoization
+
+    previous = project_starter._engine
+    project_starter._engine = engine
+    set_memoization(False)
+    try:
+        yield
+    finally:
+        project_starter._engine = previous
+        set_memoization(True)
+
+
+def check_compaction(cutoff_date: str, as_of_dates: Optional[List[str]] = None, synthetic_years: int = 0) -> Dict[str, Any]:
+    """
+    Compact a copy of the database and check that as-of queries return the same results.
+
+    The database file is copied to a temporary directory, optionally with
+    `synthetic_years` of random daily sales and stock orders added up to 90 days
+    past the cutoff.
+    Cash balances, stock levels and financial reports are computed for each date before
+    and after compacting the copy, then compared. Dates before the cutoff are answered
+    from the archive through `transactions_full`.
+
+    Args:
+        cutoff_date: Compaction cutoff (YYYY-MM-DD).
+        as_of_dates: Dates to compare. Defaults to the 1st and 15th of each month from
+                     the earliest transaction to the latest one (or 90 days past the
+                     cutoff, if later).
+        synthetic_years: Years of generated history to add before the compaction.
+
+    Returns:
+        Dict with the compaction summary, the dates compared, any mismatches, and the
+        mean time of a financial report before and after compacting.
+    """
+    import math
+    import os
+    import random
+    import shutil
+    import tempfile
+    import time
+    from datetime import date, timedelta
+
+    from sqlalchemy import create_engine, text
+
+    from memo import track_writes
+    from project_starter import DB_URL, generate_financial_report, get_all_inventory, get_cash_balance
+
+    source = DB_URL.replace("sqlite:///", "", 1)
+
+    def snapshot(dates: List[str]) -> Dict[str, Any]:
+        return {
+            as_of: {
+                "cash": get_cash_balance(as_of),
+                "inventory": get_all_inventory(as_of),
+                "report": generate_financial_report(as_of),
+            }
+            for as_of in dates
+        }
+
+    def same(a: Any, b: Any) -> bool:
+        if isinstance(a, dict) and isinstance(b, dict):
+            return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+        if isinstance(a, list) and isinstance(b, list):
+            return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            # The cash rows have no item, which pandas reads back as NaN
+            return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6) or (math.isnan(a) and math.isnan(b))
+        return a == b
+
+    def time_reports(dates: List[str]) -> float:
+        started = time.perf_counter()
+        for as_of in dates:
+            generate_financial_report(as_of)
+        return (time.perf_counter() - started) / len(dates) * 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ledger.db")
+        shutil.copy(source, path)
+        engine = create_engine(f"sqlite:///{path}")
+        track_writes(engine)
+
+        with engine.begin() as conn:
+            first, last = conn.execute(text("SELECT MIN(transaction_date), MAX(transaction_date) FROM transactions")).one()
+            if synthetic_years:
+                rng = random.Random(0)
+                items = conn.execute(text("SELECT item_name, unit_price FROM inventory")).fetchall()
+                end = date.fromisoformat(cutoff_date) + timedelta(days=90)
+                start = end - timedelta(days=365 * synthetic_years)
+                rows = []
+                for day in range(365 * synthetic_years):
+                    for _ in range(rng.randint(1, 6)):
+                        name, unit_price = rng.choice(items)
+                        units = rng.randint(10, 500)
+                        kind = rng.choice(["stock_orders", "sales"])
+                        rows.append({
+                            "item_name": name, "transaction_type": kind, "units": units,
+                            "price": round(units * unit_price * (1.0 if kind == "sales" else 0.8), 2),
+                            "transaction_date": (start + timedelta(days=day)).isoformat() + "T00:00:00",
+                        })
+                conn.execute(text(
+                    "INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date) "
+                    "VALUES (:item_name, :transaction_type, :units, :price, :transaction_date)"
+                ), rows)
+                first = min(first, start.isoformat())
+
+        if as_of_dates is None:
+            as_of_dates = []
+            month = date.fromisoformat(first[:10]).replace(day=1)
+            end = max(last[:10], (date.fromisoformat(cutoff_date) + timedelta(days=90)).isoformat())
+            while month.isoformat() <= end:
+                as_of_dates += [month.isoformat(), month.replace(day=15).isoformat()]
+                month = (month + timedelta(days=32)).replace(day=1)
+        after_cutoff = [d for d in as_of_dates if d >= cutoff_date]
+
+        with _using_engine(engine):
+            before = snapshot(as_of_dates)
+            report_ms_before = time_reports(after_cutoff) if after_cutoff else 0.0
+            summary = compact_ledger(cutoff_date, engine)
+            after = snapshot(as_of_dates)
+            report_ms_after = time_reports(after_cutoff) if after_cutoff else 0.0
+        engine.dispose()
+
+    return {
+        **summary,
+        "dates_compared": len(as_of_dates),
+        "mismatched_dates": [d for d in as_of_dates if not same(before[d], after[d])],
+        "report_ms_before": round(report_ms_before, 2),
+        "report_ms_after": round(report_ms_after, 2),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compact the transaction ledger into opening-balance rows")
+    parser.add_argument("cutoff", help="First day (YYYY-MM-DD) kept in full; earlier transactions are compacted")
+    parser.add_argument("--vacuum", action="store_true", help="Run VACUUM after compacting")
+    parser.add_argument("--check", action="store_true",
+                        help="Compact a temporary copy instead and check that as-of queries are unchanged")
+    parser.add_argument("--synthetic-years", type=int, default=0,
+                        help="With --check, add this many years of generated history first")
+    args = parser.parse_args()
+
+    if args.check:
+        print(json.dumps(check_compaction(args.cutoff, synthetic_years=args.synthetic_years), indent=2))
+    else:
+        print(json.dumps(compact_ledger(args.cutoff, vacuum=args.vacuum), indent=2))
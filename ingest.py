@@ -0,0 +1,527 @@
+"""
+Streaming ingestion of quote requests from JSONL or CSV files.
+
+`run_test_scenarios` loads `quote_requests_sample.csv` fully with pandas, which is fine
+for twenty requests but not for a feed of millions. `ingest_requests` reads a request
+file lazily in chunks of `chunk_size` records and dispatches them to `concurrency`
+concurrent agent runs through a bounded queue. When the agents fall behind, the reader
+blocks on the full queue instead of reading ahead, so memory stays constant however
+large the file is.
+
+Input formats, picked by file extension:
+- `.jsonl`: one JSON object per line
+- `.csv`: a header row, with quoted fields that may span lines
+
+The request text is read from the `request` field (or `response`, as in
+`quote_requests.csv`). The optional `request_date` may be MM/DD/YY or ISO; records
+without one use `default_date`. An optional `request_id` (or `id`) field names the
+request in the results; records without one are numbered by position in the file.
+Records are processed in file order. Unlike `run_test_scenarios`, the file is not
+sorted by date.
+
+Results are appended to a JSONL file, one line per request, with the record's byte
+offset. Progress is checkpointed by offset: the checkpoint is the offset below which
+every record has finished. It is written atomically every `checkpoint_every` requests,
+after the results before it are flushed to disk. After a crash, `resume=True` restarts
+reading at the checkpoint and skips the records past it that already have a result, so
+each request gets exactly one result line. A request whose agent run was interrupted
+before its result was written is run again. Its tools may already have recorded sales
+or stock orders, so every ledger row a request writes is tagged with the run's id and
+the record's offset (see `request_writes.py`), and the resume first deletes the rows
+of the requests it is about to run again. That way each request's writes are applied
+once too. Writes that bypass the shared engine aren't tagged and can't be undone.
+"""
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import json
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Set, Tuple, Union
+
+DEFAULT_REQUEST_DATE = "2025-04-01"
+DEFAULT_CHUNK_SIZE = 256
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHECKPOINT_EVERY = 100
+
+_DATE_FORMATS = ("%m/%d/%y", "%m/%d/%Y", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S")
+
+
+def _file_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension == ".csv":
+        return "csv"
+    raise ValueError(f"Unsupported request file '{path}': expected a .jsonl or .csv file")
+
+
+def _read_csv_record(f) -> bytes:
+    """Read one CSV record from a binary file, continuing across newlines inside quoted fields."""
+    record = f.readline()
+    quotes = record.count(b'"')
+    # Quotes inside fields are doubled, so an odd count means a quoted field is still open
+    while quotes % 2:
+        line = f.readline()
+        if not line:
+            break
+        record += line
+        quotes += line.count(b'"')
+    return record
+
+
+def iter_request_records(
+    path: str, start_offset: int = 0
+) -> Iterator[Tuple[int, int, Union[Dict[str, Any], ValueError]]]:
+    """
+    Lazily read the records of a JSONL or CSV request file.
+
+    Only the record being parsed is held in memory. A record that can't be parsed is
+    yielded as a ValueError, so that one bad line doesn't stop the ingestion.
+
+    Args:
+        path: The .jsonl or .csv file to read.
+        start_offset: Byte offset to start reading at. It must be the start of a record,
+                      e.g. a checkpointed offset. For CSV, the header is always read first.
+
+    Yields:
+        (offset, end_offset, record): The byte offsets of the record's start and end, and the
+        record as a dict (or a ValueError).
+
+    Raises:
+        ValueError: If the file is neither JSONL nor CSV.
+    """
+    fmt = _file_format(path)
+    with open(path, "rb") as f:
+        header = None
+        if fmt == "csv":
+            header = next(csv.reader(io.StringIO(_read_csv_record(f).decode("utf-8-sig"))), [])
+        f.seek(max(start_offset, f.tell()))
+
+        while True:
+            offset = f.tell()
+            raw = _read_csv_record(f) if fmt == "csv" else f.readline()
+            if not raw:
+                return
+            text = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+            if not text.strip():
+                continue
+            try:
+                if fmt == "csv":
+                    record: Union[Dict[str, Any], ValueError] = dict(zip(header, next(csv.reader(io.StringIO(text)))))
+                else:
+                    record = json.loads(text)
+                    if not isinstance(record, dict):
+                        raise ValueError("expected a JSON object")
+            except (ValueError, csv.Error) as e:
+                record = ValueError(f"Unparseable record at offset {offset}: {e}")
+            yield offset, f.tell(), record
+
+
+def normalize_request(record: Dict[str, Any], index: int, default_date: str = DEFAULT_REQUEST_DATE) -> Dict[str, Any]:
+    """
+    Pull the request id, text and date out of a raw record.
+
+    Args:
+        record: A record from `iter_request_records`.
+        index: Position of the record in the file (1-based), used when it has no id.
+        default_date: Date (YYYY-MM-DD) for records without a request_date.
+
+    Returns:
+        Dict with request_id, request_date (YYYY-MM-DD) and request.
+
+    Raises:
+        ValueError: If the record has no request text or an unrecognized date.
+    """
+    text = record.get("request") or record.get("response")
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Record has no 'request' text")
+
+    raw_date = record.get("request_date")
+    if raw_date in (None, ""):
+        request_date = default_date
+    else:
+        for fmt in _DATE_FORMATS:
+            try:
+                request_date = datetime.strptime(str(raw_date).strip(), fmt).strftime("%Y-%m-%d")
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"Unrecognized request_date '{raw_date}'")
+
+    return {
+        "request_id": record.get("request_id", record.get("id", index)),
+        "request_date": request_date,
+        "request": text.strip(),
+    }
+
+
+class _Watermark:
+    """Offset below which every dispatched record has finished, advanced as records complete out of order."""
+
+    def __init__(self, offset: int, records: int):
+        self.offset = offset
+        self.records = records
+        self._pending: "OrderedDict[int, list]" = OrderedDict()
+
+    def add(self, offset: int, end_offset: int, index: int, done: bool = False) -> None:
+        self._pending[offset] = [end_offset, index, done]
+        self._advance()
+
+    def complete(self, offset: int) -> None:
+        self._pending[offset][2] = True
+        self._advance()
+
+    def _advance(self) -> None:
+        while self._pending:
+            offset, (end_offset, index, done) = next(iter(self._pending.items()))
+            if not done:
+                return
+            del self._pending[offset]
+            self.offset, self.records = end_offset, index
+
+
+def load_checkpoint(checkpoint_path: str) -> Optional[Dict[str, Any]]:
+    """Return the saved checkpoint, or None if there is none."""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def _save_checkpoint(checkpoint_path: str, checkpoint: Dict[str, Any]) -> None:
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _finished_offsets(output_path: str, from_offset: int) -> Set[int]:
+    """
+    Offsets at or past `from_offset` that already have a result line.
+
+    A partial trailing line left by a crash is cut off first, so that appending after it
+    can't corrupt the file. Only offsets past the checkpoint are kept, which is at most
+    the records that were in flight.
+    """
+    if not os.path.exists(output_path):
+        return set()
+
+    finished: Set[int] = set()
+    with open(output_path, "rb+") as f:
+        complete_size = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            complete_size += len(line)
+            offset = json.loads(line)["offset"]
+            if offset >= from_offset:
+                finished.add(offset)
+        f.truncate(complete_size)
+    return finished
+
+
+async def ingest_requests(
+    path: str,
+    agent=None,
+    output_path: Optional[str] = None,
+    checkpoint_path: Optional[str] = None,
+    resume: bool = False,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+    default_date: str = DEFAULT_REQUEST_DATE,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Stream the requests in a JSONL or CSV file through an agent, with backpressure and checkpoints.
+
+    Args:
+        path: Request file (.jsonl or .csv).
+        agent: Anything with an async `run(prompt)` whose result has `.output`, e.g. the
+               orchestration agent, a `ModelRouter` or a `CachedAgent`. Defaults to the
+               orchestration agent.
+        output_path: JSONL file that results are appended to. Defaults to `<path>.results.jsonl`.
+        checkpoint_path: Checkpoint file. Defaults to `<path>.checkpoint.json`.
+        resume: If True, continue from the checkpoint. Otherwise, start over and replace
+                the results and checkpoint files.
+        concurrency: Agent runs in flight at once.
+        queue_size: Most records read ahead of the agent runs.
+        chunk_size: Records read from the file per read.
+        checkpoint_every: Requests finished between checkpoints.
+        default_date: Date (YYYY-MM-DD) for records without a request_date.
+        limit: Stop after dispatching this many requests (the run can be resumed later).
+
+    Returns:
+        Dict with the counts of processed, failed and skipped requests, the checkpointed
+        offset and record count, the elapsed time and the throughput.
+
+    Raises:
+        ValueError: If the file is neither JSONL nor CSV, or if `resume` is set and the
+                    checkpoint belongs to a different file.
+    """
+    import time
+
+    from request_writes import rollback_request_writes, tagged_requests, tagging_writes
+
+    _file_format(path)
+    if concurrency < 1 or queue_size < 1 or chunk_size < 1:
+        raise ValueError("concurrency, queue_size and chunk_size must be at least 1")
+    output_path = output_path or f"{path}.results.jsonl"
+    checkpoint_path = checkpoint_path or f"{path}.checkpoint.json"
+    if agent is None:
+        from inventory_agents import build_agents
+
+        agent = build_agents()["orchestration_agent"]
+
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if checkpoint is not None and checkpoint["source"] != os.path.abspath(path):
+        raise ValueError(f"Checkpoint {checkpoint_path} is for {checkpoint['source']}, not {path}")
+    if checkpoint is None:
+        for stale in (output_path, checkpoint_path):
+            if os.path.exists(stale):
+                os.remove(stale)
+        checkpoint = {
+            "source": os.path.abspath(path),
+            "run_id": uuid.uuid4().hex,
+            "offset": 0,
+            "records": 0,
+            "processed": 0,
+            "errors": 0,
+        }
+        # Saved up front, so a resume can find the writes tagged with this run's id
+        _save_checkpoint(checkpoint_path, checkpoint)
+    else:
+        print(f"Resuming {path} at offset {checkpoint['offset']} ({checkpoint['records']} records done)")
+    # Checkpoints written before writes were tagged have no run id; nothing to roll back for them
+    checkpoint.setdefault("run_id", uuid.uuid4().hex)
+    key_prefix = f"ingest:{checkpoint['run_id']}:"
+
+    finished = _finished_offsets(output_path, checkpoint["offset"])
+    if resume:
+        # Requests that wrote to the ledger but have no result were interrupted; undo their writes
+        interrupted = {
+            key for key in tagged_requests(key_prefix)
+            if int(key[len(key_prefix):]) >= checkpoint["offset"] and int(key[len(key_prefix):]) not in finished
+        }
+        if interrupted:
+            rolled_back = rollback_request_writes(interrupted)
+            print(f"Rolled back {rolled_back} transaction(s) of {len(interrupted)} interrupted request(s)")
+    watermark = _Watermark(checkpoint["offset"], checkpoint["records"])
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    stats = {"processed": 0, "errors": 0, "skipped": 0}
+    output = open(output_path, "a")
+
+    def save_checkpoint() -> None:
+        # Results must be on disk before the checkpoint moves past them
+        output.flush()
+        os.fsync(output.fileno())
+        _save_checkpoint(checkpoint_path, {
+            **checkpoint,
+            "offset": watermark.offset,
+            "records": watermark.records,
+            "processed": checkpoint["processed"] + stats["processed"],
+            "errors": checkpoint["errors"] + stats["errors"],
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        })
+
+    async def read() -> None:
+        records = iter_request_records(path, checkpoint["offset"])
+        index = checkpoint["records"]
+        dispatched = 0
+
+        def next_chunk():
+            chunk = []
+            for entry in records:
+                chunk.append(entry)
+                if len(chunk) == chunk_size:
+                    break
+            return chunk
+
+        try:
+            while limit is None or dispatched < limit:
+                chunk = await asyncio.to_thread(next_chunk)
+                if not chunk:
+                    break
+                for offset, end_offset, record in chunk:
+                    index += 1
+                    if offset in finished:
+                        watermark.add(offset, end_offset, index, done=True)
+                        stats["skipped"] += 1
+                        continue
+                    if limit is not None and dispatched >= limit:
+                        break
+                    watermark.add(offset, end_offset, index)
+                    # Blocks while the queue is full: the agents set the pace, not the file
+                    await queue.put((offset, index, record))
+                    dispatched += 1
+        finally:
+            records.close()
+            for _ in range(concurrency):
+                await queue.put(None)
+
+    async def work() -> None:
+        while (item := await queue.get()) is not None:
+            offset, index, record = item
+            result = {"offset": offset, "request_id": index, "request_date": None, "response": None, "error": None}
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                request = normalize_request(record, index, default_date)
+                result.update(request_id=request["request_id"], request_date=request["request_date"])
+                with tagging_writes(f"{key_prefix}{offset}"):
+                    run = await agent.run(f"{request['request']} (Date of request: {request['request_date']})")
+                result["response"] = str(run.output)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                stats["errors"] += 1
+
+            output.write(json.dumps(result) + "\n")
+            watermark.complete(offset)
+            stats["processed"] += 1
+            if stats["processed"] % checkpoint_every == 0:
+                save_checkpoint()
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(read(), *(work() for _ in range(concurrency)))
+    finally:
+        # Also on cancellation or a crash in the pipeline: keep whatever finished
+        save_checkpoint()
+        output.close()
+    elapsed = time.perf_counter() - started
+
+    return {
+        **stats,
+        "offset": watermark.offset,
+        "records": watermark.records,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(stats["processed"] / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def benchmark_ingestion(
+    n_requests: int = 10000,
+    latency_s: float = 0.0,
+    concurrency: int = 32,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> Dict[str, Any]:
+    """
+    Stream a generated request file through a stub agent, crash halfway, and resume.
+
+    The file repeats the requests of `quote_requests.csv` as JSONL. A scripted FunctionModel
+    stands in for the LLM and answers each request after `latency_s` seconds. The first
+    run stops after half the requests, as if it crashed; the second resumes from the
+    checkpoint. Memory is measured as the growth of the process's peak RSS over both runs,
+    which stays flat as `n_requests` grows.
+
+    Args:
+        n_requests: Requests in the generated file.
+        latency_s: Simulated latency of each agent run.
+        concurrency: Agent runs in flight.
+        queue_size: Read-ahead bound of the pipeline.
+
+    Returns:
+        Dict with the file size, throughput, peak RSS growth, and whether every
+        request got exactly one result.
+    """
+    import resource
+    import tempfile
+    import time
+
+    import pandas as pd
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import ModelResponse, TextPart
+    from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+    async def respond(messages, info: AgentInfo) -> ModelResponse:
+        if latency_s:
+            await asyncio.sleep(latency_s)
+        return ModelResponse(parts=[TextPart("Quote prepared.")])
+
+    agent = Agent(FunctionModel(respond))
+    requests = pd.read_csv("quote_requests.csv")["response"].dropna().tolist()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "requests.jsonl")
+        with open(path, "w") as f:
+            for i in range(n_requests):
+                f.write(json.dumps({"request_id": i + 1, "request": requests[i % len(requests)]}) + "\n")
+
+        options = dict(agent=agent, concurrency=concurrency, queue_size=queue_size)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        first = asyncio.run(ingest_requests(path, limit=n_requests // 2, **options))
+        second = asyncio.run(ingest_requests(path, resume=True, **options))
+        elapsed = time.perf_counter() - started
+        # ru_maxrss is in KiB on Linux
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+        with open(f"{path}.results.jsonl") as f:
+            ids = [json.loads(line)["request_id"] for line in f]
+        file_mb = os.path.getsize(path) / 1e6
+
+    return {
+        "requests": n_requests,
+        "file_mb": round(file_mb, 1),
+        "first_run_processed": first["processed"],
+        "resumed_run_processed": second["processed"],
+        "exactly_once": sorted(ids) == list(range(1, n_requests + 1)),
+        "requests_per_s": round(n_requests / elapsed, 1),
+        "peak_rss_growth_mb": round(rss_growth / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stream quote requests from a JSONL or CSV file through the agents")
+    parser.add_argument("path", nargs="?", help="Request file (.jsonl or .csv)")
+    parser.add_argument("--output", help="Results file (default: <path>.results.jsonl)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <path>.checkpoint.json)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Agent runs in flight (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"Most requests read ahead (default: {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--limit", type=int, help="Stop after this many requests")
+    parser.add_argument("--default-date", default=DEFAULT_REQUEST_DATE,
+                        help=f"Date for requests without one (default: {DEFAULT_REQUEST_DATE})")
+    parser.add_argument("--route", action="store_true", help="Route requests between a fast and a strong model")
+    parser.add_argument("--cache", action="store_true", help="Answer near-duplicate requests from a cache")
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="Instead, stream N generated requests through a stub agent, with a crash and resume")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub agent latency for --benchmark (default: 0)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark_ingestion(args.benchmark, args.latency, args.concurrency, args.queue_size), indent=2))
+    elif args.path is None:
+        parser.error("a request file is required unless --benchmark is given")
+    else:
+        agent = None
+        if args.route:
+            from routing import ModelRouter
+
+            agent = ModelRouter()
+        if args.cache:
+            from inventory_agents import build_agents
+            from request_cache import CachedAgent
+
+            agent = CachedAgent(agent or build_agents()["orchestration_agent"])
+
+        report = asyncio.run(ingest_requests(
+            args.path, agent=agent, output_path=args.output, checkpoint_path=args.checkpoint,
+            resume=args.resume, concurrency=args.concurrency, queue_size=args.queue_size,
+            limit=args.limit, default_date=args.default_date,
+        ))
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,983 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional
+
+from pydantic import BaseModel
+
+from project_starter import (
+    create_transaction,
+    get_all_inventory,
+    get_cash_balance,
+    get_inventory_items,
+    get_stock_level,
+    get_quote_facet_counts,
+    get_quote_facet_stats,
+    get_supplier_delivery_date,
+    search_quote_history,
+)
+
+# pydantic_ai (and the OpenAI client it pulls in) is only imported when the
+# agents are actually built, so the tool functions and schemas below can be
+# used from scripts and workers without loading the LLM stack.
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+
+#Set up and load your env parameters and instantiate your model.
+
+def load_env() -> None:
+    """Load environment variables from the project's `.env` file, if present."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+def get_model_name() -> str:
+    """
+    Return the model name used for agent instantiation.
+
+    Reads `OPENAI_MODEL` from the environment (after loading `.env`) and falls
+    back to gpt-4.1-nano if it is not set.
+    """
+    load_env()
+    return os.getenv("OPENAI_MODEL", "gpt-4.1-nano")
+
+
+# Transactions recorded by the tools in the current context (including delegated
+# sub-agent runs), for callers that want to know what a run wrote
+_write_log: ContextVar[Optional[List[Dict]]] = ContextVar("write_log", default=None)
+
+@contextmanager
+def recording_writes():
+    """
+    Collect the transactions the tools record while the block runs.
+
+    Yields:
+        List of dicts with transaction_type, item_name, quantity, price and date,
+        appended in the order the tools wrote them.
+    """
+    writes: List[Dict] = []
+    token = _write_log.set(writes)
+    try:
+        yield writes
+    finally:
+        _write_log.reset(token)
+
+def _record_write(transaction_type: str, item_name: str, quantity: int, price: float, date: str) -> None:
+    writes = _write_log.get()
+    if writes is not None:
+        writes.append({
+            "transaction_type": transaction_type,
+            "item_name": item_name,
+            "quantity": quantity,
+            "price": price,
+            "date": date,
+        })
+
+
+"""Set up tools for your agents to use, these should be methods that combine the database functions above
+ and apply criteria to them to ensure that the flow of the system is correct. Use Pydantic AI framework for your tools."""
+
+
+# Tools for inventory agent
+
+class CheckStockInput(BaseModel):
+    """Input for checking stock level of a specific item."""
+    item_name: str
+    as_of_date: str
+
+class StockLevelOutput(BaseModel):
+    """Output containing stock level information."""
+    item_name: str
+    current_stock: int
+
+def check_stock_level(data: CheckStockInput) -> StockLevelOutput:
+    """
+    Check the current stock level of a specific item as of a given date.
+    
+    Args:
+        data: Contains item_name and as_of_date (ISO format YYYY-MM-DD)
+    
+    Returns:
+        Stock level information including item name and current stock count
+    """
+    stock_df = get_stock_level(data.item_name, data.as_of_date)
+    stock = int(stock_df["current_stock"].iloc[0]) if not stock_df.empty else 0
+    return StockLevelOutput(item_name=data.item_name, current_stock=stock)
+
+class GetAllInventoryInput(BaseModel):
+    """Input for getting all inventory items."""
+    as_of_date: str
+
+class InventoryOutput(BaseModel):
+    """Output containing all inventory items with stock levels."""
+    inventory: Dict[str, int]
+
+def get_all_inventory_items(data: GetAllInventoryInput) -> InventoryOutput:
+    """
+    Get all inventory items with their stock levels as of a given date.
+    Only returns items with positive stock.
+    
+    Args:
+        data: Contains as_of_date (ISO format YYYY-MM-DD)
+    
+    Returns:
+        Dictionary mapping item names to their stock levels
+    """
+    inventory = get_all_inventory(data.as_of_date)
+    return InventoryOutput(inventory=inventory)
+
+# Fields that list_inventory_items can project
+InventoryField = Literal["item_name", "stock", "category", "unit_price", "min_stock_level"]
+
+class ListInventoryInput(BaseModel):
+    """Input for listing inventory items with filters, field projection and pagination.
+
+    category: 'paper', 'product', 'large_format' or 'specialty'.
+    fields: Any of 'item_name', 'stock', 'category', 'unit_price', 'min_stock_level'.
+    """
+    as_of_date: str
+    category: Optional[str] = None
+    name_prefix: Optional[str] = None
+    low_stock_only: bool = False
+    fields: List[InventoryField] = ["item_name", "stock"]
+    offset: int = 0
+    limit: int = 20
+
+class InventoryPageOutput(BaseModel):
+    """Output containing one page of inventory items."""
+    items: List[Dict[str, Any]]
+    total: int
+    next_offset: Optional[int] = None
+
+def list_inventory_items(data: ListInventoryInput) -> InventoryPageOutput:
+    """
+    List inventory items as of a given date, filtered and paginated to keep the output small.
+    Only items with positive stock are listed, unless low_stock_only is set, which lists
+    items below their minimum stock level (including items that are out of stock).
+    
+    Args:
+        data: Contains as_of_date (ISO format YYYY-MM-DD), optional category, name_prefix
+              and low_stock_only filters, the fields to return, and offset/limit for paging
+    
+    Returns:
+        The requested page of items, the total number of matches and the next offset (if any)
+    """
+    items = get_inventory_items(
+        data.as_of_date,
+        category=data.category,
+        name_prefix=data.name_prefix,
+        low_stock_only=data.low_stock_only,
+    )
+    page = items[data.offset:data.offset + data.limit]
+    next_offset = data.offset + data.limit if data.offset + data.limit < len(items) else None
+    return InventoryPageOutput(
+        items=[{f: item[f] for f in data.fields} for item in page],
+        total=len(items),
+        next_offset=next_offset,
+    )
+
+
+# Tools for quoting agent
+
+class SearchQuotesInput(BaseModel):
+    """Input for searching quote history, optionally restricted to facet values."""
+    search_terms: List[str]
+    limit: int = 5
+    job_type: Optional[str] = None
+    order_size: Optional[str] = None  # 'small', 'medium' or 'large'
+    event_type: Optional[str] = None
+
+    def facets(self) -> Dict[str, Optional[str]]:
+        return {"job_type": self.job_type, "order_size": self.order_size, "event_type": self.event_type}
+
+class QuoteResult(BaseModel):
+    """Result from a quote search."""
+    original_request: str
+    total_amount: float
+    quote_explanation: str
+    job_type: str
+    order_size: str
+    event_type: str
+    order_date: str
+
+class FacetPriceStats(BaseModel):
+    """Price statistics of all historical quotes with one facet value."""
+    facet: str
+    value: str
+    quotes: int
+    median_total: float
+    discounted_share: float
+    avg_discount_pct: float
+
+class SearchQuotesOutput(BaseModel):
+    """Output containing matching quotes, match counts per facet value and price stats for the filtered facets."""
+    quotes: List[QuoteResult]
+    facet_counts: Dict[str, Dict[str, int]] = {}
+    price_stats: List[FacetPriceStats] = []
+
+def search_historical_quotes(data: SearchQuotesInput) -> SearchQuotesOutput:
+    """
+    Search for historical quotes matching the provided search terms.
+    Searches both customer requests and quote explanations.
+    
+    Args:
+        data: Contains search_terms (list of keywords), optional limit (default 5)
+              and optional job_type, order_size and event_type facet filters
+    
+    Returns:
+        List of matching quotes with their details, how many matches each facet value
+        has, and the median total and discount rate of each filtered facet value
+    """
+    facets = data.facets()
+    results = search_quote_history(data.search_terms, data.limit, **facets)
+    quotes = [
+        QuoteResult(
+            original_request=r.get("original_request", ""),
+            total_amount=float(r.get("total_amount", 0.0)),
+            quote_explanation=r.get("quote_explanation", ""),
+            job_type=r.get("job_type", ""),
+            order_size=r.get("order_size", ""),
+            event_type=r.get("event_type", ""),
+            order_date=str(r.get("order_date", ""))
+        )
+        for r in results
+    ]
+    return SearchQuotesOutput(quotes=quotes, **_facet_summary(data.search_terms, facets))
+
+def _facet_summary(search_terms: List[str], facets: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """Match counts per facet value, and price stats of the filtered facet values, for a quote search."""
+    price_stats = [
+        FacetPriceStats(**{k: row[k] for k in FacetPriceStats.model_fields})
+        for facet, value in facets.items() if value
+        for row in get_quote_facet_stats(facet, value)
+    ]
+    return {"facet_counts": get_quote_facet_counts(search_terms, **facets), "price_stats": price_stats}
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Collapse whitespace and cut text at a word boundary to at most max_chars characters."""
+    text = " ".join(str(text).split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut + "..."
+
+class SearchQuoteSummariesInput(SearchQuotesInput):
+    """Input for searching quote history with truncated text fields."""
+    max_chars: int = 160
+
+class QuoteSummary(BaseModel):
+    """Compact result from a quote search."""
+    total_amount: float
+    job_type: str
+    order_size: str
+    event_type: str
+    request_summary: str
+    explanation_summary: str
+
+class SearchQuoteSummariesOutput(BaseModel):
+    """Output containing compact summaries of matching quotes, match counts per facet value and price stats for the filtered facets."""
+    quotes: List[QuoteSummary]
+    facet_counts: Dict[str, Dict[str, int]] = {}
+    price_stats: List[FacetPriceStats] = []
+
+def search_quote_summaries(data: SearchQuoteSummariesInput) -> SearchQuoteSummariesOutput:
+    """
+    Search for historical quotes matching the provided search terms, returning compact summaries.
+    Like search_historical_quotes, but the original request and quote explanation are
+    truncated to max_chars characters each.
+    
+    Args:
+        data: Contains search_terms (list of keywords), optional limit (default 5),
+              optional job_type, order_size and event_type facet filters
+              and max_chars per text field (default 160)
+    
+    Returns:
+        List of matching quotes with amounts, metadata and truncated text, how many
+        matches each facet value has, and the median total and discount rate of each
+        filtered facet value
+    """
+    facets = data.facets()
+    results = search_quote_history(data.search_terms, data.limit, **facets)
+    quotes = [
+        QuoteSummary(
+            total_amount=float(r.get("total_amount", 0.0)),
+            job_type=r.get("job_type", ""),
+            order_size=r.get("order_size", ""),
+            event_type=r.get("event_type", ""),
+            request_summary=truncate_text(r.get("original_request", ""), data.max_chars),
+            explanation_summary=truncate_text(r.get("quote_explanation", ""), data.max_chars),
+        )
+        for r in results
+    ]
+    return SearchQuoteSummariesOutput(quotes=quotes, **_facet_summary(data.search_terms, facets))
+
+
+# Tools for ordering agent
+
+class CreateTransactionInput(BaseModel):
+    """Input for creating a transaction.
+    
+    transaction_type: Must be 'stock_orders' (or 'stock_order', 'order', 'purchase', 'buy') 
+                      for purchasing inventory, or 'sales' (or 'sale', 'sell') for customer sales.
+    """
+    item_name: str
+    transaction_type: str  # 'stock_orders' or 'sales' (case-insensitive, accepts variations)
+    quantity: int
+    price: float
+    date: str  # ISO format YYYY-MM-DD
+
+class TransactionOutput(BaseModel):
+    """Output from creating a transaction."""
+    transaction_id: int
+    message: str
+
+async def create_order_transaction(data: CreateTransactionInput) -> TransactionOutput:
+    """
+    Create a new transaction (stock order or sale) in the database.
+
+    Sales only go through if enough unreserved stock is available at the time of writing;
+    otherwise the model is asked to retry (e.g. with a smaller quantity or after a stock
+    order). Goes through the write-behind queue when a `TransactionWriter` is running.
+    
+    Args:
+        data: Contains item_name, transaction_type, quantity, price, and date
+    
+    Returns:
+        Transaction ID and confirmation message
+    """
+    # Normalize transaction type (handle common variations)
+    transaction_type = data.transaction_type.lower().strip()
+    
+    # Map common variations to correct values
+    type_mapping = {
+        "stock_order": "stock_orders",
+        "stock_orders": "stock_orders",
+        "order": "stock_orders",
+        "purchase": "stock_orders",
+        "buy": "stock_orders",
+        "sale": "sales",
+        "sales": "sales",
+        "sell": "sales"
+    }
+    
+    if transaction_type not in type_mapping:
+        raise ValueError(
+            f"Invalid transaction type: '{data.transaction_type}'. "
+            f"Must be one of: 'stock_orders' (or 'stock_order', 'order', 'purchase') "
+            f"or 'sales' (or 'sale', 'sell')"
+        )
+    
+    normalized_type = type_mapping[transaction_type]
+    
+    from pydantic_ai import ModelRetry
+    from reservations import create_sale
+    from transaction_queue import active_writer
+
+    writer = active_writer()
+    try:
+        if writer is not None:
+            transaction_id = await writer.submit(
+                data.item_name, normalized_type, data.quantity, data.price, data.date
+            )
+        elif normalized_type == "sales":
+            transaction_id = await asyncio.to_thread(
+                create_sale, data.item_name, data.quantity, data.price, data.date
+            )
+        else:
+            transaction_id = await asyncio.to_thread(
+                create_transaction,
+                item_name=data.item_name,
+                transaction_type=normalized_type,
+                quantity=data.quantity,
+                price=data.price,
+                date=data.date
+            )
+    except ValueError as e:
+        if "Insufficient stock" in str(e):
+            raise ModelRetry(str(e)) from e
+        raise
+    _record_write(normalized_type, data.item_name, data.quantity, data.price, data.date)
+    return TransactionOutput(
+        transaction_id=transaction_id,
+        message=f"Successfully created {normalized_type} transaction for {data.item_name}"
+    )
+
+class ReserveStockInput(BaseModel):
+    """Input for holding stock for a customer until the sale is recorded."""
+    item_name: str
+    quantity: int
+    request_date: str  # ISO format YYYY-MM-DD
+    price: float = 0.0  # total price quoted for the held units
+
+class ReservationOutput(BaseModel):
+    """Output from reserving stock."""
+    reservation_id: int
+    message: str
+
+def reserve_item_stock(data: ReserveStockInput) -> ReservationOutput:
+    """
+    Hold stock of an item for a customer so concurrent requests can't sell it.
+    Holds expire after 15 minutes unless committed or released.
+
+    Args:
+        data: Contains item_name, quantity, request_date, and the quoted total price
+
+    Returns:
+        Reservation ID and confirmation message
+    """
+    from pydantic_ai import ModelRetry
+    from reservations import reserve_stock
+
+    try:
+        reservation_id = reserve_stock(data.item_name, data.quantity, data.request_date, data.price)
+    except ValueError as e:
+        raise ModelRetry(str(e)) from e
+    return ReservationOutput(
+        reservation_id=reservation_id,
+        message=f"Reserved {data.quantity} units of {data.item_name}"
+    )
+
+class ReservationIdInput(BaseModel):
+    """Input identifying a stock reservation."""
+    reservation_id: int
+
+def commit_stock_reservation(data: ReservationIdInput) -> TransactionOutput:
+    """
+    Record the sale for a held reservation, at the price given when reserving.
+
+    Args:
+        data: Contains reservation_id
+
+    Returns:
+        Sales transaction ID and confirmation message
+    """
+    from pydantic_ai import ModelRetry
+    from reservations import commit_reservation, get_reservation
+
+    try:
+        transaction_id = commit_reservation(data.reservation_id)
+    except ValueError as e:
+        raise ModelRetry(str(e)) from e
+    held = get_reservation(data.reservation_id)
+    _record_write("sales", held["item_name"], held["units"], held["price"], held["request_date"])
+    return TransactionOutput(
+        transaction_id=transaction_id,
+        message=f"Recorded sale for reservation {data.reservation_id}"
+    )
+
+class ReleaseOutput(BaseModel):
+    """Output from releasing a stock reservation."""
+    released: bool
+
+def release_stock_reservation(data: ReservationIdInput) -> ReleaseOutput:
+    """
+    Release a held reservation when the customer's order won't go ahead.
+
+    Args:
+        data: Contains reservation_id
+
+    Returns:
+        Whether the hold was still active and has been released
+    """
+    from reservations import release_reservation
+
+    return ReleaseOutput(released=release_reservation(data.reservation_id))
+
+class CashBalanceInput(BaseModel):
+    """Input for checking cash balance."""
+    as_of_date: str
+
+class CashBalanceOutput(BaseModel):
+    """Output containing cash balance."""
+    cash_balance: float
+    as_of_date: str
+
+def get_cash_balance_info(data: CashBalanceInput) -> CashBalanceOutput:
+    """
+    Get the current cash balance as of a given date.
+    Calculated as total sales revenue minus total stock purchase costs.
+    
+    Args:
+        data: Contains as_of_date (ISO format YYYY-MM-DD)
+    
+    Returns:
+        Cash balance amount and the date it's calculated for
+    """
+    balance = get_cash_balance(data.as_of_date)
+    return CashBalanceOutput(cash_balance=balance, as_of_date=data.as_of_date)
+
+class DeliveryDateInput(BaseModel):
+    """Input for checking supplier delivery date."""
+    input_date: str  # ISO format YYYY-MM-DD
+    quantity: int
+
+class DeliveryDateOutput(BaseModel):
+    """Output containing estimated delivery date."""
+    delivery_date: str
+    input_date: str
+    quantity: int
+
+def check_delivery_date(data: DeliveryDateInput) -> DeliveryDateOutput:
+    """
+    Estimate the supplier delivery date based on order quantity.
+    Lead times: ≤10 units (same day), 11-100 (1 day), 101-1000 (4 days), >1000 (7 days).
+    
+    Args:
+        data: Contains input_date (ISO format) and quantity
+    
+    Returns:
+        Estimated delivery date, input date, and quantity
+    """
+    delivery_date = get_supplier_delivery_date(data.input_date, data.quantity)
+    return DeliveryDateOutput(
+        delivery_date=delivery_date,
+        input_date=data.input_date,
+        quantity=data.quantity
+    )
+
+
+# Delegation tools for orchestration agent
+
+# An unknown agent fails validation, which is sent back to the model as a retry
+SubtaskAgent = Literal["inventory", "quoting", "ordering"]
+
+class Subtask(BaseModel):
+    """A task for one specialized agent.
+
+    agent: 'inventory', 'quoting' or 'ordering'.
+    task: Self-contained instructions, including any dates (YYYY-MM-DD) and quantities.
+    """
+    agent: SubtaskAgent
+    task: str
+
+class DelegateInput(BaseModel):
+    """Input for delegating independent subtasks to the specialized agents."""
+    subtasks: List[Subtask]
+
+class SubtaskResult(BaseModel):
+    """Result of one delegated subtask."""
+    agent: str
+    task: str
+    output: str
+
+class DelegateOutput(BaseModel):
+    """Output containing the result of every delegated subtask, in request order."""
+    results: List[SubtaskResult]
+
+def make_delegate_subtasks(sub_agents: Dict[str, Agent]):
+    """
+    Build the delegate_subtasks tool for a set of specialized agents.
+
+    Args:
+        sub_agents: The inventory, quoting and ordering agents, keyed by 'inventory',
+                    'quoting' and 'ordering'
+
+    Returns:
+        An async tool function taking (ctx, DelegateInput); register it with takes_ctx=True
+    """
+    async def delegate_subtasks(ctx, data: DelegateInput) -> DelegateOutput:
+        """
+        Delegate independent subtasks to the inventory, quoting and ordering agents, all at once.
+        The subtasks run concurrently, so only batch subtasks that don't depend on each other
+        (e.g. stock checks for several items and a historical quote search). Subtasks that
+        depend on earlier results, such as recording a sale after checking stock, belong in
+        a later call.
+        
+        Args:
+            data: Contains subtasks, each with agent ('inventory', 'quoting' or 'ordering')
+                  and a self-contained task description
+        
+        Returns:
+            The output of each subtask, in the order given
+        """
+        # Sub-runs add their requests and tokens to the orchestrator's usage
+        outputs = await asyncio.gather(
+            *(sub_agents[s.agent].run(s.task, usage=ctx.usage) for s in data.subtasks),
+            return_exceptions=True,
+        )
+        return DelegateOutput(results=[
+            SubtaskResult(
+                agent=s.agent,
+                task=s.task,
+                output=f"Error: {out}" if isinstance(out, Exception) else str(out.output),
+            )
+            for s, out in zip(data.subtasks, outputs)
+        ])
+
+    return delegate_subtasks
+
+
+# Message-history compaction
+
+# Tool results longer than this are truncated once the model has already seen them
+COMPACT_TOOL_RETURN_CHARS = 300
+
+def compact_tool_history(messages: list) -> list:
+    """
+    Truncate tool results from earlier turns of a run before they are re-sent to the model.
+
+    The model sees each tool result in full on the turn right after the call. On later
+    turns, results longer than COMPACT_TOOL_RETURN_CHARS are replaced by a truncated copy,
+    since the model has already acted on them. Tool call ids are kept, so every tool call
+    still has its matching return.
+    
+    Args:
+        messages: The run's message history (list of pydantic-ai ModelMessage)
+    
+    Returns:
+        The compacted message history
+    """
+    from dataclasses import replace
+
+    from pydantic_ai.messages import ModelRequest, ToolReturnPart
+
+    last_request = max((i for i, m in enumerate(messages) if isinstance(m, ModelRequest)), default=-1)
+    compacted = []
+    for i, message in enumerate(messages):
+        if isinstance(message, ModelRequest) and i != last_request:
+            parts = []
+            for part in message.parts:
+                if isinstance(part, ToolReturnPart):
+                    content = part.model_response_str()
+                    if len(content) > COMPACT_TOOL_RETURN_CHARS:
+                        part = replace(part, content=truncate_text(content, COMPACT_TOOL_RETURN_CHARS) + " [truncated]")
+                parts.append(part)
+            message = replace(message, parts=parts)
+        compacted.append(message)
+    return compacted
+
+def _history_compaction_kwargs() -> Dict[str, Any]:
+    """Agent keyword arguments that install compact_tool_history for the installed pydantic-ai version."""
+    try:
+        from pydantic_ai.capabilities import ProcessHistory
+    except ImportError:
+        # Older pydantic-ai releases take history processors directly
+        return {"history_processors": [compact_tool_history]}
+    return {"capabilities": [ProcessHistory(compact_tool_history)]}
+
+
+# Set up your agents and create an orchestration agent that will manage them.
+
+_AGENT_NAMES = ("inventory_agent", "quoting_agent", "ordering_agent", "orchestration_agent")
+
+_agents: Optional[Dict[str, Agent]] = None
+
+def build_agents(model: Optional[Any] = None) -> Dict[str, Agent]:
+    """
+    Build the inventory, quoting, ordering and orchestration agents.
+
+    The default agents use the OpenAI model from `get_model_name()`, throttled by the
+    shared rate limiter in `rate_limit.py`, and are built once and cached. Passing `model` builds a fresh, uncached set of agents on that
+    model instead (for example a pydantic_ai `TestModel` or `FunctionModel`).
+
+    Args:
+        model: Optional pydantic_ai model or model name to use for every agent.
+
+    Returns:
+        Dict[str, Agent]: The agents keyed by 'inventory_agent', 'quoting_agent',
+                          'ordering_agent' and 'orchestration_agent'.
+
+    Raises:
+        ValueError: If no model is given and OPENAI_API_KEY is not set.
+    """
+    global _agents
+    if model is None and _agents is not None:
+        return _agents
+
+    from pydantic_ai import Agent
+    from pydantic_ai.tools import Tool
+
+    use_default = model is None
+    if use_default:
+        load_env()
+        if not os.getenv("OPENAI_API_KEY"):
+            raise ValueError("OPENAI_API_KEY not found in environment variables. Please check your .env file.")
+        from rate_limit import rate_limited_openai_model
+
+        model = rate_limited_openai_model(get_model_name())
+
+    compaction = _history_compaction_kwargs()
+
+    # Inventory Agent - Handles inventory queries and stock level checks
+    inventory_agent = Agent(
+        model=model,
+        system_prompt="""You are an inventory management agent. Your role is to:
+        - Check stock levels for specific items
+        - Provide comprehensive inventory information
+        - Help determine availability of items for orders
+        - Report on inventory status as of specific dates
+
+        Always use the tools provided to get accurate, real-time inventory data.
+        Format dates as YYYY-MM-DD (ISO format).""",
+        tools=[Tool(check_stock_level), Tool(list_inventory_items)],
+        **compaction
+    )
+
+    # Quoting Agent - Handles quote generation and historical quote searches
+    quoting_agent = Agent(
+        model=model,
+        system_prompt="""You are a quoting agent. Your role is to:
+        - Search historical quotes to find similar past orders
+        - Help generate accurate quotes based on historical data
+        - Analyze quote patterns and pricing trends
+        - Provide insights from past quote requests and their outcomes
+
+        Use the search tool to find relevant historical quotes that match customer requirements.
+        Narrow the search with order_size ('small', 'medium', 'large'), event_type or job_type
+        when the request states them. The results also count the matches per facet value and
+        give the median total and discount rate of the values you filtered on.
+        This helps inform pricing and quote generation decisions.""",
+        tools=[Tool(search_quote_summaries)],
+        **compaction
+    )
+
+    # Ordering Agent - Handles order transactions, cash management, and delivery estimates
+    ordering_agent = Agent(
+        model=model,
+        system_prompt="""You are an ordering agent. Your role is to:
+        - Create transactions for stock orders and sales
+        - Check cash balance before making purchase decisions
+        - Calculate delivery dates for orders
+        - Ensure sufficient cash is available before ordering stock
+        - Record sales transactions when orders are fulfilled
+        - Reserve stock while an order is being confirmed, then commit or release it
+
+        Always check cash balance before creating stock orders.
+        Verify that the company has sufficient funds.
+        Format dates as YYYY-MM-DD (ISO format).""",
+        tools=[Tool(create_order_transaction), Tool(reserve_item_stock), Tool(commit_stock_reservation),
+               Tool(release_stock_reservation), Tool(get_cash_balance_info), Tool(check_delivery_date)],
+        **compaction
+    )
+
+    sub_agents = {"inventory": inventory_agent, "quoting": quoting_agent, "ordering": ordering_agent}
+
+    # Orchestration Agent - Coordinates between all specialized agents
+    orchestration_agent = Agent(
+        model=model,
+        system_prompt="""You are an orchestration agent managing a multi-agent inventory management system.
+
+        You coordinate three specialized agents:
+        1. **Inventory Agent**: Checks stock levels and inventory status
+        2. **Quoting Agent**: Searches historical quotes for pricing guidance
+        3. **Ordering Agent**: Creates transactions, manages cash, and calculates delivery dates
+
+        Use delegate_subtasks to hand work to these agents. Subtasks in one call run in
+        parallel, so batch everything that is independent (e.g. stock checks for every
+        requested item plus a historical quote search) into a single call.
+
+        Other requests may be selling the same items at the same time. Once you quote an
+        item that is in stock, reserve it with reserve_item_stock, then commit the
+        reservation to record the sale or release it if the order doesn't go ahead.
+
+        Your responsibilities:
+        - Route customer requests to the appropriate specialized agent
+        - Coordinate multi-step workflows that require multiple agents
+        - Ensure proper workflow: check inventory → generate quote → process order
+        - Maintain context across agent interactions
+
+        When a request comes in:
+        1. Determine which agent(s) are needed
+        2. Call the appropriate agent(s) with clear instructions
+        3. Synthesize the results into a comprehensive response
+
+        Always ensure agents have the correct date format (YYYY-MM-DD) and required parameters.""",
+        tools=[Tool(check_stock_level), Tool(list_inventory_items), Tool(search_quote_summaries),
+               Tool(create_order_transaction), Tool(reserve_item_stock), Tool(commit_stock_reservation),
+               Tool(release_stock_reservation), Tool(get_cash_balance_info), Tool(check_delivery_date),
+               Tool(make_delegate_subtasks(sub_agents), takes_ctx=True)],
+        **compaction
+    )
+
+    agents = {
+        "inventory_agent": inventory_agent,
+        "quoting_agent": quoting_agent,
+        "ordering_agent": ordering_agent,
+        "orchestration_agent": orchestration_agent,
+    }
+    if use_default:
+        _agents = agents
+    return agents
+
+def __getattr__(name: str):
+    """Build the default agents on first access to one of them by name."""
+    if name in _AGENT_NAMES:
+        return build_agents()[name]
+    if name == "DEFAULT_MODEL_NAME":
+        return get_model_name()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Token usage reporting
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English/JSON text (about 4 characters per token)."""
+    return max(1, (len(text) + 3) // 4)
+
+def report_tool_token_savings(sample_path: str = "quote_requests_sample.csv", follow_up_turns: int = 3) -> List[Dict]:
+    """
+    Estimate prompt tokens saved per request by the compact tools and history compaction.
+
+    For every request in the sample file, compares a typical inventory listing plus
+    historical quote search done with the full tools (get_all_inventory_items,
+    search_historical_quotes) against the compact ones (list_inventory_items with its
+    defaults, search_quote_summaries). Both quote searches return the same facet counts
+    and price stats, so only the quote text differs. Tool results are counted once when returned and
+    again on each of `follow_up_turns` later turns of the run; with compaction those
+    re-sends are capped at COMPACT_TOOL_RETURN_CHARS. Uses the current database state.
+
+    Args:
+        sample_path: CSV of quote requests (columns event and request_date as MM/DD/YY)
+        follow_up_turns: Number of model turns after the tool calls in a run
+
+    Returns:
+        One dictionary per request with full_tokens, compact_tokens and tokens_saved
+    """
+    import csv
+    from datetime import datetime
+
+    def run_tokens(outputs: List[str], compacted: bool) -> int:
+        total = 0
+        for output in outputs:
+            resent = output
+            if compacted and len(output) > COMPACT_TOOL_RETURN_CHARS:
+                resent = truncate_text(output, COMPACT_TOOL_RETURN_CHARS) + " [truncated]"
+            total += estimate_tokens(output) + follow_up_turns * estimate_tokens(resent)
+        return total
+
+    report = []
+    with open(sample_path, newline="") as f:
+        for request_id, row in enumerate(csv.DictReader(f), start=1):
+            try:
+                as_of_date = datetime.strptime(row["request_date"], "%m/%d/%y").strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+            terms = [row["event"]]
+
+            full = [
+                get_all_inventory_items(GetAllInventoryInput(as_of_date=as_of_date)).model_dump_json(),
+                search_historical_quotes(SearchQuotesInput(search_terms=terms)).model_dump_json(),
+            ]
+            compact = [
+                list_inventory_items(ListInventoryInput(as_of_date=as_of_date)).model_dump_json(),
+                search_quote_summaries(SearchQuoteSummariesInput(search_terms=terms)).model_dump_json(),
+            ]
+            full_tokens = run_tokens(full, compacted=False)
+            compact_tokens = run_tokens(compact, compacted=True)
+            report.append({
+                "request_id": request_id,
+                "request_date": as_of_date,
+                "full_tokens": full_tokens,
+                "compact_tokens": compact_tokens,
+                "tokens_saved": full_tokens - compact_tokens,
+            })
+    return report
+
+
+# Delegation benchmark
+
+async def benchmark_delegation(
+    item_names: Optional[List[str]] = None,
+    as_of_date: str = "2025-04-01",
+    latency_s: float = 0.2,
+) -> Dict[str, float]:
+    """
+    Measure per-request wall time of sequential vs parallel delegation with a latency-simulating stub model.
+
+    A scripted FunctionModel stands in for the LLM: every model call sleeps `latency_s`
+    seconds. The orchestrator stub handles a multi-item request by delegating one stock
+    check per item plus one historical quote search, either one subtask per turn
+    (sequential) or all in a single delegate_subtasks call (parallel). Sub-agents call
+    their real tools against the current database, then answer.
+
+    Args:
+        item_names: Items to check stock for. Defaults to the first four inventory items.
+        as_of_date: Date (YYYY-MM-DD) used for the stock checks
+        latency_s: Simulated latency of each model call, in seconds
+
+    Returns:
+        Wall time in seconds for each mode, plus the model requests counted in each
+        run's aggregated usage
+    """
+    import re
+    import time
+
+    from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart, ToolReturnPart, UserPromptPart
+    from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+    if item_names is None:
+        item_names = [item["item_name"] for item in get_inventory_items(as_of_date)[:4]]
+
+    subtasks = [
+        {"agent": "inventory", "task": f"Check the stock level of {name} as of {as_of_date}."}
+        for name in item_names
+    ] + [{"agent": "quoting", "task": "Find historical quotes for: ceremony"}]
+
+    def latest_tool_returns(messages) -> List[ToolReturnPart]:
+        return [p for p in messages[-1].parts if isinstance(p, ToolReturnPart)]
+
+    def make_model(parallel: bool) -> FunctionModel:
+        async def respond(messages, info: AgentInfo) -> ModelResponse:
+            await asyncio.sleep(latency_s)
+            tools = {t.name for t in info.function_tools}
+            returns = latest_tool_returns(messages)
+
+            if "delegate_subtasks" in tools:
+                done = sum(1 for m in messages for p in getattr(m, "parts", []) if isinstance(p, ToolReturnPart))
+                if parallel and not done:
+                    return ModelResponse(parts=[ToolCallPart("delegate_subtasks", {"subtasks": subtasks})])
+                if not parallel and done < len(subtasks):
+                    return ModelResponse(parts=[ToolCallPart("delegate_subtasks", {"subtasks": [subtasks[done]]})])
+                return ModelResponse(parts=[TextPart("Quote prepared.")])
+
+            if returns:
+                return ModelResponse(parts=[TextPart(returns[0].model_response_str())])
+            prompt = next(p.content for p in messages[0].parts if isinstance(p, UserPromptPart))
+            stock = re.match(r"Check the stock level of (.+) as of (\S+)\.", prompt)
+            if stock:
+                args = {"data": {"item_name": stock.group(1), "as_of_date": stock.group(2)}}
+                return ModelResponse(parts=[ToolCallPart("check_stock_level", args)])
+            terms = prompt.split(":", 1)[-1].strip().split()
+            return ModelResponse(parts=[ToolCallPart("search_quote_summaries", {"data": {"search_terms": terms}})])
+
+        return FunctionModel(respond)
+
+    timings = {}
+    for mode in ("sequential", "parallel"):
+        agent = build_agents(make_model(parallel=mode == "parallel"))["orchestration_agent"]
+        started = time.perf_counter()
+        result = await agent.run(f"Please quote {', '.join(item_names)} for our ceremony.")
+        timings[f"{mode}_s"] = time.perf_counter() - started
+        timings[f"{mode}_requests"] = result.usage.requests
+    return timings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline reports for the agent tools (run project_starter.py first)")
+    parser.add_argument("--delegation-benchmark", action="store_true",
+                        help="Compare sequential and parallel delegation with a latency-simulating stub model")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated model latency in seconds (default: 0.2)")
+    args = parser.parse_args()
+
+    if args.delegation_benchmark:
+        timings = asyncio.run(benchmark_delegation(latency_s=args.latency))
+        print(f"Sequential delegation: {timings['sequential_s']:.2f}s ({timings['sequential_requests']} model requests)")
+        print(f"Parallel delegation:   {timings['parallel_s']:.2f}s ({timings['parallel_requests']} model requests)")
+        print(f"Speedup: {timings['sequential_s'] / timings['parallel_s']:.1f}x")
+        raise SystemExit(0)
+
+    # Report tool-output token savings over the sample requests
+    rows = report_tool_token_savings()
+    print(f"{'request':>7}  {'date':10}  {'full':>6}  {'compact':>7}  {'saved':>6}")
+    for r in rows:
+        print(f"{r['request_id']:>7}  {r['request_date']:10}  {r['full_tokens']:>6}  {r['compact_tokens']:>7}  {r['tokens_saved']:>6}")
+    if rows:
+        full = sum(r["full_tokens"] for r in rows)
+        saved = sum(r["tokens_saved"] for r in rows)
+        print(f"\nAverage saved per request: {saved / len(rows):.0f} tokens ({saved / full:.0%} of tool-output tokens)")
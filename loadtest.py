@@ -0,0 +1,424 @@
+"""
+End-to-end load test of the orchestration agent with a scripted stand-in for the LLM.
+
+`run_load_test` builds the real agents with `build_agents(model=...)`, but the model is
+a FunctionModel that plays back a realistic tool-call sequence for each request.
+Everything else is real: tool dispatch, pydantic validation of tool arguments and
+results, the SQLite queries, and the financial report `run_test_scenarios` generates
+after each request.
+
+For each request the scripted model:
+1. Checks the stock of every catalog item the request mentions, and searches similar
+   historical quotes, in one turn.
+2. Checks the cash balance and the delivery date of every item.
+3. Records a sale for each item in stock, and a stock order for each item that isn't.
+4. Answers.
+
+Each model call sleeps `latency_s` (± `jitter`) to simulate the API. Time spent outside
+those sleeps is the orchestration overhead, and the report breaks each request's wall
+time down into:
+- model call overhead: message mapping around the stub model
+- tool calls: each turn of tool calls, which run concurrently
+- the per-request financial report, split into SQL and Python time
+- other: the agent graph, the event loop and waiting for it
+
+The tool-call time is further broken down by tool, into SQL, CPU and queue wait, and
+tool argument validation. The tools run in worker threads (sync tools directly,
+`create_order_transaction` through `asyncio.to_thread`). CPU is the worker thread's
+`time.thread_time()` while it runs the tool, so it includes SQLite's CPU but not
+waiting for the GIL. Queue wait is the time a call waits for a free worker thread.
+These are busy times summed over calls, so a turn's parallel calls can add up to more
+than its wall time.
+
+Timings are collected with pydantic-ai `Hooks` passed to each run, SQLAlchemy cursor
+events on the shared engine, a thread pool that times the calls it runs, and a
+context variable that tags SQL and thread time with the tool or report it runs under.
+
+The test reinitializes the database, like `run_test_scenarios` does.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import io
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+DEFAULT_LATENCY_S = 0.05
+
+_phase: ContextVar[str] = ContextVar("loadtest_phase", default="other")
+_DATE_RE = re.compile(r"\(Date of request: (\d{4}-\d{2}-\d{2})\)")
+
+
+class _Timings:
+    """Thread-safe accumulator of seconds and counts per category."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, category: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[category] = self.seconds.get(category, 0.0) + seconds
+            self.counts[category] = self.counts.get(category, 0) + 1
+
+
+class _TimedExecutor(ThreadPoolExecutor):
+    """Thread pool that records each call's queue wait and CPU time under the submitter's phase."""
+
+    def __init__(self, timings: _Timings, max_workers: int = 40):
+        # 40 workers, like the anyio thread limit that sync tools otherwise run under
+        super().__init__(max_workers=max_workers, thread_name_prefix="loadtest")
+        self._timings = timings
+
+    def submit(self, fn, /, *args, **kwargs):
+        phase = _phase.get()
+        queued = time.perf_counter()
+
+        def timed():
+            self._timings.add(f"queue:{phase}", time.perf_counter() - queued)
+            cpu_started = time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._timings.add(f"cpu:{phase}", time.thread_time() - cpu_started)
+
+        return super().submit(timed)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def make_scripted_model(latency_s: float = DEFAULT_LATENCY_S, jitter: float = 0.0, timings: Optional[_Timings] = None, seed: int = 0):
+    """
+    Build a FunctionModel that drives the orchestration agent through a realistic tool-call sequence.
+
+    Args:
+        latency_s: Simulated latency of each model call, in seconds.
+        jitter: Relative spread of the latency; each call sleeps latency_s * (1 ± jitter).
+        timings: Accumulator for the simulated latency (category 'llm_wait').
+        seed: Seed for the latency jitter.
+
+    Returns:
+        FunctionModel: The scripted model.
+    """
+    from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart, ToolReturnPart, UserPromptPart
+    from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+    from project_starter import paper_supplies
+    from routing import extract_items, match_catalog_item
+
+    unit_prices = {item["item_name"]: item["unit_price"] for item in paper_supplies}
+    rng = random.Random(seed)
+
+    def request_items(prompt: str) -> List[Dict[str, Any]]:
+        items: Dict[str, int] = {}
+        for quantity, description in extract_items(prompt):
+            name = match_catalog_item(description)
+            if name is not None:
+                items[name] = items.get(name, 0) + quantity
+        return [{"item_name": name, "quantity": quantity} for name, quantity in list(items.items())[:4]]
+
+    async def respond(messages, info: AgentInfo) -> ModelResponse:
+        delay = latency_s * (1 + rng.uniform(-jitter, jitter))
+        if delay > 0:
+            started = time.perf_counter()
+            await asyncio.sleep(delay)
+            if timings is not None:
+                timings.add("llm_wait", time.perf_counter() - started)
+
+        prompt = next(p.content for p in messages[0].parts if isinstance(p, UserPromptPart))
+        match = _DATE_RE.search(prompt)
+        request_date = match.group(1) if match else "2025-04-01"
+        items = request_items(prompt)
+        turn = sum(1 for m in messages if isinstance(m, ModelResponse))
+
+        if turn == 0:
+            calls = [
+                ToolCallPart("check_stock_level", {"data": {"item_name": item["item_name"], "as_of_date": request_date}})
+                for item in items
+            ]
+            terms = [item["item_name"].split()[-1] for item in items[:1]] or ["paper"]
+            calls.append(ToolCallPart("search_quote_summaries", {"data": {"search_terms": terms, "limit": 3}}))
+            return ModelResponse(parts=calls)
+
+        if turn == 1:
+            calls = [ToolCallPart("get_cash_balance_info", {"data": {"as_of_date": request_date}})]
+            calls += [
+                ToolCallPart("check_delivery_date", {"data": {"input_date": request_date, "quantity": item["quantity"]}})
+                for item in items
+            ]
+            return ModelResponse(parts=calls)
+
+        if turn == 2 and items:
+            stock = {
+                part.content.item_name: part.content.current_stock
+                for m in messages for part in getattr(m, "parts", [])
+                if isinstance(part, ToolReturnPart) and part.tool_name == "check_stock_level"
+            }
+            calls = []
+            for item in items:
+                name, quantity = item["item_name"], item["quantity"]
+                in_stock = stock.get(name, 0) >= quantity
+                price = round(unit_prices[name] * quantity * (1 if in_stock else 0.8), 2)
+                calls.append(ToolCallPart("create_order_transaction", {"data": {
+                    "item_name": name, "transaction_type": "sales" if in_stock else "stock_orders",
+                    "quantity": quantity, "price": price, "date": request_date,
+                }}))
+            return ModelResponse(parts=calls)
+
+        return ModelResponse(parts=[TextPart(f"Quote prepared for {len(items)} item(s), dated {request_date}.")])
+
+    return FunctionModel(respond)
+
+
+def _make_hooks(timings: _Timings):
+    """Hooks that time model requests, tool phases, tool argument validation and tool execution."""
+    from pydantic_ai.capabilities import Hooks
+
+    hooks = Hooks()
+
+    @hooks.on.node_run
+    async def time_tool_phase(ctx, *, node, handler):
+        if type(node).__name__ != "CallToolsNode":
+            return await handler(node)
+        # Wall time of a whole turn of tool calls, which run concurrently
+        started = time.perf_counter()
+        try:
+            return await handler(node)
+        finally:
+            timings.add("tool_phase", time.perf_counter() - started)
+
+    @hooks.on.model_request
+    async def time_model_request(ctx, *, request_context, handler):
+        started = time.perf_counter()
+        try:
+            return await handler(request_context)
+        finally:
+            timings.add("model_request", time.perf_counter() - started)
+
+    @hooks.on.tool_validate
+    async def time_tool_validate(ctx, *, call, tool_def, args, handler):
+        started = time.perf_counter()
+        try:
+            return await handler(args)
+        finally:
+            timings.add("tool_validate", time.perf_counter() - started)
+
+    @hooks.on.tool_execute
+    async def time_tool_execute(ctx, *, call, tool_def, args, handler):
+        token = _phase.set(f"tool:{call.tool_name}")
+        started = time.perf_counter()
+        try:
+            return await handler(args)
+        finally:
+            timings.add(f"tool:{call.tool_name}", time.perf_counter() - started)
+            _phase.reset(token)
+
+    return hooks
+
+
+def _load_requests(n_requests: int) -> List[str]:
+    import pandas as pd
+
+    sample = pd.read_csv("quote_requests_sample.csv")
+    sample["request_date"] = pd.to_datetime(sample["request_date"], format="%m/%d/%y", errors="coerce")
+    sample = sample.dropna(subset=["request_date"]).sort_values("request_date")
+    prompts = [
+        f"{row.request} (Date of request: {row.request_date.strftime('%Y-%m-%d')})"
+        for row in sample.itertuples()
+    ]
+    return [prompts[i % len(prompts)] for i in range(n_requests)]
+
+
+async def run_load_test(
+    n_requests: int = 1000,
+    concurrency: int = 16,
+    latency_s: float = DEFAULT_LATENCY_S,
+    jitter: float = 0.0,
+    with_report: bool = True,
+    seed: int = 0,
+    memoize: bool = True,
+) -> Dict[str, Any]:
+    """
+    Drive requests through the orchestration agent with a scripted model, and measure the overhead.
+
+    The sample requests are cycled to `n_requests` and run `concurrency` at a time on a
+    freshly initialized database.
+
+    Args:
+        n_requests: Requests to run.
+        concurrency: Requests in flight at once.
+        latency_s: Simulated latency of each model call, in seconds.
+        jitter: Relative spread of the simulated latency (0.2 means ±20%).
+        with_report: Also generate the financial report after each request, as
+                     `run_test_scenarios` does.
+        seed: Seed for the latency jitter.
+        memoize: Keep the memoization of read-only queries on (see memo.py).
+
+    Returns:
+        Dict with throughput, latency percentiles (ms), CPU ms per request, the
+        breakdown of time per request (ms) by category, and memo cache hits and misses.
+    """
+    from pydantic_ai.capabilities import UseThreadExecutor
+    from sqlalchemy import event
+
+    from inventory_agents import build_agents
+    from memo import memo_stats, memoization_enabled, set_memoization
+    from project_starter import generate_financial_report, get_engine, init_database
+
+    previous_memoization = memoization_enabled()
+    set_memoization(memoize)
+    with contextlib.redirect_stdout(io.StringIO()):
+        init_database()
+    memo_before = memo_stats()
+    timings = _Timings()
+    agent = build_agents(model=make_scripted_model(latency_s, jitter, timings, seed))["orchestration_agent"]
+    executor = _TimedExecutor(timings)
+    capabilities = [_make_hooks(timings), UseThreadExecutor(executor)]
+    prompts = _load_requests(n_requests)
+    engine = get_engine()
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("loadtest_started", []).append(time.perf_counter())
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        timings.add(f"sql:{_phase.get()}", time.perf_counter() - conn.info["loadtest_started"].pop())
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(prompt: str) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await agent.run(prompt, capabilities=capabilities)
+                if with_report:
+                    token = _phase.set("report")
+                    report_started = time.perf_counter()
+                    await asyncio.to_thread(generate_financial_report, _DATE_RE.search(prompt).group(1))
+                    timings.add("report", time.perf_counter() - report_started)
+                    _phase.reset(token)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            latencies.append(time.perf_counter() - started)
+
+    # asyncio.to_thread (async tools, the report) runs on the loop's default executor;
+    # asyncio has no public getter for it, so the previous one is restored by attribute
+    loop = asyncio.get_running_loop()
+    previous_executor = loop._default_executor
+    loop.set_default_executor(executor)
+    event.listen(engine, "before_cursor_execute", before_execute)
+    event.listen(engine, "after_cursor_execute", after_execute)
+    try:
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        # The tools' FUNC/DEBUG prints would dominate both the output and the CPU profile
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*(one(prompt) for prompt in prompts))
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    finally:
+        event.remove(engine, "before_cursor_execute", before_execute)
+        event.remove(engine, "after_cursor_execute", after_execute)
+        loop._default_executor = previous_executor
+        executor.shutdown(wait=False)
+        set_memoization(previous_memoization)
+
+    for error in errors[:3]:
+        print(f"[LOADTEST] {error}")
+
+    seconds = timings.seconds
+    tools = sorted(k for k in seconds if k.startswith("tool:"))
+    breakdown = {
+        "llm_wait": seconds.get("llm_wait", 0.0),
+        "model_call_overhead": seconds.get("model_request", 0.0) - seconds.get("llm_wait", 0.0),
+        "tool_calls": seconds.get("tool_phase", 0.0),
+    }
+    if with_report:
+        breakdown["report (sql)"] = seconds.get("sql:report", 0.0)
+        breakdown["report (python)"] = seconds.get("report", 0.0) - seconds.get("sql:report", 0.0)
+    breakdown["other"] = sum(latencies) - sum(breakdown.values())
+
+    tool_busy = {"tool_validate": seconds.get("tool_validate", 0.0)}
+    for tool in tools:
+        tool_busy[f"{tool[5:]} (sql)"] = seconds.get(f"sql:{tool}", 0.0)
+        tool_busy[f"{tool[5:]} (cpu)"] = seconds.get(f"cpu:{tool}", 0.0)
+        tool_busy[f"{tool[5:]} (queue wait)"] = seconds.get(f"queue:{tool}", 0.0)
+
+    return {
+        "requests": n_requests,
+        "errors": len(errors),
+        "concurrency": concurrency,
+        "latency_s": latency_s,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(n_requests / elapsed, 1),
+        "latency_ms": {
+            f"p{p}": round(_percentile(latencies, p) * 1000, 1) for p in (50, 90, 95, 99)
+        } | {"max": round(max(latencies) * 1000, 1)},
+        "cpu_ms_per_request": round(cpu / n_requests * 1000, 2),
+        "tool_calls": {tool[5:]: timings.counts[tool] for tool in tools},
+        "breakdown_ms_per_request": {k: round(v / n_requests * 1000, 2) for k, v in breakdown.items()},
+        "tool_busy_ms_per_request": {k: round(v / n_requests * 1000, 2) for k, v in tool_busy.items()},
+        "memo": {
+            name: {k: stats[k] - memo_before[name][k] for k in ("hits", "misses", "invalidations")}
+            for name, stats in memo_stats().items() if memoize
+        },
+    }
+
+
+def print_load_test_report(report: Dict[str, Any]) -> None:
+    """Print a `run_load_test` report as a table, with each category's share of the non-LLM time."""
+    print(f"Requests:    {report['requests']} ({report['errors']} errors), concurrency {report['concurrency']}, "
+          f"model latency {report['latency_s'] * 1000:.0f} ms")
+    print(f"Throughput:  {report['throughput_rps']} req/s over {report['elapsed_s']} s")
+    print("Latency:     " + ", ".join(f"{k} {v} ms" for k, v in report["latency_ms"].items()))
+    print(f"CPU:         {report['cpu_ms_per_request']} ms/request")
+    print(f"Tool calls:  " + ", ".join(f"{k} {v}" for k, v in report["tool_calls"].items()))
+
+    breakdown = report["breakdown_ms_per_request"]
+    non_llm = sum(v for k, v in breakdown.items() if k != "llm_wait")
+    print(f"\nWall time per request: {sum(breakdown.values()):.1f} ms, "
+          f"of which {breakdown['llm_wait']:.1f} ms simulated LLM latency")
+    print(f"{'Non-LLM time':<42}{'ms/req':>9}{'share':>8}")
+    for category, ms in sorted(breakdown.items(), key=lambda kv: -kv[1]):
+        if category != "llm_wait":
+            print(f"{category:<42}{ms:>9.2f}{ms / non_llm:>8.1%}")
+
+    print(f"\n{'Tool busy time (parallel calls overlap)':<42}{'ms/req':>9}")
+    for category, ms in sorted(report["tool_busy_ms_per_request"].items(), key=lambda kv: -kv[1]):
+        print(f"{category:<42}{ms:>9.2f}")
+
+    if report["memo"]:
+        print(f"\n{'Memoized query':<42}{'hits':>9}{'misses':>9}{'hit rate':>10}")
+        for name, stats in report["memo"].items():
+            calls = stats["hits"] + stats["misses"]
+            if calls:
+                print(f"{name:<42}{stats['hits']:>9}{stats['misses']:>9}{stats['hits'] / calls:>10.1%}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load-test the orchestration agent with a scripted model")
+    parser.add_argument("-n", type=int, default=1000, help="Requests to run (default: 1000)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight (default: 16)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY_S,
+                        help=f"Simulated seconds per model call (default: {DEFAULT_LATENCY_S})")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Relative latency spread, e.g. 0.2 (default: 0)")
+    parser.add_argument("--no-report", action="store_true", help="Skip the per-request financial report")
+    parser.add_argument("--no-memo", action="store_true", help="Turn off memoization of read-only queries")
+    args = parser.parse_args()
+
+    print_load_test_report(asyncio.run(run_load_test(
+        args.n, args.concurrency, args.latency, args.jitter, with_report=not args.no_report, memoize=not args.no_memo
+    )))
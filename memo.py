@@ -0,0 +1,265 @@
+"""
+Ledger-versioned memoization of read-only database queries.
+
+Within one request the agents often ask for the same stock level, cash balance or
+historical quotes several times. Across requests on the same date,
+`generate_financial_report` recomputes identical figures. `@memoized(*tables)` caches
+such a function's results in a bounded LRU. The cache key is the call's arguments
+plus the current version of every table the function reads.
+
+Every write to a table bumps that table's version, along with a monotonically
+increasing ledger version. A write is any INSERT, UPDATE, DELETE, REPLACE, CREATE,
+DROP or ALTER executed on an engine passed to `track_writes()`. The shared engine is
+tracked as soon as `get_engine()` creates it, so the write paths don't need to know
+about the cache. Writing to a table evicts that table's entries from every cache, and
+only those: a new sale invalidates stock levels and reports but not quote searches.
+
+The version is bumped once when the write statement runs, and again when the
+connection goes back to the pool after committing. So a result computed from data
+read before the commit is filed under a version that no later lookup uses.
+
+Only writes made through this process's tracked engines are seen, so memoization
+assumes no other process writes to the database while agents are running.
+
+Exceptions are not cached. A function that falls back to a default value on errors
+must do so outside the memoized function, or the fallback stays cached until the next
+write. Cached values are copied on the way out, so callers can modify what they get back.
+`memo_stats()` reports hits, misses, evictions and invalidations per function, and
+`set_memoization(False)` turns caching off, e.g. to benchmark without it.
+"""
+from __future__ import annotations
+
+import copy
+import functools
+import re
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Set, Tuple
+
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+
+DEFAULT_MAXSIZE = 1024
+
+# Table written by a statement; '*' when a write can't be attributed to one table
+_WRITE_RE = re.compile(
+    r"""^\s*(?:
+        INSERT(?:\s+OR\s+\w+)?\s+INTO
+        | REPLACE\s+INTO
+        | UPDATE(?:\s+OR\s+\w+)?
+        | DELETE\s+FROM
+        | (?:CREATE|DROP)\s+(?:TEMP(?:ORARY)?\s+)?(?:TABLE|VIEW)(?:\s+IF(?:\s+NOT)?\s+EXISTS)?
+        | CREATE\s+(?:UNIQUE\s+)?INDEX(?:\s+IF\s+NOT\s+EXISTS)?\s+\S+\s+ON
+        | ALTER\s+TABLE
+    )\s+[\"`\[]?(\w+)""",
+    re.IGNORECASE | re.VERBOSE,
+)
+_OTHER_WRITE_RE = re.compile(r"^\s*(?:DROP\s+INDEX|VACUUM|ATTACH|DETACH)\b", re.IGNORECASE)
+
+_lock = threading.RLock()
+_ledger_version = 0
+_table_versions: Dict[str, int] = {}
+_caches: List["_MemoCache"] = []
+_enabled = True
+_MISSING = object()
+
+
+def written_tables(statement: str) -> Set[str]:
+    """Return the tables a SQL statement writes to ({'*'} if unknown, empty for reads)."""
+    match = _WRITE_RE.match(statement)
+    if match:
+        return {match.group(1).lower()}
+    return {"*"} if _OTHER_WRITE_RE.match(statement) else set()
+
+
+def ledger_version() -> int:
+    """Return the ledger version, which every tracked write increases."""
+    return _ledger_version
+
+
+def table_version(table: str) -> int:
+    """Return the version of one table."""
+    return _table_versions.get(table, 0)
+
+
+def bump(tables: Iterable[str]) -> None:
+    """
+    Record writes to `tables`: bump their versions and evict the entries that read them.
+
+    Args:
+        tables: Table names; '*' stands for every table.
+    """
+    global _ledger_version
+    tables = set(tables)
+    if not tables:
+        return
+    with _lock:
+        _ledger_version += 1
+        if "*" in tables:
+            tables = set(_table_versions) | {t for cache in _caches for t in cache.tables}
+        for table in tables:
+            _table_versions[table] = _table_versions.get(table, 0) + 1
+        for cache in _caches:
+            cache.invalidate(tables)
+
+
+def track_writes(engine: Engine) -> None:
+    """
+    Bump table versions for every write executed on `engine`.
+
+    Args:
+        engine: Engine to watch. Calling this again for the same engine does nothing.
+    """
+    from sqlalchemy import event
+
+    if engine.__dict__.get("_memo_tracked"):
+        return
+    engine._memo_tracked = True
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        tables = written_tables(statement)
+        if tables:
+            conn.info.setdefault("memo_written", set()).update(tables)
+            bump(tables)
+
+    def checkin(dbapi_connection, connection_record):
+        # The transaction has been committed (or rolled back) by the time the
+        # connection returns to the pool
+        written = connection_record.info.pop("memo_written", None)
+        if written:
+            bump(written)
+
+    event.listen(engine, "after_cursor_execute", after_execute)
+    event.listen(engine.pool, "checkin", checkin)
+
+
+def set_memoization(enabled: bool) -> None:
+    """Turn memoization on or off for every memoized function, clearing the caches."""
+    global _enabled
+    _enabled = enabled
+    for cache in _caches:
+        cache.clear()
+
+
+def memoization_enabled() -> bool:
+    """Return whether memoization is on."""
+    return _enabled
+
+
+def memo_stats() -> Dict[str, Dict[str, int]]:
+    """Return hits, misses, evictions, invalidations and current size per memoized function."""
+    with _lock:
+        return {cache.name: cache.stats() for cache in _caches}
+
+
+def _freeze(value: Any) -> Any:
+    """Turn an argument into a hashable cache key component."""
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    if isinstance(value, (list, tuple, set, frozenset)):
+        frozen = tuple(_freeze(v) for v in value)
+        return tuple(sorted(frozen, key=repr)) if isinstance(value, (set, frozenset)) else frozen
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "model_dump_json"):
+        return value.model_dump_json()
+    return repr(value)
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool, type(None), tuple)):
+        return value
+    if hasattr(value, "copy") and hasattr(value, "iloc"):
+        # pandas objects
+        return value.copy()
+    return copy.deepcopy(value)
+
+
+class _MemoCache:
+    """Bounded LRU of one function's results, keyed by arguments and table versions."""
+
+    def __init__(self, name: str, tables: Tuple[str, ...], maxsize: int):
+        self.name = name
+        self.tables = tables
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def key(self, args: Tuple, kwargs: Dict[str, Any]) -> Tuple:
+        versions = tuple(_table_versions.get(table, 0) for table in self.tables)
+        return _freeze(args), _freeze(kwargs), versions
+
+    def invalidate(self, tables: Set[str]) -> None:
+        if self.entries and tables.intersection(self.tables):
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self.entries),
+        }
+
+
+def memoized(*tables: str, maxsize: int = DEFAULT_MAXSIZE) -> Callable:
+    """
+    Memoize a read-only function until one of the tables it reads is written.
+
+    Args:
+        tables: Tables the function reads.
+        maxsize: Most results kept; the least recently used are evicted first.
+
+    Returns:
+        A decorator. The decorated function gains `cache_info()` and `cache_clear()`.
+
+    Raises:
+        ValueError: If no tables are given.
+    """
+    if not tables:
+        raise ValueError("memoized() needs the tables the function reads")
+
+    def decorator(func: Callable) -> Callable:
+        cache = _MemoCache(func.__qualname__, tuple(t.lower() for t in tables), maxsize)
+        with _lock:
+            _caches.append(cache)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            # Take the versions before reading, so a concurrent write makes this key stale
+            with _lock:
+                key = cache.key(args, kwargs)
+                value = cache.entries.get(key, _MISSING)
+                if value is _MISSING:
+                    cache.misses += 1
+                else:
+                    cache.entries.move_to_end(key)
+                    cache.hits += 1
+            if value is not _MISSING:
+                return _copy(value)
+
+            value = func(*args, **kwargs)
+            with _lock:
+                # Don't keep a result if a table was written while it was computed
+                if key[2] == tuple(_table_versions.get(table, 0) for table in cache.tables):
+                    cache.entries[key] = value
+                    if len(cache.entries) > cache.maxsize:
+                        cache.entries.popitem(last=False)
+                        cache.evictions += 1
+            return _copy(value)
+
+        wrapper.cache_info = cache.stats
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
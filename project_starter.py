@@ -1,21 +1,68 @@
-import numpy as np
-import pandas as pd
+from __future__ import annotations
+
 import os
-import time
 import asyncio
-from dotenv import load_dotenv
 import ast
-from sqlalchemy.sql import text
+import uuid
 from datetime import datetime, timedelta
-from typing import Dict, List, Union
-from sqlalchemy import create_engine, Engine
-from openai import OpenAI
-from pydantic_ai import Agent
-from pydantic_ai.tools import Tool
-from pydantic import BaseModel
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+from memo import memoized
+
+# pandas, numpy, SQLAlchemy and the agent stack are imported lazily inside the
+# functions that need them, so importing this module for its data-access
+# helpers stays cheap and has no side effects (no engine, no API key lookup).
+if TYPE_CHECKING:
+    import pandas as pd
+    from sqlalchemy import Engine
+
+# Location of the SQLite database (override with MUNDER_DIFFLIN_DB_URL)
+DB_URL = os.getenv("MUNDER_DIFFLIN_DB_URL", "sqlite:///munder_difflin.db")
+
+_engine: Optional[Engine] = None
+
+
+def get_engine() -> Engine:
+    """
+    Return the shared SQLAlchemy engine, creating it on first use.
 
-# Create an SQLite database
-db_engine = create_engine("sqlite:///munder_difflin.db")
+    Returns:
+        Engine: The engine connected to `DB_URL`.
+    """
+    global _engine
+    if _engine is None:
+        from sqlalchemy import create_engine
+
+        from memo import track_writes
+        from request_writes import tag_writes
+
+        _engine = create_engine(DB_URL)
+        # Writes bump the table versions that memoized reads are keyed on
+        track_writes(_engine)
+        # Ledger rows are tagged with the request that wrote them, for rollback on resume
+        tag_writes(_engine)
+    return _engine
+
+
+def __getattr__(name: str):
+    """
+    Lazily resolve module attributes that are expensive to build.
+
+    `db_engine` is kept for backwards compatibility and maps to `get_engine()`.
+    The agents, tools and their Pydantic models live in `inventory_agents` and
+    are only imported when first accessed from here.
+    """
+    if name == "db_engine":
+        return get_engine()
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    import inventory_agents
+
+    try:
+        return getattr(inventory_agents, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
 
 # List containing the different kinds of papers 
 paper_supplies = [
@@ -101,6 +148,9 @@ def generate_sample_inventory(paper_supplies: list, coverage: float = 0.4, seed:
                       - current_stock
                       - min_stock_level
     """
+    import numpy as np
+    import pandas as pd
+
     # Ensure reproducible random output
     np.random.seed(seed)
 
@@ -131,19 +181,25 @@ def generate_sample_inventory(paper_supplies: list, coverage: float = 0.4, seed:
     # Return inventory as a pandas DataFrame
     return pd.DataFrame(inventory)
 
-def init_database(db_engine: Engine, seed: int = 137) -> Engine:    
+def init_database(db_engine: Optional[Engine] = None, seed: int = 137) -> Engine:    
     """
     Set up the Munder Difflin database with all required tables and initial records.
 
     This function performs the following tasks:
     - Creates the 'transactions' table for logging stock orders and sales
+    - Records a new 'ledger_generation' marker, so rowid-based consumers notice the ledger was replaced
     - Loads customer inquiries from 'quote_requests.csv' into a 'quote_requests' table
     - Loads previous quotes from 'quotes.csv' into a 'quotes' table, extracting useful metadata
     - Generates a random subset of paper inventory using `generate_sample_inventory`
     - Inserts initial financial records including available cash and starting stock levels
+    - Builds the indexed 'quote_search' table and per-facet 'quote_facet_stats' for quote search
+    - Creates an empty 'reservations' table for stock holds
+    - Drops the archive and log of earlier ledger compactions
+    - Creates an empty 'request_writes' table tagging ledger rows with the request that wrote them
 
     Args:
-        db_engine (Engine): A SQLAlchemy engine connected to the SQLite database.
+        db_engine (Engine, optional): A SQLAlchemy engine connected to the SQLite database.
+                                      Defaults to the shared engine from `get_engine()`.
         seed (int, optional): A random seed used to control reproducibility of inventory stock levels.
                               Default is 137.
 
@@ -153,6 +209,11 @@ def init_database(db_engine: Engine, seed: int = 137) -> Engine:
     Raises:
         Exception: If an error occurs during setup, the exception is printed and raised.
     """
+    import pandas as pd
+
+    if db_engine is None:
+        db_engine = get_engine()
+
     try:
         # ----------------------------
         # 1. Create an empty 'transactions' table schema
@@ -167,6 +228,11 @@ def init_database(db_engine: Engine, seed: int = 137) -> Engine:
         })
         transactions_schema.to_sql("transactions", db_engine, if_exists="replace", index=False)
 
+        # Rowids restart in the new table, so mark it as a new generation of the ledger
+        pd.DataFrame({"generation": [uuid.uuid4().hex]}).to_sql(
+            "ledger_generation", db_engine, if_exists="replace", index=False
+        )
+
         # Set a consistent starting date
         initial_date = datetime(2025, 1, 1).isoformat()
 
@@ -238,12 +304,73 @@ def init_database(db_engine: Engine, seed: int = 137) -> Engine:
         # Save the inventory reference table
         inventory_df.to_sql("inventory", db_engine, if_exists="replace", index=False)
 
+        # ----------------------------
+        # 5. Build the denormalized quote search and facet statistics tables
+        # ----------------------------
+        build_quote_search_index(db_engine)
+
+        # ----------------------------
+        # 6. Create an empty 'reservations' table for stock holds
+        # ----------------------------
+        from sqlalchemy import text
+        from reservations import create_reservations_table
+
+        with db_engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS reservations"))
+            create_reservations_table(conn)
+
+        # ----------------------------
+        # 7. Drop the archive of any earlier ledger compaction
+        # ----------------------------
+        from compaction import drop_compaction_tables
+
+        with db_engine.begin() as conn:
+            drop_compaction_tables(conn)
+
+        # ----------------------------
+        # 8. Create an empty 'request_writes' table for tagging ledger rows by request
+        # ----------------------------
+        from request_writes import create_request_writes_table
+
+        with db_engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS request_writes"))
+            create_request_writes_table(conn)
+
         return db_engine
 
     except Exception as e:
         print(f"Error initializing database: {e}")
         raise
 
+@memoized("ledger_compactions")
+def _ledger_cutoff() -> Optional[str]:
+    """Return the cutoff of the latest ledger compaction, or None if the ledger was never compacted."""
+    from sqlalchemy import inspect, text
+
+    engine = get_engine()
+    if not inspect(engine).has_table("ledger_compactions"):
+        return None
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(cutoff) FROM ledger_compactions")).scalar()
+
+def ledger_table(as_of_date: Union[str, datetime]) -> str:
+    """
+    Return the table to answer an as-of query from.
+
+    Transactions before the last compaction cutoff are rolled into opening-balance rows
+    in `transactions` (see compaction.py), which give the same totals for any date on or
+    after the cutoff. Earlier dates are answered from `transactions_full`, which adds
+    the archived originals back. Every as-of read of the ledger should go through this.
+    """
+    if isinstance(as_of_date, datetime):
+        as_of_date = as_of_date.isoformat()
+    cutoff = _ledger_cutoff()
+    return "transactions_full" if cutoff is not None and as_of_date < cutoff else "transactions"
+
+def ledger_row_id(table: str) -> str:
+    """Return the column holding the transaction ID in a table returned by `ledger_table`."""
+    return "row_id" if table == "transactions_full" else "rowid"
+
 def create_transaction(
     item_name: str,
     transaction_type: str,
@@ -269,6 +396,8 @@ def create_transaction(
         ValueError: If `transaction_type` is not 'stock_orders' or 'sales'.
         Exception: For other database or execution errors.
     """
+    import pandas as pd
+
     try:
         # Convert datetime to ISO string if necessary
         date_str = date.isoformat() if isinstance(date, datetime) else date
@@ -287,10 +416,10 @@ def create_transaction(
         }])
 
         # Insert the record into the database
-        transaction.to_sql("transactions", db_engine, if_exists="append", index=False)
+        transaction.to_sql("transactions", get_engine(), if_exists="append", index=False)
 
         # Fetch and return the ID of the inserted row
-        result = pd.read_sql("SELECT last_insert_rowid() as id", db_engine)
+        result = pd.read_sql("SELECT last_insert_rowid() as id", get_engine())
         return int(result.iloc[0]["id"])
 
     except Exception as e:
@@ -312,8 +441,10 @@ def get_all_inventory(as_of_date: str) -> Dict[str, int]:
     Returns:
         Dict[str, int]: A dictionary mapping item names to their current stock levels.
     """
+    import pandas as pd
+
     # SQL query to compute stock levels per item as of the given date
-    query = """
+    query = f"""
         SELECT
             item_name,
             SUM(CASE
@@ -321,7 +452,7 @@ def get_all_inventory(as_of_date: str) -> Dict[str, int]:
                 WHEN transaction_type = 'sales' THEN -units
                 ELSE 0
             END) as stock
-        FROM transactions
+        FROM {ledger_table(as_of_date)}
         WHERE item_name IS NOT NULL
         AND transaction_date <= :as_of_date
         GROUP BY item_name
@@ -329,11 +460,98 @@ def get_all_inventory(as_of_date: str) -> Dict[str, int]:
     """
 
     # Execute the query with the date parameter
-    result = pd.read_sql(query, db_engine, params={"as_of_date": as_of_date})
+    result = pd.read_sql(query, get_engine(), params={"as_of_date": as_of_date})
 
     # Convert the result into a dictionary {item_name: stock}
     return dict(zip(result["item_name"], result["stock"]))
 
+def get_inventory_items(
+    as_of_date: str,
+    category: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    low_stock_only: bool = False,
+) -> List[Dict]:
+    """
+    Retrieve inventory items with their stock levels and reference data as of a date.
+
+    Stock is computed from the transaction ledger like `get_all_inventory`, and each
+    item is enriched with its category, unit price and minimum stock level (from the
+    `inventory` table, or the `paper_supplies` catalog for items ordered later).
+
+    By default only items with positive stock are returned. With `low_stock_only`,
+    only items below their minimum stock level are returned, including items with
+    no stock at all.
+
+    Args:
+        as_of_date (str): ISO-formatted date string (YYYY-MM-DD) representing the inventory cutoff.
+        category (str, optional): Only return items of this category (e.g. 'paper', 'product').
+        name_prefix (str, optional): Only return items whose name starts with this text (case-insensitive).
+        low_stock_only (bool, optional): Only return items below their minimum stock level.
+
+    Returns:
+        List[Dict]: Items sorted by name, each with item_name, stock, category,
+                    unit_price and min_stock_level.
+    """
+    from sqlalchemy.sql import text
+
+    query = f"""
+        WITH stock AS (
+            SELECT
+                item_name,
+                SUM(CASE
+                    WHEN transaction_type = 'stock_orders' THEN units
+                    WHEN transaction_type = 'sales' THEN -units
+                    ELSE 0
+                END) AS stock
+            FROM {ledger_table(as_of_date)}
+            WHERE item_name IS NOT NULL
+            AND transaction_date <= :as_of_date
+            GROUP BY item_name
+        ),
+        items AS (
+            SELECT item_name FROM stock
+            UNION
+            SELECT item_name FROM inventory
+        )
+        SELECT
+            items.item_name,
+            COALESCE(s.stock, 0) AS stock,
+            i.category,
+            i.unit_price,
+            i.min_stock_level
+        FROM items
+        LEFT JOIN stock s ON s.item_name = items.item_name
+        LEFT JOIN inventory i ON i.item_name = items.item_name
+        ORDER BY items.item_name
+    """
+    with get_engine().connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(text(query), {"as_of_date": as_of_date})]
+
+    catalog = {item["item_name"]: item for item in paper_supplies}
+    prefix = name_prefix.lower() if name_prefix else None
+
+    items = []
+    for row in rows:
+        if row["category"] is None and row["item_name"] in catalog:
+            row["category"] = catalog[row["item_name"]]["category"]
+            row["unit_price"] = catalog[row["item_name"]]["unit_price"]
+        row["stock"] = int(row["stock"])
+        row["min_stock_level"] = int(row["min_stock_level"] or 0)
+
+        if category and row["category"] != category:
+            continue
+        if prefix and not row["item_name"].lower().startswith(prefix):
+            continue
+        if low_stock_only:
+            if row["stock"] >= row["min_stock_level"]:
+                continue
+        elif row["stock"] <= 0:
+            continue
+        items.append(row)
+
+    return items
+
+@memoized("transactions")
 def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.DataFrame:
     """
     Retrieve the stock level of a specific item as of a given date.
@@ -348,12 +566,14 @@ def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.Data
     Returns:
         pd.DataFrame: A single-row DataFrame with columns 'item_name' and 'current_stock'.
     """
+    import pandas as pd
+
     # Convert date to ISO string format if it's a datetime object
     if isinstance(as_of_date, datetime):
         as_of_date = as_of_date.isoformat()
 
     # SQL query to compute net stock level for the item
-    stock_query = """
+    stock_query = f"""
         SELECT
             item_name,
             COALESCE(SUM(CASE
@@ -361,7 +581,7 @@ def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.Data
                 WHEN transaction_type = 'sales' THEN -units
                 ELSE 0
             END), 0) AS current_stock
-        FROM transactions
+        FROM {ledger_table(as_of_date)}
         WHERE item_name = :item_name
         AND transaction_date <= :as_of_date
     """
@@ -369,7 +589,7 @@ def get_stock_level(item_name: str, as_of_date: Union[str, datetime]) -> pd.Data
     # Execute query and return result as a DataFrame
     return pd.read_sql(
         stock_query,
-        db_engine,
+        get_engine(),
         params={"item_name": item_name, "as_of_date": as_of_date},
     )
 
@@ -431,30 +651,39 @@ def get_cash_balance(as_of_date: Union[str, datetime]) -> float:
         float: Net cash balance as of the given date. Returns 0.0 if no transactions exist or an error occurs.
     """
     try:
-        # Convert date to ISO format if it's a datetime object
-        if isinstance(as_of_date, datetime):
-            as_of_date = as_of_date.isoformat()
-
-        # Query all transactions on or before the specified date
-        transactions = pd.read_sql(
-            "SELECT * FROM transactions WHERE transaction_date <= :as_of_date",
-            db_engine,
-            params={"as_of_date": as_of_date},
-        )
-
-        # Compute the difference between sales and stock purchases
-        if not transactions.empty:
-            total_sales = transactions.loc[transactions["transaction_type"] == "sales", "price"].sum()
-            total_purchases = transactions.loc[transactions["transaction_type"] == "stock_orders", "price"].sum()
-            return float(total_sales - total_purchases)
-
-        return 0.0
-
+        return _cash_balance(as_of_date)
     except Exception as e:
+        # Outside the memoized query, so a transient error isn't cached as a zero balance
         print(f"Error getting cash balance: {e}")
         return 0.0
 
 
+@memoized("transactions")
+def _cash_balance(as_of_date: Union[str, datetime]) -> float:
+    """Memoized cash balance query behind `get_cash_balance`; raises on database errors."""
+    import pandas as pd
+
+    # Convert date to ISO format if it's a datetime object
+    if isinstance(as_of_date, datetime):
+        as_of_date = as_of_date.isoformat()
+
+    # Query all transactions on or before the specified date
+    transactions = pd.read_sql(
+        f"SELECT * FROM {ledger_table(as_of_date)} WHERE transaction_date <= :as_of_date",
+        get_engine(),
+        params={"as_of_date": as_of_date},
+    )
+
+    # Compute the difference between sales and stock purchases
+    if not transactions.empty:
+        total_sales = transactions.loc[transactions["transaction_type"] == "sales", "price"].sum()
+        total_purchases = transactions.loc[transactions["transaction_type"] == "stock_orders", "price"].sum()
+        return float(total_sales - total_purchases)
+
+    return 0.0
+
+
+@memoized("transactions", "inventory")
 def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
     """
     Generate a complete financial report for the company as of a specific date.
@@ -478,15 +707,17 @@ def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
             - 'inventory_summary': List of items with stock and valuation details
             - 'top_selling_products': List of top 5 products by revenue
     """
+    import pandas as pd
+
     # Normalize date input
     if isinstance(as_of_date, datetime):
         as_of_date = as_of_date.isoformat()
 
-    # Get current cash balance
-    cash = get_cash_balance(as_of_date)
+    # Get current cash balance; a failed query fails the report rather than being cached in it as 0.0
+    cash = _cash_balance(as_of_date)
 
     # Get current inventory snapshot
-    inventory_df = pd.read_sql("SELECT * FROM inventory", db_engine)
+    inventory_df = pd.read_sql("SELECT * FROM inventory", get_engine())
     inventory_value = 0.0
     inventory_summary = []
 
@@ -505,15 +736,15 @@ def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
         })
 
     # Identify top-selling products by revenue
-    top_sales_query = """
+    top_sales_query = f"""
         SELECT item_name, SUM(units) as total_units, SUM(price) as total_revenue
-        FROM transactions
+        FROM {ledger_table(as_of_date)}
         WHERE transaction_type = 'sales' AND transaction_date <= :date
         GROUP BY item_name
         ORDER BY total_revenue DESC
         LIMIT 5
     """
-    top_sales = pd.read_sql(top_sales_query, db_engine, params={"date": as_of_date})
+    top_sales = pd.read_sql(top_sales_query, get_engine(), params={"date": as_of_date})
     top_selling_products = top_sales.to_dict(orient="records")
 
     return {
@@ -526,17 +757,248 @@ def generate_financial_report(as_of_date: Union[str, datetime]) -> Dict:
     }
 
 
-def search_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
+def generate_financial_report_series(
+    start_date: Union[str, datetime],
+    end_date: Union[str, datetime],
+    freq: str = "D",
+) -> Dict:
+    """
+    Generate the financial report figures for every date in a range in a single pass.
+
+    Instead of calling `generate_financial_report` once per date (which re-scans the
+    ledger each time), this reads the transactions up to `end_date` once, in date
+    order, and accumulates running cash, per-item stock and sales totals, sampling
+    them at each report date. Each point matches what `generate_financial_report`
+    would return for that date.
+
+    Args:
+        start_date (str or datetime): First report date (YYYY-MM-DD or datetime).
+        end_date (str or datetime): Last report date (inclusive).
+        freq (str, optional): 'D' (or 'daily') for one point per day, 'W' (or 'weekly')
+                              for one point every 7 days from `start_date`. Default is 'D'.
+
+    Returns:
+        Dict: A columnar structure with one entry per report date:
+            - 'as_of_date': List of report dates (YYYY-MM-DD)
+            - 'cash_balance': List of cash balances
+            - 'inventory_value': List of inventory valuations
+            - 'total_assets': List of combined cash and inventory values
+            - 'stock': Dict mapping each inventory item to its list of stock levels
+            - 'unit_price': Dict mapping each inventory item to its unit price
+            - 'top_selling_products': List of top 5 products by revenue, per date
+
+    Raises:
+        ValueError: If `freq` is not recognised or `end_date` is before `start_date`.
+    """
+    from sqlalchemy.sql import text
+
+    steps = {"d": 1, "daily": 1, "w": 7, "weekly": 7}
+    if freq.lower() not in steps:
+        raise ValueError("freq must be 'D'/'daily' or 'W'/'weekly'")
+    step = timedelta(days=steps[freq.lower()])
+
+    # Normalize date inputs to calendar days
+    start_dt = datetime.fromisoformat(start_date.isoformat() if isinstance(start_date, datetime) else start_date)
+    end_dt = datetime.fromisoformat(end_date.isoformat() if isinstance(end_date, datetime) else end_date)
+    if end_dt < start_dt:
+        raise ValueError("end_date must not be before start_date")
+
+    report_dates = []
+    current = start_dt.date()
+    while current <= end_dt.date():
+        report_dates.append(current.isoformat())
+        current += step
+
+    with get_engine().connect() as conn:
+        inventory = conn.execute(text("SELECT item_name, unit_price FROM inventory")).fetchall()
+        # One ordered scan of the ledger up to the last report date
+        ledger = conn.execute(
+            text(f"""
+                SELECT item_name, transaction_type, units, price, transaction_date
+                FROM {ledger_table(report_dates[0])}
+                WHERE transaction_date <= :end_date
+                ORDER BY transaction_date
+            """),
+            {"end_date": report_dates[-1]},
+        )
+
+        unit_prices = {name: price for name, price in inventory}
+        running_stock = {name: 0.0 for name in unit_prices}
+        sales_totals: Dict = {}  # item_name -> [total_units, total_revenue]
+        cash = 0.0
+
+        series = {
+            "as_of_date": report_dates,
+            "cash_balance": [],
+            "inventory_value": [],
+            "total_assets": [],
+            "stock": {name: [] for name in unit_prices},
+            "unit_price": unit_prices,
+            "top_selling_products": [],
+        }
+
+        pending = next(ledger, None)
+        for as_of in report_dates:
+            # Apply every transaction dated on or before this report date
+            while pending is not None and pending.transaction_date <= as_of:
+                item_name, transaction_type, units, price = pending[:4]
+                if transaction_type == "sales":
+                    cash += price or 0.0
+                    totals = sales_totals.setdefault(item_name, [None, 0.0])
+                    if units is not None:
+                        totals[0] = (totals[0] or 0) + units
+                    totals[1] += price or 0.0
+                elif transaction_type == "stock_orders":
+                    cash -= price or 0.0
+                if item_name in running_stock and units is not None:
+                    if transaction_type == "stock_orders":
+                        running_stock[item_name] += units
+                    elif transaction_type == "sales":
+                        running_stock[item_name] -= units
+                pending = next(ledger, None)
+
+            inventory_value = 0.0
+            for name, stock in running_stock.items():
+                series["stock"][name].append(stock)
+                inventory_value += stock * unit_prices[name]
+
+            top_sales = sorted(sales_totals.items(), key=lambda kv: kv[1][1], reverse=True)[:5]
+
+            series["cash_balance"].append(cash)
+            series["inventory_value"].append(inventory_value)
+            series["total_assets"].append(cash + inventory_value)
+            series["top_selling_products"].append([
+                {"item_name": name, "total_units": units, "total_revenue": revenue}
+                for name, (units, revenue) in top_sales
+            ])
+
+    return series
+
+
+# Facet columns of the historical quotes, filterable and counted by search_quote_history
+QUOTE_FACETS = ["job_type", "order_size", "event_type"]
+
+def _discount_pct(explanation: str) -> Optional[float]:
+    """Return the discount percentage stated in a quote explanation, 0 if none is mentioned, None if unstated."""
+    import re
+
+    text = str(explanation).lower()
+    match = re.search(r"(\d+(?:\.\d+)?)\s*%\s*(?:bulk\s+)?(?:discount|off)", text) or re.search(
+        r"discount of (\d+(?:\.\d+)?)\s*%", text
+    )
+    if match:
+        return float(match.group(1))
+    return None if "discount" in text else 0.0
+
+def build_quote_search_index(db_engine: Optional[Engine] = None) -> None:
+    """
+    Build the denormalized `quote_search` table and the per-facet `quote_facet_stats` table.
+
+    `quote_search` holds one row per quote with its original request already joined in,
+    a lowercased `search_text` column for keyword matching, the facet columns, and the
+    discount stated in the explanation. It is indexed on each facet (and on
+    order_size + event_type) so facet filters and counts don't need the join at query time.
+
+    `quote_facet_stats` holds, for every value of every facet, the number of quotes, the
+    median and mean total, the share of quotes that mention a discount, and the mean
+    stated discount percentage.
+
+    Args:
+        db_engine (Engine, optional): Engine to write to. Defaults to `get_engine()`.
+    """
+    import pandas as pd
+    from sqlalchemy import text
+
+    if db_engine is None:
+        db_engine = get_engine()
+
+    quotes = pd.read_sql(
+        """
+        SELECT q.request_id, qr.response AS original_request, q.total_amount, q.quote_explanation,
+               q.job_type, q.order_size, q.event_type, q.order_date
+        FROM quotes q
+        JOIN quote_requests qr ON q.request_id = qr.id
+        """,
+        db_engine,
+    )
+    quotes["search_text"] = (
+        quotes["original_request"].fillna("") + "\n" + quotes["quote_explanation"].fillna("")
+    ).str.lower()
+    quotes["discount_pct"] = quotes["quote_explanation"].map(_discount_pct)
+    quotes.to_sql("quote_search", db_engine, if_exists="replace", index=False)
+
+    stats = []
+    for facet in QUOTE_FACETS:
+        for value, group in quotes.groupby(facet):
+            stated = group["discount_pct"].dropna()
+            stats.append({
+                "facet": facet,
+                "value": value,
+                "quotes": len(group),
+                "median_total": float(group["total_amount"].median()),
+                "mean_total": float(group["total_amount"].mean()),
+                # Quotes that mention a discount, whether or not they state a percentage
+                "discounted_share": float((group["discount_pct"].isna() | (group["discount_pct"] > 0)).mean()),
+                "avg_discount_pct": float(stated[stated > 0].mean()) if (stated > 0).any() else 0.0,
+            })
+    pd.DataFrame(stats).to_sql("quote_facet_stats", db_engine, if_exists="replace", index=False)
+
+    with db_engine.begin() as conn:
+        for facet in QUOTE_FACETS:
+            conn.execute(text(f"CREATE INDEX idx_quote_search_{facet} ON quote_search ({facet})"))
+        conn.execute(text("CREATE INDEX idx_quote_search_size_event ON quote_search (order_size, event_type)"))
+        conn.execute(text("CREATE INDEX idx_quote_search_order_date ON quote_search (order_date)"))
+        conn.execute(text("CREATE UNIQUE INDEX idx_quote_facet_stats ON quote_facet_stats (facet, value)"))
+
+def _quote_search_filters(
+    search_terms: List[str], facets: Dict[str, Union[str, List[str], None]]
+) -> tuple:
+    """Build the WHERE clause and params for keyword and facet filters on `quote_search`."""
+    conditions = []
+    params: Dict[str, str] = {}
+
+    # LIKE filters for each search term over the pre-joined, lowercased text
+    for i, term in enumerate(search_terms):
+        conditions.append(f"search_text LIKE :term_{i}")
+        params[f"term_{i}"] = f"%{term.lower()}%"
+
+    # Equality (or IN) filters on the indexed facet columns
+    for facet, value in facets.items():
+        if facet not in QUOTE_FACETS:
+            raise ValueError(f"Unknown facet '{facet}'. Must be one of: {', '.join(QUOTE_FACETS)}")
+        if value is None or value == []:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        names = [f"{facet}_{i}" for i in range(len(values))]
+        conditions.append(f"{facet} IN ({', '.join(':' + n for n in names)})")
+        params.update(zip(names, values))
+
+    # Combine conditions; fallback to always-true if no filters provided
+    return (" AND ".join(conditions) if conditions else "1=1"), params
+
+@memoized("quote_search", "quote_facet_stats")
+def search_quote_history(
+    search_terms: List[str],
+    limit: int = 5,
+    job_type: Union[str, List[str], None] = None,
+    order_size: Union[str, List[str], None] = None,
+    event_type: Union[str, List[str], None] = None,
+) -> List[Dict]:
     """
     Retrieve a list of historical quotes that match any of the provided search terms.
 
-    The function searches both the original customer request (from `quote_requests`) and
-    the explanation for the quote (from `quotes`) for each keyword. Results are sorted by
+    The function searches both the original customer request and the explanation for
+    the quote for each keyword, optionally restricted to facet values (e.g.
+    order_size='large', event_type='ceremony'). It reads the denormalized
+    `quote_search` table, so no join is needed at query time. Results are sorted by
     most recent order date and limited by the `limit` parameter.
 
     Args:
         search_terms (List[str]): List of terms to match against customer requests and explanations.
         limit (int, optional): Maximum number of quote records to return. Default is 5.
+        job_type (str or List[str], optional): Only quotes for this job type (or any of these).
+        order_size (str or List[str], optional): Only quotes of this order size ('small', 'medium', 'large').
+        event_type (str or List[str], optional): Only quotes for this event type.
 
     Returns:
         List[Dict]: A list of matching quotes, each represented as a dictionary with fields:
@@ -548,362 +1010,96 @@ def search_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
             - event_type
             - order_date
     """
-    conditions = []
-    params = {}
-
-    # Build SQL WHERE clause using LIKE filters for each search term
-    for i, term in enumerate(search_terms):
-        param_name = f"term_{i}"
-        conditions.append(
-            f"(LOWER(qr.response) LIKE :{param_name} OR "
-            f"LOWER(q.quote_explanation) LIKE :{param_name})"
-        )
-        params[param_name] = f"%{term.lower()}%"
+    from sqlalchemy.sql import text
 
-    # Combine conditions; fallback to always-true if no terms provided
-    where_clause = " AND ".join(conditions) if conditions else "1=1"
-
-    # Final SQL query to join quotes with quote_requests
+    _ensure_quote_search_index()
+    where_clause, params = _quote_search_filters(
+        search_terms, {"job_type": job_type, "order_size": order_size, "event_type": event_type}
+    )
     query = f"""
         SELECT
-            qr.response AS original_request,
-            q.total_amount,
-            q.quote_explanation,
-            q.job_type,
-            q.order_size,
-            q.event_type,
-            q.order_date
-        FROM quotes q
-        JOIN quote_requests qr ON q.request_id = qr.id
+            original_request,
+            total_amount,
+            quote_explanation,
+            job_type,
+            order_size,
+            event_type,
+            order_date
+        FROM quote_search
         WHERE {where_clause}
-        ORDER BY q.order_date DESC
-        LIMIT {limit}
+        ORDER BY order_date DESC
+        LIMIT {int(limit)}
     """
 
     # Execute parameterized query
-    with db_engine.connect() as conn:
+    with get_engine().connect() as conn:
         result = conn.execute(text(query), params)
         # Convert SQLAlchemy Row objects to dictionaries
         return [dict(row._mapping) for row in result]
 
-########################
-########################
-########################
-# YOUR MULTI AGENT STARTS HERE
-########################
-########################
-########################
-
-
-#Set up and load your env parameters and instantiate your model.
-
-# Load environment variables
-load_dotenv()
-
-# Set up OpenAI client using API key from environment
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY not found in environment variables. Please check your .env file.")
-#print the OPENAI_API_KEY
-print(f"OPENAI_API_KEY: {OPENAI_API_KEY}")
-
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
-# For compatibility, you could specify a default model name for agent instantiation.
-DEFAULT_MODEL_NAME = os.getenv("OPENAI_MODEL", "gpt-4.1-nano")  # Use GPT-4o as default if model not specified
-
-
-
-"""Set up tools for your agents to use, these should be methods that combine the database functions above
- and apply criteria to them to ensure that the flow of the system is correct. Use Pydantic AI framework for your tools."""
-
-
-# Tools for inventory agent
-
-class CheckStockInput(BaseModel):
-    """Input for checking stock level of a specific item."""
-    item_name: str
-    as_of_date: str
-
-class StockLevelOutput(BaseModel):
-    """Output containing stock level information."""
-    item_name: str
-    current_stock: int
-
-def check_stock_level(data: CheckStockInput) -> StockLevelOutput:
-    """
-    Check the current stock level of a specific item as of a given date.
-    
-    Args:
-        data: Contains item_name and as_of_date (ISO format YYYY-MM-DD)
-    
-    Returns:
-        Stock level information including item name and current stock count
-    """
-    stock_df = get_stock_level(data.item_name, data.as_of_date)
-    stock = int(stock_df["current_stock"].iloc[0]) if not stock_df.empty else 0
-    return StockLevelOutput(item_name=data.item_name, current_stock=stock)
-
-class GetAllInventoryInput(BaseModel):
-    """Input for getting all inventory items."""
-    as_of_date: str
-
-class InventoryOutput(BaseModel):
-    """Output containing all inventory items with stock levels."""
-    inventory: Dict[str, int]
-
-def get_all_inventory_items(data: GetAllInventoryInput) -> InventoryOutput:
-    """
-    Get all inventory items with their stock levels as of a given date.
-    Only returns items with positive stock.
-    
-    Args:
-        data: Contains as_of_date (ISO format YYYY-MM-DD)
-    
-    Returns:
-        Dictionary mapping item names to their stock levels
+@memoized("quote_search", "quote_facet_stats")
+def get_quote_facet_counts(
+    search_terms: Optional[List[str]] = None,
+    job_type: Union[str, List[str], None] = None,
+    order_size: Union[str, List[str], None] = None,
+    event_type: Union[str, List[str], None] = None,
+) -> Dict[str, Dict[str, int]]:
     """
-    inventory = get_all_inventory(data.as_of_date)
-    return InventoryOutput(inventory=inventory)
-
+    Count the historical quotes matching a search, per value of each facet.
 
-# Tools for quoting agent
+    Takes the same filters as `search_quote_history`.
 
-class SearchQuotesInput(BaseModel):
-    """Input for searching quote history."""
-    search_terms: List[str]
-    limit: int = 5
-
-class QuoteResult(BaseModel):
-    """Result from a quote search."""
-    original_request: str
-    total_amount: float
-    quote_explanation: str
-    job_type: str
-    order_size: str
-    event_type: str
-    order_date: str
-
-class SearchQuotesOutput(BaseModel):
-    """Output containing matching quotes."""
-    quotes: List[QuoteResult]
-
-def search_historical_quotes(data: SearchQuotesInput) -> SearchQuotesOutput:
-    """
-    Search for historical quotes matching the provided search terms.
-    Searches both customer requests and quote explanations.
-    
-    Args:
-        data: Contains search_terms (list of keywords) and optional limit (default 5)
-    
     Returns:
-        List of matching quotes with their details
+        Dict[str, Dict[str, int]]: {facet: {value: count}}, values ordered by count.
     """
-    results = search_quote_history(data.search_terms, data.limit)
-    quotes = [
-        QuoteResult(
-            original_request=r.get("original_request", ""),
-            total_amount=float(r.get("total_amount", 0.0)),
-            quote_explanation=r.get("quote_explanation", ""),
-            job_type=r.get("job_type", ""),
-            order_size=r.get("order_size", ""),
-            event_type=r.get("event_type", ""),
-            order_date=str(r.get("order_date", ""))
-        )
-        for r in results
-    ]
-    return SearchQuotesOutput(quotes=quotes)
+    from sqlalchemy.sql import text
 
-
-# Tools for ordering agent
-
-class CreateTransactionInput(BaseModel):
-    """Input for creating a transaction.
-    
-    transaction_type: Must be 'stock_orders' (or 'stock_order', 'order', 'purchase', 'buy') 
-                      for purchasing inventory, or 'sales' (or 'sale', 'sell') for customer sales.
-    """
-    item_name: str
-    transaction_type: str  # 'stock_orders' or 'sales' (case-insensitive, accepts variations)
-    quantity: int
-    price: float
-    date: str  # ISO format YYYY-MM-DD
-
-class TransactionOutput(BaseModel):
-    """Output from creating a transaction."""
-    transaction_id: int
-    message: str
-
-def create_order_transaction(data: CreateTransactionInput) -> TransactionOutput:
-    """
-    Create a new transaction (stock order or sale) in the database.
-    
-    Args:
-        data: Contains item_name, transaction_type, quantity, price, and date
-    
-    Returns:
-        Transaction ID and confirmation message
-    """
-    # Normalize transaction type (handle common variations)
-    transaction_type = data.transaction_type.lower().strip()
-    
-    # Map common variations to correct values
-    type_mapping = {
-        "stock_order": "stock_orders",
-        "stock_orders": "stock_orders",
-        "order": "stock_orders",
-        "purchase": "stock_orders",
-        "buy": "stock_orders",
-        "sale": "sales",
-        "sales": "sales",
-        "sell": "sales"
-    }
-    
-    if transaction_type not in type_mapping:
-        raise ValueError(
-            f"Invalid transaction type: '{data.transaction_type}'. "
-            f"Must be one of: 'stock_orders' (or 'stock_order', 'order', 'purchase') "
-            f"or 'sales' (or 'sale', 'sell')"
-        )
-    
-    normalized_type = type_mapping[transaction_type]
-    
-    transaction_id = create_transaction(
-        item_name=data.item_name,
-        transaction_type=normalized_type,
-        quantity=data.quantity,
-        price=data.price,
-        date=data.date
-    )
-    return TransactionOutput(
-        transaction_id=transaction_id,
-        message=f"Successfully created {normalized_type} transaction for {data.item_name}"
+    _ensure_quote_search_index()
+    where_clause, params = _quote_search_filters(
+        search_terms or [], {"job_type": job_type, "order_size": order_size, "event_type": event_type}
     )
-
-class CashBalanceInput(BaseModel):
-    """Input for checking cash balance."""
-    as_of_date: str
-
-class CashBalanceOutput(BaseModel):
-    """Output containing cash balance."""
-    cash_balance: float
-    as_of_date: str
-
-def get_cash_balance_info(data: CashBalanceInput) -> CashBalanceOutput:
-    """
-    Get the current cash balance as of a given date.
-    Calculated as total sales revenue minus total stock purchase costs.
-    
-    Args:
-        data: Contains as_of_date (ISO format YYYY-MM-DD)
-    
-    Returns:
-        Cash balance amount and the date it's calculated for
+    counts: Dict[str, Dict[str, int]] = {}
+    with get_engine().connect() as conn:
+        for facet in QUOTE_FACETS:
+            rows = conn.execute(text(f"""
+                SELECT {facet} AS value, COUNT(*) AS n
+                FROM quote_search
+                WHERE {where_clause}
+                GROUP BY {facet}
+                ORDER BY n DESC, value
+            """), params)
+            counts[facet] = {row.value: row.n for row in rows}
+    return counts
+
+@memoized("quote_facet_stats")
+def get_quote_facet_stats(facet: Optional[str] = None, value: Optional[str] = None) -> List[Dict]:
     """
-    balance = get_cash_balance(data.as_of_date)
-    return CashBalanceOutput(cash_balance=balance, as_of_date=data.as_of_date)
+    Return the price statistics precomputed per facet value at init.
 
-class DeliveryDateInput(BaseModel):
-    """Input for checking supplier delivery date."""
-    input_date: str  # ISO format YYYY-MM-DD
-    quantity: int
-
-class DeliveryDateOutput(BaseModel):
-    """Output containing estimated delivery date."""
-    delivery_date: str
-    input_date: str
-    quantity: int
-
-def check_delivery_date(data: DeliveryDateInput) -> DeliveryDateOutput:
-    """
-    Estimate the supplier delivery date based on order quantity.
-    Lead times: ≤10 units (same day), 11-100 (1 day), 101-1000 (4 days), >1000 (7 days).
-    
     Args:
-        data: Contains input_date (ISO format) and quantity
-    
+        facet (str, optional): Only this facet ('job_type', 'order_size' or 'event_type').
+        value (str, optional): Only this facet value.
+
     Returns:
-        Estimated delivery date, input date, and quantity
+        List[Dict]: Rows with facet, value, quotes, median_total, mean_total,
+                    discounted_share and avg_discount_pct.
     """
-    delivery_date = get_supplier_delivery_date(data.input_date, data.quantity)
-    return DeliveryDateOutput(
-        delivery_date=delivery_date,
-        input_date=data.input_date,
-        quantity=data.quantity
-    )
+    from sqlalchemy.sql import text
 
+    if facet is not None and facet not in QUOTE_FACETS:
+        raise ValueError(f"Unknown facet '{facet}'. Must be one of: {', '.join(QUOTE_FACETS)}")
+    _ensure_quote_search_index()
+    query = "SELECT * FROM quote_facet_stats WHERE (:facet IS NULL OR facet = :facet) AND (:value IS NULL OR value = :value) ORDER BY facet, quotes DESC"
+    with get_engine().connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(text(query), {"facet": facet, "value": value})]
 
-# Set up your agents and create an orchestration agent that will manage them.
+def _ensure_quote_search_index() -> None:
+    """Build the quote search tables if the database predates them."""
+    from sqlalchemy import inspect
 
-# Inventory Agent - Handles inventory queries and stock level checks
-inventory_agent = Agent(
-    model=f'openai:{DEFAULT_MODEL_NAME}',
-    system_prompt="""You are an inventory management agent. Your role is to:
-    - Check stock levels for specific items
-    - Provide comprehensive inventory information
-    - Help determine availability of items for orders
-    - Report on inventory status as of specific dates
-    
-    Always use the tools provided to get accurate, real-time inventory data.
-    Format dates as YYYY-MM-DD (ISO format).""",
-    tools=[Tool(check_stock_level), Tool(get_all_inventory_items)]
-)
-
-# Quoting Agent - Handles quote generation and historical quote searches
-quoting_agent = Agent(
-    model=f'openai:{DEFAULT_MODEL_NAME}',
-    system_prompt="""You are a quoting agent. Your role is to:
-    - Search historical quotes to find similar past orders
-    - Help generate accurate quotes based on historical data
-    - Analyze quote patterns and pricing trends
-    - Provide insights from past quote requests and their outcomes
-    
-    Use the search tool to find relevant historical quotes that match customer requirements.
-    This helps inform pricing and quote generation decisions.""",
-    tools=[Tool(search_historical_quotes)]
-)
-
-# Ordering Agent - Handles order transactions, cash management, and delivery estimates
-ordering_agent = Agent(
-    model=f'openai:{DEFAULT_MODEL_NAME}',
-    system_prompt="""You are an ordering agent. Your role is to:
-    - Create transactions for stock orders and sales
-    - Check cash balance before making purchase decisions
-    - Calculate delivery dates for orders
-    - Ensure sufficient cash is available before ordering stock
-    - Record sales transactions when orders are fulfilled
-    
-    Always check cash balance before creating stock orders.
-    Verify that the company has sufficient funds.
-    Format dates as YYYY-MM-DD (ISO format).""",
-    tools=[Tool(create_order_transaction), Tool(get_cash_balance_info), Tool(check_delivery_date)]
-)
-
-# Orchestration Agent - Coordinates between all specialized agents
-orchestration_agent = Agent(
-    model=f'openai:{DEFAULT_MODEL_NAME}',
-    system_prompt="""You are an orchestration agent managing a multi-agent inventory management system.
-    
-    You coordinate three specialized agents:
-    1. **Inventory Agent**: Checks stock levels and inventory status
-    2. **Quoting Agent**: Searches historical quotes for pricing guidance
-    3. **Ordering Agent**: Creates transactions, manages cash, and calculates delivery dates
-    
-    Your responsibilities:
-    - Route customer requests to the appropriate specialized agent
-    - Coordinate multi-step workflows that require multiple agents
-    - Ensure proper workflow: check inventory → generate quote → process order
-    - Maintain context across agent interactions
-    
-    When a request comes in:
-    1. Determine which agent(s) are needed
-    2. Call the appropriate agent(s) with clear instructions
-    3. Synthesize the results into a comprehensive response
-    
-    Always ensure agents have the correct date format (YYYY-MM-DD) and required parameters.""",
-    tools=[Tool(check_stock_level), Tool(get_all_inventory_items), Tool(search_historical_quotes), 
-           Tool(create_order_transaction), Tool(get_cash_balance_info), Tool(check_delivery_date)]
-)
+    engine = get_engine()
+    if not inspect(engine).has_table("quote_facet_stats"):
+        build_quote_search_index(engine)
 
 
 # Run your test scenarios by writing them here. Make sure to keep track of them.
@@ -949,10 +1145,156 @@ def debug_agent_result(result, verbose=False):
     
     return debug_info
 
-async def run_test_scenarios():
-    
-    print("Initializing Database...")
-    init_database(db_engine)
+async def stream_agent_run(agent, prompt: str):
+    """
+    Run an agent with its streaming API, printing tokens and tool events as they arrive.
+
+    Args:
+        agent: The pydantic-ai Agent to run.
+        prompt: The user prompt to send.
+
+    Returns:
+        The final AgentRunResult, as returned by agent.run()
+    """
+    from pydantic_ai.messages import (
+        FunctionToolCallEvent,
+        FunctionToolResultEvent,
+        PartDeltaEvent,
+        PartStartEvent,
+        TextPart,
+        TextPartDelta,
+    )
+    from pydantic_ai.run import AgentRunResultEvent
+
+    result = None
+    async with agent.run_stream_events(prompt) as stream:
+        async for event in stream:
+            if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+                print(event.part.content, end="", flush=True)
+            elif isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+                print(event.delta.content_delta, end="", flush=True)
+            elif isinstance(event, FunctionToolCallEvent):
+                print(f"\n[TOOL CALL] {event.part.tool_name}({event.part.args_as_json_str()})", flush=True)
+            elif isinstance(event, FunctionToolResultEvent):
+                # Older pydantic-ai versions expose the return part as `result`
+                part = event.part if hasattr(event, "part") else event.result
+                content = str(part.content)
+                preview = content[:200] + "..." if len(content) > 200 else content
+                print(f"[TOOL RESULT] {part.tool_name} -> {preview}", flush=True)
+            elif isinstance(event, AgentRunResultEvent):
+                result = event.result
+    print()
+    return result
+
+# Columns of the results file written by run_test_scenarios
+RESULT_FIELDS = ["request_id", "request_date", "cash_balance", "inventory_value", "response"]
+
+def load_persisted_results(output_path: str) -> List[Dict]:
+    """
+    Load the results already written to a results file, dropping any incomplete trailing row.
+
+    The file is rewritten with only the complete rows, so that appending after a crash
+    mid-write cannot corrupt it.
+
+    Args:
+        output_path: Path of the CSV results file.
+
+    Returns:
+        List of result dictionaries, in file order. Empty if the file does not exist.
+    """
+    import csv
+
+    if not os.path.exists(output_path):
+        return []
+
+    with open(output_path, newline="") as f:
+        rows = [
+            row for row in csv.DictReader(f)
+            if all(row.get(field) is not None for field in RESULT_FIELDS) and None not in row
+        ]
+
+    for row in rows:
+        row["request_id"] = int(row["request_id"])
+        row["cash_balance"] = float(row["cash_balance"])
+        row["inventory_value"] = float(row["inventory_value"])
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, output_path)
+    return rows
+
+def append_result(output_path: str, result: Dict) -> None:
+    """
+    Append one result row to the results file and flush it to disk immediately.
+
+    Args:
+        output_path: Path of the CSV results file (the header is written if it is new).
+        result: Dictionary with the RESULT_FIELDS keys.
+    """
+    import csv
+
+    is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    with open(output_path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if is_new:
+            writer.writeheader()
+        writer.writerow({field: result[field] for field in RESULT_FIELDS})
+        f.flush()
+        os.fsync(f.fileno())
+
+async def run_test_scenarios(
+    stream: bool = False,
+    resume: bool = False,
+    output_path: str = "test_results.csv",
+    agent=None,
+):
+    """
+    Run the sample quote requests through the orchestration agent in date order.
+
+    Each finished result is appended to `output_path` as soon as it completes, so a
+    crash loses at most the request in flight. The ledger rows each request writes are
+    tagged with its id (see `request_writes.py`). On resume, the rows of a request that
+    was interrupted before its result was persisted are deleted before it runs again,
+    so its sales and stock orders are not recorded twice.
+
+    Args:
+        stream: If True, print tokens and tool events as they arrive instead of waiting
+                for each run to finish.
+        resume: If True, keep the existing results file and database state, skip the
+                requests already persisted in it, and roll back the writes of any
+                request that was interrupted.
+        output_path: CSV file that results are appended to.
+        agent: Agent to run requests through. Defaults to the orchestration agent.
+
+    Returns:
+        List of all result dictionaries, including those persisted by earlier runs.
+    """
+    import pandas as pd
+
+    from request_writes import rollback_request_writes, tagged_requests, tagging_writes
+
+    if agent is None:
+        from inventory_agents import build_agents
+
+        agent = build_agents()["orchestration_agent"]
+
+    results = load_persisted_results(output_path) if resume else []
+    completed_ids = {r["request_id"] for r in results}
+
+    if completed_ids:
+        print(f"Resuming: {len(completed_ids)} request(s) already persisted in {output_path}")
+        interrupted = tagged_requests("scenario:") - {f"scenario:{i}" for i in completed_ids}
+        if interrupted:
+            rolled_back = rollback_request_writes(interrupted)
+            print(f"Rolled back {rolled_back} transaction(s) of interrupted request(s): {sorted(interrupted)}")
+    else:
+        print("Initializing Database...")
+        init_database()
+        if os.path.exists(output_path):
+            os.remove(output_path)
     try:
         quote_requests_sample = pd.read_csv("quote_requests_sample.csv")
         quote_requests_sample["request_date"] = pd.to_datetime(
@@ -972,17 +1314,22 @@ async def run_test_scenarios():
     #)
     #quote_requests_sample = quote_requests_sample.sort_values("request_date")
 
-    # Get initial state
-    initial_date = quote_requests_sample["request_date"].min().strftime("%Y-%m-%d")
-    report = generate_financial_report(initial_date)
-    current_cash = report["cash_balance"]
-    current_inventory = report["inventory_value"]
+    # Get initial state, or the state after the last persisted request when resuming
+    if results:
+        current_cash = results[-1]["cash_balance"]
+        current_inventory = results[-1]["inventory_value"]
+    else:
+        initial_date = quote_requests_sample["request_date"].min().strftime("%Y-%m-%d")
+        report = generate_financial_report(initial_date)
+        current_cash = report["cash_balance"]
+        current_inventory = report["inventory_value"]
 
   
 
-    results = []
     for idx, row in quote_requests_sample.iterrows():
         request_date = row["request_date"].strftime("%Y-%m-%d")
+        if idx + 1 in completed_ids:
+            continue
 
         print(f"\n=== Request {idx+1} ===")
         print(f"Context: {row['job']} organizing {row['event']}")
@@ -996,7 +1343,13 @@ async def run_test_scenarios():
 
         # Run the orchestration agent with debugging
         try:
-            result = await orchestration_agent.run(request_with_date)
+            # Tag this request's ledger writes so a resume can undo them if it is interrupted
+            with tagging_writes(f"scenario:{idx + 1}"):
+                if stream:
+                    print("\n[STREAM]")
+                    result = await stream_agent_run(agent, request_with_date)
+                else:
+                    result = await agent.run(request_with_date)
             
             # Use helper function to extract debug info
             debug_info = debug_agent_result(result, verbose=False)
@@ -1040,18 +1393,27 @@ async def run_test_scenarios():
         print(f"Updated Cash: ${current_cash:.2f}")
         print(f"Updated Inventory: ${current_inventory:.2f}")
 
-        results.append(
-            {
-                "request_id": idx + 1,
-                "request_date": request_date,
-                "cash_balance": current_cash,
-                "inventory_value": current_inventory,
-                "response": response,
-            }
+        result_row = {
+            "request_id": idx + 1,
+            "request_date": request_date,
+            "cash_balance": current_cash,
+            "inventory_value": current_inventory,
+            "response": response,
+        }
+        # Persist immediately so a crash doesn't lose finished requests
+        append_result(output_path, result_row)
+        results.append(result_row)
+
+        # Throttling happens per model call in the shared rate limiter; report its live rates
+        from rate_limit import get_rate_limiter
+
+        rate = get_rate_limiter().metrics()
+        print(
+            f"[RATE] {rate['requests_last_min']} req/min, {rate['tokens_last_min']} tokens/min "
+            f"(limits {rate['rpm_limit']:.0f}/{rate['tpm_limit']:.0f}), retries {rate['retries']}, "
+            f"waited {rate['wait_s']:.1f}s"
         )
 
-        time.sleep(1)
-
     # Final report
     final_date = quote_requests_sample["request_date"].max().strftime("%Y-%m-%d")
     final_report = generate_financial_report(final_date)
@@ -1059,10 +1421,47 @@ async def run_test_scenarios():
     print(f"Final Cash: ${final_report['cash_balance']:.2f}")
     print(f"Final Inventory: ${final_report['inventory_value']:.2f}")
 
-    # Save results
-    pd.DataFrame(results).to_csv("test_results.csv", index=False)
     return results
 
 
 if __name__ == "__main__":
-    results = asyncio.run(run_test_scenarios())
\ No newline at end of file
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Run the sample quote requests through the agents")
+    parser.add_argument("--stream", action="store_true", help="Print tokens and tool events as they arrive")
+    parser.add_argument("--resume", action="store_true", help="Resume from the last persisted request")
+    parser.add_argument("--output", default="test_results.csv", help="Results file (default: test_results.csv)")
+    parser.add_argument("--route", action="store_true",
+                        help="Route requests between a fast and a strong model (see routing.py)")
+    parser.add_argument("--cache", action="store_true",
+                        help="Answer near-duplicate requests from a cache (see request_cache.py)")
+    args = parser.parse_args()
+    if args.stream and (args.route or args.cache):
+        parser.error("--stream cannot be combined with --route or --cache")
+
+    # Run through the importable module so the agents share its engine
+    import project_starter
+
+    agent = None
+    if args.route:
+        from routing import ModelRouter
+
+        agent = ModelRouter()
+    router = agent
+    if args.cache:
+        from inventory_agents import build_agents
+        from request_cache import CachedAgent
+
+        agent = CachedAgent(agent or build_agents()["orchestration_agent"])
+
+    results = asyncio.run(project_starter.run_test_scenarios(
+        stream=args.stream, resume=args.resume, output_path=args.output, agent=agent
+    ))
+
+    if args.route:
+        print("\n===== MODEL ROUTING =====")
+        print(json.dumps(router.summary(), indent=2))
+    if args.cache:
+        print("\n===== REQUEST CACHE =====")
+        print(json.dumps(agent.summary(), indent=2))
\ No newline at end of file
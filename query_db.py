@@ -0,0 +1,433 @@
+"""
+Database query tool for the Munder Difflin inventory management system.
+
+Serves the transactions, quotes, quote_requests, inventory and financial views
+in-process over the shared engine (instead of one sqlite3 process per section),
+reusing the library functions in `project_starter` for stock, cash and report
+figures so the numbers always match what the agents see.
+
+Usage: python query_db.py [view] [options]
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+import project_starter
+from project_starter import generate_financial_report, get_engine, ledger_row_id, ledger_table
+
+VIEWS = ("transactions", "quotes", "quote_requests", "inventory", "financial")
+
+# Rows fetched per round trip when streaming large result sets
+STREAM_BATCH_SIZE = 1000
+
+# Rows buffered to size the columns of the plain-text table output
+TABLE_SAMPLE_ROWS = 200
+
+# A section is (title, column names, iterable of row tuples)
+Section = Tuple[str, Sequence[str], Iterable[Sequence[Any]]]
+
+
+def stream_query(conn, query: str, params: Optional[Dict[str, Any]] = None) -> Tuple[List[str], Iterator[Sequence[Any]]]:
+    """
+    Execute a query and stream its rows in batches instead of loading them all.
+
+    Args:
+        conn: An open SQLAlchemy connection.
+        query (str): The SQL query to execute.
+        params (dict, optional): Bound parameters for the query.
+
+    Returns:
+        Tuple of (column names, iterator over row tuples).
+    """
+    from sqlalchemy.sql import text
+
+    result = conn.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE).execute(
+        text(query), params or {}
+    )
+    columns = list(result.keys())
+
+    def rows() -> Iterator[Sequence[Any]]:
+        for partition in result.partitions(STREAM_BATCH_SIZE):
+            for row in partition:
+                yield tuple(row)
+
+    return columns, rows()
+
+
+def _limit_clause(limit: Optional[int]) -> str:
+    return f"LIMIT {int(limit)}" if limit else ""
+
+
+# ----------------------------
+# Views
+# ----------------------------
+
+def transactions_view(conn, as_of: str, limit: Optional[int], count: bool, summary: bool) -> List[Section]:
+    """Build the sections for the transactions view."""
+    params = {"as_of_date": as_of}
+    where = "WHERE transaction_date <= :as_of_date"
+    # Through the full ledger for dates before a compaction cutoff, like the library
+    ledger = ledger_table(as_of)
+    row_id = ledger_row_id(ledger)
+
+    if count:
+        columns, rows = stream_query(conn, f"SELECT COUNT(*) AS total_transactions FROM {ledger} {where}", params)
+        return [("Transaction Count", columns, rows)]
+
+    if summary:
+        return [
+            ("Total Transactions",
+             *stream_query(conn, f"SELECT COUNT(*) AS total FROM {ledger} {where}", params)),
+            ("By Type", *stream_query(conn, f"""
+                SELECT transaction_type, COUNT(*) AS count,
+                       SUM(price) AS total_value,
+                       SUM(units) AS total_units
+                FROM {ledger}
+                {where} AND transaction_type IS NOT NULL
+                GROUP BY transaction_type""", params)),
+            ("Recent Transactions (last 10)", *stream_query(conn, f"""
+                SELECT {row_id} AS id, item_name, transaction_type, units, price, transaction_date
+                FROM {ledger}
+                {where}
+                ORDER BY transaction_date DESC, {row_id} DESC
+                LIMIT 10""", params)),
+        ]
+
+    return [("Transactions", *stream_query(conn, f"""
+        SELECT {row_id} AS id, item_name, transaction_type, units, price, transaction_date
+        FROM {ledger}
+        {where}
+        ORDER BY transaction_date DESC, {row_id} DESC
+        {_limit_clause(limit)}""", params))]
+
+
+def quotes_view(conn, as_of: str, limit: Optional[int], count: bool, summary: bool) -> List[Section]:
+    """Build the sections for the quotes view."""
+    params = {"as_of_date": as_of}
+    where = "WHERE order_date <= :as_of_date"
+
+    if count:
+        return [("Quote Count", *stream_query(conn, f"SELECT COUNT(*) AS total_quotes FROM quotes {where}", params))]
+
+    if summary:
+        return [
+            ("Total Quotes", *stream_query(conn, f"SELECT COUNT(*) AS total FROM quotes {where}", params)),
+            ("By Order Size", *stream_query(conn, f"""
+                SELECT order_size, COUNT(*) AS count,
+                       AVG(total_amount) AS avg_amount,
+                       SUM(total_amount) AS total_value
+                FROM quotes
+                {where} AND order_size IS NOT NULL AND order_size != ''
+                GROUP BY order_size""", params)),
+            ("By Event Type", *stream_query(conn, f"""
+                SELECT event_type, COUNT(*) AS count,
+                       AVG(total_amount) AS avg_amount
+                FROM quotes
+                {where} AND event_type IS NOT NULL AND event_type != ''
+                GROUP BY event_type""", params)),
+            ("Top 5 Quotes by Amount", *stream_query(conn, f"""
+                SELECT request_id, total_amount, job_type, order_size, event_type, order_date
+                FROM quotes
+                {where}
+                ORDER BY total_amount DESC
+                LIMIT 5""", params)),
+        ]
+
+    return [("Quotes", *stream_query(conn, f"""
+        SELECT request_id, total_amount, job_type, order_size, event_type, order_date
+        FROM quotes
+        {where}
+        ORDER BY order_date DESC, request_id DESC
+        {_limit_clause(limit)}""", params))]
+
+
+def quote_requests_view(conn, as_of: str, limit: Optional[int], count: bool, summary: bool) -> List[Section]:
+    """Build the sections for the quote_requests view (requests are undated, so `as_of` is ignored)."""
+    if count:
+        return [("Quote Request Count", *stream_query(conn, "SELECT COUNT(*) AS total_requests FROM quote_requests"))]
+
+    if summary:
+        return [
+            ("Total Requests", *stream_query(conn, "SELECT COUNT(*) AS total FROM quote_requests")),
+            ("Sample Requests (first 5)", *stream_query(conn, """
+                SELECT id, substr(response, 1, 100) || '...' AS request_preview
+                FROM quote_requests
+                ORDER BY id
+                LIMIT 5""")),
+        ]
+
+    return [("Quote Requests", *stream_query(conn, f"""
+        SELECT id, substr(response, 1, 150) || '...' AS request_preview
+        FROM quote_requests
+        ORDER BY id
+        {_limit_clause(limit)}"""))]
+
+
+def _inventory_rows(conn, as_of: str) -> List[Dict[str, Any]]:
+    """
+    Combine the inventory reference table with stock levels as of a date.
+
+    Stock and value come from `generate_financial_report`, so they reflect the
+    transaction ledger rather than the static `current_stock` seed column.
+    """
+    report = generate_financial_report(as_of)
+    _, reference = stream_query(conn, "SELECT item_name, category, min_stock_level FROM inventory")
+    meta = {name: (category, min_level) for name, category, min_level in reference}
+
+    rows = []
+    for item in report["inventory_summary"]:
+        category, min_level = meta.get(item["item_name"], ("", 0))
+        rows.append({
+            "item_name": item["item_name"],
+            "category": category,
+            "unit_price": float(item["unit_price"]),
+            "stock": int(item["stock"]),
+            "min_stock_level": int(min_level),
+            "value": float(item["value"]),
+        })
+    return rows
+
+
+def inventory_view(conn, as_of: str, limit: Optional[int], count: bool, summary: bool) -> List[Section]:
+    """Build the sections for the inventory view, with stock levels as of `as_of`."""
+    if count:
+        return [("Inventory Item Count", *stream_query(conn, "SELECT COUNT(*) AS total_items FROM inventory"))]
+
+    items = _inventory_rows(conn, as_of)
+    item_columns = ["item_name", "category", "unit_price", "stock", "min_stock_level", "value"]
+
+    if summary:
+        by_category: Dict[str, List[Any]] = {}
+        for item in items:
+            totals = by_category.setdefault(item["category"], [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += item["stock"]
+            totals[2] += item["value"]
+
+        low_stock = sorted(
+            (item for item in items if item["stock"] < item["min_stock_level"]),
+            key=lambda item: item["stock"] - item["min_stock_level"],
+        )
+        top_value = sorted(items, key=lambda item: item["value"], reverse=True)[:10]
+
+        return [
+            ("Total Items", ["total"], [(len(items),)]),
+            ("By Category", ["category", "item_count", "total_stock", "total_value"],
+             [(category, *totals) for category, totals in sorted(by_category.items())]),
+            ("Low Stock Items (below min_stock_level)", item_columns,
+             [tuple(item[c] for c in item_columns) for item in low_stock]),
+            ("Top 10 Items by Stock Value", item_columns,
+             [tuple(item[c] for c in item_columns) for item in top_value]),
+        ]
+
+    items = sorted(items, key=lambda item: item["item_name"])
+    if limit:
+        items = items[:limit]
+    return [("Inventory", item_columns, [tuple(item[c] for c in item_columns) for item in items])]
+
+
+def financial_view(conn, as_of: str, limit: Optional[int], count: bool, summary: bool) -> List[Section]:
+    """Build the financial summary sections as of `as_of`."""
+    report = generate_financial_report(as_of)
+    params = {"as_of_date": as_of}
+    ledger = ledger_table(as_of)
+
+    return [
+        ("Balance Sheet", ["as_of_date", "cash_balance", "inventory_value", "total_assets"],
+         [(as_of[:10], report["cash_balance"], report["inventory_value"], report["total_assets"])]),
+        ("Total Sales Revenue", *stream_query(conn, f"""
+            SELECT COUNT(*) AS transaction_count,
+                   SUM(price) AS total_revenue,
+                   SUM(units) AS total_units_sold
+            FROM {ledger}
+            WHERE transaction_type = 'sales' AND item_name IS NOT NULL
+            AND transaction_date <= :as_of_date""", params)),
+        ("Total Stock Purchases", *stream_query(conn, f"""
+            SELECT COUNT(*) AS transaction_count,
+                   SUM(price) AS total_cost,
+                   SUM(units) AS total_units_purchased
+            FROM {ledger}
+            WHERE transaction_type = 'stock_orders'
+            AND transaction_date <= :as_of_date""", params)),
+        ("Top Selling Products", ["item_name", "total_units", "total_revenue"],
+         [(p["item_name"], p["total_units"], p["total_revenue"]) for p in report["top_selling_products"]]),
+    ]
+
+
+def overview_view(conn, as_of: str, limit: Optional[int], count: bool, summary: bool) -> List[Section]:
+    """Build the table-count overview shown when no view is given."""
+    return [("Table Counts", *stream_query(conn, """
+        SELECT 'transactions' AS table_name, COUNT(*) AS count FROM transactions
+        UNION ALL
+        SELECT 'quotes', COUNT(*) FROM quotes
+        UNION ALL
+        SELECT 'quote_requests', COUNT(*) FROM quote_requests
+        UNION ALL
+        SELECT 'inventory', COUNT(*) FROM inventory"""))]
+
+
+VIEW_BUILDERS = {
+    "transactions": transactions_view,
+    "quotes": quotes_view,
+    "quote_requests": quote_requests_view,
+    "inventory": inventory_view,
+    "financial": financial_view,
+    None: overview_view,
+}
+
+
+# ----------------------------
+# Output writers
+# ----------------------------
+
+def _json_default(value: Any) -> Any:
+    # numpy scalars coming back from pandas-based library functions
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def _json_value(value: Any) -> Any:
+    """Map missing values (NaN, pandas NA) to None, since JSON has no NaN."""
+    if hasattr(value, "item") and not isinstance(value, (list, dict)):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if type(value).__name__ in ("NAType", "NaTType"):
+        return None
+    return value
+
+
+def write_json(sections: List[Section], out: TextIO) -> None:
+    """Write sections as a JSON object of {title: [row objects]}, streaming rows as they arrive."""
+    out.write("{")
+    for i, (title, columns, rows) in enumerate(sections):
+        out.write(("," if i else "") + "\n  " + json.dumps(title) + ": [")
+        for j, row in enumerate(rows):
+            record = {column: _json_value(value) for column, value in zip(columns, row)}
+            # allow_nan=False: a missing value that slipped through fails here instead of writing invalid JSON
+            out.write(("," if j else "") + "\n    " + json.dumps(record, default=_json_default, allow_nan=False))
+        out.write("\n  ]")
+    out.write("\n}\n")
+
+
+def write_csv(sections: List[Section], out: TextIO) -> None:
+    """Write sections as CSV; multiple sections are separated by a '# title' line."""
+    writer = csv.writer(out)
+    for i, (title, columns, rows) in enumerate(sections):
+        if len(sections) > 1:
+            if i:
+                out.write("\n")
+            out.write(f"# {title}\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+
+
+def _format_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def write_table(sections: List[Section], out: TextIO) -> None:
+    """
+    Write sections as aligned plain-text tables.
+
+    Column widths are sized from the first `TABLE_SAMPLE_ROWS` rows; the remaining
+    rows are streamed with those widths so large tables never sit fully in memory.
+    """
+    for i, (title, columns, rows) in enumerate(sections):
+        if i:
+            out.write("\n")
+        out.write(f"{title}:\n")
+
+        rows = iter(rows)
+        sample = []
+        for row in rows:
+            sample.append([_format_cell(v) for v in row])
+            if len(sample) >= TABLE_SAMPLE_ROWS:
+                break
+
+        widths = [len(c) for c in columns]
+        for row in sample:
+            widths = [max(w, len(v)) for w, v in zip(widths, row)]
+
+        def emit(cells: Sequence[str]) -> None:
+            out.write("  ".join(c.ljust(w) for c, w in zip(cells, widths)).rstrip() + "\n")
+
+        emit(list(columns))
+        emit(["-" * w for w in widths])
+        for row in sample:
+            emit(row)
+        for row in rows:
+            emit([_format_cell(v) for v in row])
+
+
+WRITERS = {"table": write_table, "json": write_json, "csv": write_csv}
+
+
+# ----------------------------
+# Command line
+# ----------------------------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Munder Difflin Database Query Tool",
+        epilog=(
+            "Examples:\n"
+            "  python query_db.py transactions --limit 10\n"
+            "  python query_db.py quotes --summary\n"
+            "  python query_db.py inventory --as-of 2025-04-15 --format csv\n"
+            "  python query_db.py financial --format json"
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("view", nargs="?", choices=VIEWS,
+                        help="View to query; omit for an overview of table counts")
+    parser.add_argument("--as-of", default=date.today().isoformat(),
+                        help="Cutoff date (YYYY-MM-DD) for ledger-based figures, passed to the library "
+                             "functions as is, like the agents' tools do (default: today)")
+    # Showing all records is the default; --all is still accepted for existing scripts
+    parser.add_argument("--all", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--limit", type=int, help="Limit results to N rows")
+    parser.add_argument("--count", action="store_true", help="Show count of records")
+    parser.add_argument("--summary", action="store_true", help="Show summary statistics")
+    parser.add_argument("--financial", action="store_true",
+                        help="Show the financial summary (same as the 'financial' view)")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="table", help="Output format (default: table)")
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None, out: TextIO = sys.stdout) -> int:
+    args = build_parser().parse_args(argv)
+    view = "financial" if args.financial else args.view
+
+    db_url = project_starter.DB_URL
+    if db_url.startswith("sqlite:///") and not os.path.exists(db_url[len("sqlite:///"):]):
+        print(f"Error: Database file '{db_url[len('sqlite:///'):]}' not found!", file=sys.stderr)
+        print("Please run project_starter.py first to initialize the database.", file=sys.stderr)
+        return 1
+
+    with get_engine().connect() as conn:
+        # Passed through as given, like the agents' tools do, so the figures match theirs
+        sections = VIEW_BUILDERS[view](conn, args.as_of, args.limit, args.count, args.summary)
+        try:
+            WRITERS[args.format](sections, out)
+        except BrokenPipeError:
+            # Output piped into e.g. `head`; stop quietly
+            sys.stderr.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
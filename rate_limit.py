@@ -0,0 +1,460 @@
+"""
+Adaptive rate limiting and retry/backoff for LLM calls.
+
+`RateLimiter` is an async token bucket shared by every agent: one bucket for requests
+per minute (RPM) and one for tokens per minute (TPM). Each model request reserves one
+request and an estimate of its tokens up front; once the response arrives the token
+bucket is corrected with the actual usage. When the provider still answers 429 (or a
+transient 5xx), the limiter pauses all callers for the server's `Retry-After` (or a
+jittered exponential backoff when none is given) and halves its effective rate, which
+then recovers gradually as requests succeed.
+
+`RateLimitedModel` wraps any pydantic_ai model with a limiter, so it works for the
+OpenAI models as well as `TestModel`/`FunctionModel`. `rate_limited_openai_model()`
+builds the OpenAI model the agents use by default, with the SDK's own retries turned
+off so the shared limiter is the single place that throttles and retries.
+
+`check_against_fake_endpoint()` serves a local OpenAI-compatible endpoint that injects
+429s and latency, and runs concurrent agent requests through the limiter against it.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+# Defaults for the shared limiter (override with OPENAI_RPM_LIMIT / OPENAI_TPM_LIMIT)
+DEFAULT_RPM_LIMIT = 500
+DEFAULT_TPM_LIMIT = 200_000
+
+# Statuses worth retrying: rate limited, or a transient server error
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Output tokens assumed for a request that doesn't set max_tokens
+DEFAULT_OUTPUT_TOKEN_ESTIMATE = 512
+
+
+class RateLimiter:
+    """
+    Shared async token bucket for requests and tokens per minute, with adaptive backoff.
+
+    The limiter is lock-free: callers reserve capacity immediately (letting a bucket go
+    negative) and sleep until their reservation is covered, so waiting callers are
+    served in arrival order without holding a lock across awaits.
+    """
+
+    def __init__(
+        self,
+        rpm: float = DEFAULT_RPM_LIMIT,
+        tpm: float = DEFAULT_TPM_LIMIT,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        min_rate_scale: float = 0.1,
+    ):
+        """
+        Args:
+            rpm: Requests per minute allowed across all callers.
+            tpm: Tokens (input + output) per minute allowed across all callers.
+            max_retries: Retries per request on a retryable error before giving up.
+            base_delay: First backoff step in seconds when no Retry-After is given.
+            max_delay: Upper bound for a single backoff in seconds.
+            min_rate_scale: Lowest fraction of the configured rates to throttle down to.
+        """
+        if rpm <= 0 or tpm <= 0:
+            raise ValueError("rpm and tpm must be positive")
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_rate_scale = min_rate_scale
+
+        self._request_tokens = float(rpm)
+        self._token_tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # Fraction of the configured rates currently in use (lowered on 429, recovers on success)
+        self.rate_scale = 1.0
+
+        self._recent: deque = deque()  # (timestamp, tokens) of completed requests in the last minute
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.wait_s = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._request_tokens = min(self.rpm, self._request_tokens + elapsed * self.rpm * self.rate_scale / 60)
+        self._token_tokens = min(self.tpm, self._token_tokens + elapsed * self.tpm * self.rate_scale / 60)
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """
+        Reserve one request and `tokens` tokens, waiting until both buckets cover them.
+
+        Args:
+            tokens: Estimated tokens for the request (capped at the TPM limit).
+
+        Returns:
+            Seconds spent waiting.
+        """
+        self._refill()
+        tokens = min(tokens, self.tpm)
+        self._request_tokens -= 1
+        self._token_tokens -= tokens
+
+        now = time.monotonic()
+        wait = max(
+            self._paused_until - now,
+            -self._request_tokens * 60 / (self.rpm * self.rate_scale),
+            -self._token_tokens * 60 / (self.tpm * self.rate_scale),
+            0.0,
+        )
+        if wait > 0:
+            self.throttled += 1
+            self.wait_s += wait
+            await asyncio.sleep(wait)
+        return wait
+
+    def release(self, tokens: int) -> None:
+        """Return reserved tokens for a request that was rejected without using them."""
+        self._token_tokens = min(self.tpm, self._token_tokens + tokens)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket with the actual usage of a completed request."""
+        self._refill()
+        self._token_tokens += estimated_tokens - actual_tokens
+        self.requests += 1
+        now = time.monotonic()
+        self._recent.append((now, actual_tokens))
+        self.rate_scale = min(1.0, self.rate_scale + 0.05)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None, rate_limited: bool = True) -> float:
+        """
+        Pause every caller before the next attempt and return the delay.
+
+        Honors `retry_after` when the server gives one; otherwise uses full-jitter
+        exponential backoff (a random delay up to base_delay * 2**attempt). A 429 also
+        halves the effective rate.
+        """
+        self.retries += 1
+        if rate_limited:
+            self.rate_limited += 1
+            self.rate_scale = max(self.min_rate_scale, self.rate_scale / 2)
+        if retry_after is not None:
+            delay = min(retry_after, self.max_delay) + random.uniform(0, self.base_delay / 2)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return live request/token rates over the last minute and the throttling counters."""
+        now = time.monotonic()
+        while self._recent and now - self._recent[0][0] > 60:
+            self._recent.popleft()
+        self._refill()
+        return {
+            "requests_last_min": len(self._recent),
+            "tokens_last_min": sum(tokens for _, tokens in self._recent),
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "rate_scale": round(self.rate_scale, 3),
+            "available_requests": round(max(self._request_tokens, 0.0), 1),
+            "available_tokens": round(max(self._token_tokens, 0.0)),
+            "requests": self.requests,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "throttled": self.throttled,
+            "wait_s": round(self.wait_s, 3),
+        }
+
+
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide limiter, configured from OPENAI_RPM_LIMIT / OPENAI_TPM_LIMIT."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(
+            rpm=float(os.getenv("OPENAI_RPM_LIMIT", DEFAULT_RPM_LIMIT)),
+            tpm=float(os.getenv("OPENAI_TPM_LIMIT", DEFAULT_TPM_LIMIT)),
+        )
+    return _rate_limiter
+
+
+def estimate_request_tokens(messages: list, model_settings: Optional[dict] = None) -> int:
+    """Estimate the tokens a request will use: ~4 characters per prompt token plus the output budget."""
+    from pydantic_ai.messages import ModelRequest, ModelResponse
+
+    chars = 0
+    for message in messages:
+        if isinstance(message, (ModelRequest, ModelResponse)):
+            for part in message.parts:
+                content = getattr(part, "content", None) or getattr(part, "args", None)
+                chars += len(str(content)) if content is not None else 0
+    max_tokens = (model_settings or {}).get("max_tokens") or DEFAULT_OUTPUT_TOKEN_ESTIMATE
+    return chars // 4 + max_tokens
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        try:
+            return max(float(headers["retry-after"]), 0.0)
+        except ValueError:
+            return getattr(error, "retry_after", None)
+    return None
+
+
+def _make_rate_limited_model_class():
+    from pydantic_ai.exceptions import ModelHTTPError
+    from pydantic_ai.models.wrapper import WrapperModel
+
+    class RateLimitedModel(WrapperModel):
+        """pydantic_ai model wrapper that routes every request through a `RateLimiter`."""
+
+        def __init__(self, wrapped, limiter: Optional[RateLimiter] = None):
+            super().__init__(wrapped)
+            self.limiter = limiter or get_rate_limiter()
+
+        async def _with_retries(self, messages, model_settings, call):
+            limiter = self.limiter
+            estimate = estimate_request_tokens(messages, model_settings)
+            for attempt in range(limiter.max_retries + 1):
+                await limiter.acquire(estimate)
+                try:
+                    return await call(), estimate
+                except ModelHTTPError as e:
+                    if e.status_code not in RETRYABLE_STATUS or attempt == limiter.max_retries:
+                        limiter.failures += 1
+                        raise
+                    limiter.release(estimate)
+                    limiter.backoff(attempt, _retry_after(e), rate_limited=e.status_code == 429)
+
+        async def request(self, messages, model_settings, model_request_parameters):
+            response, estimate = await self._with_retries(
+                messages,
+                model_settings,
+                lambda: self.wrapped.request(messages, model_settings, model_request_parameters),
+            )
+            self.limiter.record_usage(estimate, response.usage.input_tokens + response.usage.output_tokens)
+            return response
+
+        @asynccontextmanager
+        async def request_stream(self, messages, model_settings, model_request_parameters, run_context=None):
+            # Only opening the stream is retried; a stream that fails midway is not replayed
+            stack = None
+
+            async def open_stream():
+                nonlocal stack
+                stack = self.wrapped.request_stream(messages, model_settings, model_request_parameters, run_context)
+                return await stack.__aenter__()
+
+            stream, estimate = await self._with_retries(messages, model_settings, open_stream)
+            try:
+                yield stream
+            except BaseException as e:
+                if not await stack.__aexit__(type(e), e, e.__traceback__):
+                    raise
+            else:
+                await stack.__aexit__(None, None, None)
+            finally:
+                usage = stream.usage
+                self.limiter.record_usage(estimate, usage.input_tokens + usage.output_tokens)
+
+    return RateLimitedModel
+
+
+def __getattr__(name: str):
+    # RateLimitedModel subclasses a pydantic_ai class, so it's only defined on first use
+    if name == "RateLimitedModel":
+        cls = _make_rate_limited_model_class()
+        globals()[name] = cls
+        return cls
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def rate_limited_openai_model(
+    model_name: str,
+    limiter: Optional[RateLimiter] = None,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+):
+    """
+    Build an OpenAI chat model whose requests go through the shared rate limiter.
+
+    The OpenAI SDK's own retries are disabled so 429s surface to the limiter, which
+    backs off for every agent at once instead of each request retrying on its own.
+
+    Args:
+        model_name: OpenAI model name, e.g. 'gpt-4.1-nano'.
+        limiter: Limiter to use. Defaults to the process-wide `get_rate_limiter()`.
+        base_url: Optional API base URL (e.g. a local OpenAI-compatible server).
+        api_key: Optional API key. Defaults to OPENAI_API_KEY.
+
+    Returns:
+        A RateLimitedModel wrapping an OpenAIChatModel.
+    """
+    from openai import AsyncOpenAI
+    from pydantic_ai.models.openai import OpenAIChatModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    client = AsyncOpenAI(base_url=base_url, api_key=api_key or os.getenv("OPENAI_API_KEY"), max_retries=0)
+    model = OpenAIChatModel(model_name, provider=OpenAIProvider(openai_client=client))
+    return __getattr__("RateLimitedModel")(model, limiter)
+
+
+# Local fake endpoint for exercising the limiter
+
+def serve_fake_openai(error_rate: float = 0.3, latency_s: float = 0.05, retry_after_s: float = 0.2, seed: int = 0):
+    """
+    Start an OpenAI-compatible chat completions server on localhost in a background thread.
+
+    A fraction `error_rate` of requests is answered with 429 and a `Retry-After` header
+    (in seconds, alternating with the millisecond `retry-after-ms` header OpenAI also
+    sends); every request is delayed by `latency_s`.
+
+    Returns:
+        (server, stats): the ThreadingHTTPServer (call `shutdown()` when done) and a dict
+        counting 'requests' and 'rate_limited' responses.
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    rng = random.Random(seed)
+    stats = {"requests": 0, "rate_limited": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(latency_s)
+            with lock:
+                stats["requests"] += 1
+                limited = rng.random() < error_rate
+                stats["rate_limited"] += int(limited)
+                use_ms = stats["rate_limited"] % 2 == 0
+            if limited:
+                header = (
+                    {"retry-after-ms": str(int(retry_after_s * 1000))}
+                    if use_ms else {"Retry-After": str(max(1, round(retry_after_s)))}
+                )
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, header)
+                return
+
+            prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+            self._send(200, {
+                "id": f"chatcmpl-{stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Quote prepared."},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 4, "total_tokens": prompt_tokens + 4},
+            })
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+async def check_against_fake_endpoint(
+    n_requests: int = 40,
+    concurrency: int = 10,
+    rpm: float = 600,
+    tpm: float = 100_000,
+    error_rate: float = 0.3,
+    latency_s: float = 0.05,
+    retry_after_s: float = 0.2,
+) -> Dict[str, Any]:
+    """
+    Send concurrent agent requests through a RateLimiter to a fake endpoint that injects 429s.
+
+    Checks that every request eventually succeeds, that the observed request rate stays
+    within the RPM limit, and returns the limiter metrics alongside the server counts.
+
+    Args:
+        n_requests: Total agent runs.
+        concurrency: Agent runs in flight at once.
+        rpm: Requests per minute for the limiter under test.
+        tpm: Tokens per minute for the limiter under test.
+        error_rate: Fraction of requests the fake endpoint rejects with 429.
+        latency_s: Latency the fake endpoint adds to every request.
+        retry_after_s: Retry-After the fake endpoint asks for.
+
+    Returns:
+        Dict with 'elapsed_s', 'server' counts, 'limiter' metrics and 'observed_rpm'.
+    """
+    from pydantic_ai import Agent
+
+    server, server_stats = serve_fake_openai(error_rate, latency_s, retry_after_s)
+    limiter = RateLimiter(rpm=rpm, tpm=tpm, base_delay=0.1)
+    # Start from an empty bucket so the RPM limit governs the whole run, not just the burst after it
+    limiter._request_tokens = 0.0
+    try:
+        model = rate_limited_openai_model(
+            "gpt-4.1-nano", limiter, base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", api_key="fake"
+        )
+        agent = Agent(model=model, system_prompt="You prepare quotes.")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i: int) -> str:
+            async with semaphore:
+                return (await agent.run(f"Request {i}: 100 sheets of A4 paper")).output
+
+        started = time.perf_counter()
+        outputs = await asyncio.gather(*(one(i) for i in range(n_requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    assert all(output == "Quote prepared." for output in outputs)
+    assert server_stats["requests"] - server_stats["rate_limited"] == n_requests
+    observed_rpm = server_stats["requests"] / elapsed * 60
+    # Allow a single-request burst on top of the configured rate
+    assert observed_rpm <= rpm * 1.05 + 60 / elapsed, f"observed {observed_rpm:.0f} rpm > limit {rpm}"
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "server": server_stats,
+        "limiter": limiter.metrics(),
+        "observed_rpm": round(observed_rpm),
+    }
+
+
+if __name__ == "__main__":
+    import json
+
+    print(json.dumps(asyncio.run(check_against_fake_endpoint()), indent=2))
@@ -0,0 +1,457 @@
+"""
+Near-duplicate request cache.
+
+Many customer requests ask for the same items in the same quantities and differ only
+in tone, greeting or dates. Each one used to trigger a full agent workflow. This
+module fingerprints a request by what it asks for:
+- the parsed items, mapped onto catalog items where possible
+- their quantities
+- its deadline, relative to the request date when that is known
+Runs with the same fingerprint share a cached plan: the final response plus the
+transactions the run recorded.
+
+An entry is only reused while the inputs the plan depended on are unchanged:
+- the unit prices of the items involved
+- whether each item still has enough available stock for the quantity needed
+- whether the cash balance still covers the stock orders the plan placed
+A stale entry is dropped and the request runs normally.
+
+On a hit, `CachedAgent` replays the recorded transactions in one database transaction,
+shifted to the new request date. Sales are replayed with the oversell check from
+`reservations.py`. The cached response is returned with its dates shifted the same way.
+
+`report_cache_hit_rate()` fingerprints the requests in `quote_requests.csv` against
+the current database and reports the hit rate and the latency the hits would save.
+"""
+from __future__ import annotations
+
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from project_starter import get_cash_balance, get_engine, paper_supplies
+from routing import extract_items, match_catalog_item
+
+# Assumed wall time of one full orchestration run, for the latency-saved estimate
+DEFAULT_AGENT_LATENCY_S = 10.0
+
+_MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*"
+_DATE_RE = re.compile(
+    rf"\b(\d{{4}}-\d{{2}}-\d{{2}})\b|\b({_MONTHS}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}})\b", re.IGNORECASE
+)
+_REQUEST_DATE_RE = re.compile(r"\(?Date of request:\s*(\d{4}-\d{2}-\d{2})\)?", re.IGNORECASE)
+_DESCRIPTION_STOP_WORDS = {"of", "the", "and", "a", "an", "for", "with", "in", "our", "some", "high", "quality"}
+
+
+def _parse_date(text: str) -> Optional[datetime]:
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", text):
+        return datetime.fromisoformat(text)
+    cleaned = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", text.replace(",", " ").replace(".", " "))
+    cleaned = " ".join(cleaned.split())
+    for fmt in ("%B %d %Y", "%b %d %Y"):
+        try:
+            return datetime.strptime(cleaned, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _normalize_description(description: str) -> str:
+    words = []
+    for word in re.findall(r"[a-z0-9]+", description.lower()):
+        if word in _DESCRIPTION_STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+@dataclass(frozen=True)
+class RequestFingerprint:
+    """What a request asks for, independent of its wording."""
+    items: Tuple[Tuple[str, int], ...]  # sorted ("<unit> of <catalog item>" or normalized description, quantity)
+    deadline: Optional[str]             # "+<days>" after the request date, or the ISO deadline
+    request_date: Optional[str]         # YYYY-MM-DD, if the request carries one
+    catalog_items: Dict[str, int] = field(default_factory=dict, compare=False, hash=False)
+
+    @property
+    def key(self) -> Tuple:
+        return self.items, self.deadline
+
+
+def fingerprint_request(request: str) -> Optional[RequestFingerprint]:
+    """
+    Fingerprint a request by its parsed items, quantities and deadline.
+
+    Args:
+        request (str): The request text, optionally ending in "(Date of request: YYYY-MM-DD)".
+
+    Returns:
+        RequestFingerprint, or None if the items couldn't be fully parsed (such requests
+        aren't cached).
+    """
+    match = _REQUEST_DATE_RE.search(request)
+    request_date = match.group(1) if match else None
+    body = _REQUEST_DATE_RE.sub("", request)
+
+    mentions = extract_items(body)
+    # Only fingerprint requests whose every number (outside dates) was parsed as an item
+    # quantity; an unparsed item would let requests for different orders collide
+    numbers = re.findall(r"\b\d[\d,]*\b", _DATE_RE.sub("", body))
+    if not mentions or len(numbers) != len(mentions):
+        return None
+
+    # Items that map onto the catalog are keyed by unit and catalog name, so "sheets of
+    # colorful cardstock" and "sheets of colored cardstock (assorted)" fingerprint alike;
+    # the rest by their normalized text
+    items = []
+    catalog_items: Dict[str, int] = {}
+    for quantity, description in mentions:
+        name = match_catalog_item(description)
+        if name is not None:
+            catalog_items[name] = catalog_items.get(name, 0) + quantity
+            unit = _normalize_description(description.split()[0])
+            items.append((f"{unit} of {name}", quantity))
+        else:
+            items.append((_normalize_description(description), quantity))
+
+    deadline = None
+    dates = [d for d in (_parse_date(m.group(0)) for m in _DATE_RE.finditer(body)) if d is not None]
+    if dates:
+        deadline_dt = max(dates)
+        if request_date:
+            deadline = f"+{(deadline_dt - datetime.fromisoformat(request_date)).days}d"
+        else:
+            deadline = deadline_dt.strftime("%Y-%m-%d")
+
+    return RequestFingerprint(items=tuple(sorted(items)), deadline=deadline, request_date=request_date, catalog_items=catalog_items)
+
+
+@dataclass
+class CachedPlan:
+    """A finished run's response and writes, with the inputs they depended on."""
+    response: str
+    request_date: Optional[str]
+    writes: List[Dict]
+    needed: Dict[str, int]            # catalog item -> units the plan needed in stock
+    unit_prices: Dict[str, Optional[float]]
+    in_stock: Dict[str, bool]
+    cash_required: float
+    hits: int = 0
+
+
+def _unit_prices(item_names: List[str]) -> Dict[str, Optional[float]]:
+    from sqlalchemy import bindparam, text
+
+    prices: Dict[str, Optional[float]] = {
+        item["item_name"]: item["unit_price"] for item in paper_supplies if item["item_name"] in item_names
+    }
+    if item_names:
+        query = text("SELECT item_name, unit_price FROM inventory WHERE item_name IN :names").bindparams(
+            bindparam("names", expanding=True)
+        )
+        with get_engine().connect() as conn:
+            prices.update({row.item_name: row.unit_price for row in conn.execute(query, {"names": item_names})})
+    return {name: prices.get(name) for name in item_names}
+
+
+def _in_stock(needed: Dict[str, int], as_of_date: str) -> Dict[str, bool]:
+    from reservations import get_available_stock
+
+    return {name: get_available_stock(name, as_of_date) >= units for name, units in needed.items()}
+
+
+def _as_of(fingerprint: RequestFingerprint, as_of_date: Optional[str]) -> str:
+    return as_of_date or fingerprint.request_date or datetime.now().strftime("%Y-%m-%d")
+
+
+class RequestCache:
+    """LRU cache of plans keyed by request fingerprint, validated against current inputs on lookup."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, CachedPlan]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.lookup_s = 0.0
+        self.hit_lookup_s = 0.0
+
+    def lookup(self, fingerprint: RequestFingerprint, as_of_date: Optional[str] = None) -> Optional[CachedPlan]:
+        """
+        Return the cached plan for a fingerprint if its inputs are unchanged.
+
+        Args:
+            fingerprint: The request's fingerprint.
+            as_of_date: Date to re-validate stock and cash at. Defaults to the request date.
+
+        Returns:
+            CachedPlan, or None on a miss or if the entry was stale (it is then dropped).
+        """
+        started = time.perf_counter()
+        try:
+            plan = self._entries.get(fingerprint.key)
+            if plan is None:
+                self.misses += 1
+                return None
+            as_of = _as_of(fingerprint, as_of_date)
+            valid = (
+                _unit_prices(list(plan.unit_prices)) == plan.unit_prices
+                and _in_stock(plan.needed, as_of) == plan.in_stock
+                and (plan.cash_required <= 0 or get_cash_balance(as_of) >= plan.cash_required)
+            )
+            if not valid:
+                self.invalidate(fingerprint)
+                return None
+            self._entries.move_to_end(fingerprint.key)
+            self.hits += 1
+            self.hit_lookup_s += time.perf_counter() - started
+            plan.hits += 1
+            return plan
+        finally:
+            self.lookup_s += time.perf_counter() - started
+
+    def store(
+        self,
+        fingerprint: RequestFingerprint,
+        response: str,
+        writes: Optional[List[Dict]] = None,
+        as_of_date: Optional[str] = None,
+    ) -> CachedPlan:
+        """
+        Cache a finished run's response and writes, snapshotting the inputs it depended on.
+
+        Args:
+            fingerprint: The request's fingerprint.
+            response: The final response text.
+            writes: Transactions the run recorded (see `inventory_agents.recording_writes`).
+            as_of_date: Date the inputs are snapshotted at. Defaults to the request date.
+
+        Returns:
+            The stored CachedPlan.
+        """
+        writes = list(writes or [])
+        needed = dict(fingerprint.catalog_items)
+        for write in writes:
+            if write["transaction_type"] == "sales":
+                needed[write["item_name"]] = max(needed.get(write["item_name"], 0), write["quantity"])
+        as_of = _as_of(fingerprint, as_of_date)
+        # Snapshot before the plan's own writes are applied, matching what a lookup sees
+        in_stock = _in_stock(needed, as_of)
+        involved = sorted(set(needed) | {w["item_name"] for w in writes})
+        plan = CachedPlan(
+            response=response,
+            request_date=fingerprint.request_date,
+            writes=writes,
+            needed=needed,
+            unit_prices=_unit_prices(involved),
+            in_stock=in_stock,
+            cash_required=sum(w["price"] for w in writes if w["transaction_type"] == "stock_orders"),
+        )
+        self._entries[fingerprint.key] = plan
+        self._entries.move_to_end(fingerprint.key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return plan
+
+    def invalidate(self, fingerprint: RequestFingerprint) -> None:
+        """Drop the entry for a fingerprint and count it as stale."""
+        if self._entries.pop(fingerprint.key, None) is not None:
+            self.stale += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/stale counts, the hit rate and the mean lookup latency (overall and for hits)."""
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_lookup_ms": self.lookup_s / lookups * 1000 if lookups else 0.0,
+            "avg_hit_lookup_ms": self.hit_lookup_s / self.hits * 1000 if self.hits else 0.0,
+        }
+
+
+def _shift_dates(text: str, days: int) -> str:
+    if not days:
+        return text
+
+    def shift(match: re.Match) -> str:
+        original = match.group(0)
+        parsed = _parse_date(original)
+        if parsed is None:
+            return original
+        shifted = parsed + timedelta(days=days)
+        if match.group(1):
+            return shifted.strftime("%Y-%m-%d")
+        month = "%B" if len(original.split()[0].rstrip(".")) > 3 else "%b"
+        return shifted.strftime(f"{month} {shifted.day}, %Y")
+
+    return _DATE_RE.sub(shift, text)
+
+
+def replay_plan(plan: CachedPlan, fingerprint: RequestFingerprint) -> str:
+    """
+    Apply a cached plan's writes for a new request and return its response.
+
+    Writes are shifted by the number of days between the cached and the new request
+    date and applied in one database transaction; sales use the oversell check.
+
+    Returns:
+        str: The cached response, with its dates shifted the same way.
+
+    Raises:
+        ValueError: If a sale no longer has the stock (nothing is written).
+    """
+    from sqlalchemy import text
+
+    from reservations import sell_if_available
+    from transaction_queue import INSERT_TRANSACTION
+
+    days = 0
+    if plan.request_date and fingerprint.request_date:
+        days = (datetime.fromisoformat(fingerprint.request_date) - datetime.fromisoformat(plan.request_date)).days
+
+    with get_engine().begin() as conn:
+        for write in plan.writes:
+            date = _shift_dates(write["date"], days)
+            if write["transaction_type"] == "sales":
+                if sell_if_available(conn, write["item_name"], write["quantity"], write["price"], date) is None:
+                    raise ValueError(f"Insufficient stock to replay sale of {write['quantity']} {write['item_name']}")
+            else:
+                conn.execute(text(INSERT_TRANSACTION), {
+                    "item_name": write["item_name"],
+                    "transaction_type": write["transaction_type"],
+                    "units": write["quantity"],
+                    "price": write["price"],
+                    "transaction_date": date,
+                })
+    return _shift_dates(plan.response, days)
+
+
+@dataclass
+class CachedRunResult:
+    """Result of a request answered from the cache (mirrors `AgentRunResult.output`)."""
+    output: str
+    cached: bool = True
+
+
+class CachedAgent:
+    """
+    Answer near-duplicate requests from a `RequestCache`, running the wrapped agent otherwise.
+
+    `run(prompt)` has the same shape as `Agent.run`, so it can wrap an orchestration agent
+    or a `ModelRouter` wherever those are expected (e.g. `run_test_scenarios(agent=...)`).
+    """
+
+    def __init__(self, agent, cache: Optional[RequestCache] = None):
+        self.agent = agent
+        self.cache = cache or RequestCache()
+        self.replay_s = 0.0
+
+    async def run(self, prompt: str):
+        """
+        Return the cached plan's response for a near-duplicate request, else run the agent and cache it.
+
+        Args:
+            prompt (str): The request text.
+
+        Returns:
+            CachedRunResult on a hit, otherwise the wrapped agent's result.
+        """
+        import asyncio
+
+        from inventory_agents import recording_writes
+
+        fingerprint = fingerprint_request(prompt)
+        if fingerprint is not None:
+            plan = self.cache.lookup(fingerprint)
+            if plan is not None:
+                started = time.perf_counter()
+                try:
+                    output = await asyncio.to_thread(replay_plan, plan, fingerprint)
+                except ValueError:
+                    self.cache.hits -= 1
+                    self.cache.invalidate(fingerprint)
+                else:
+                    self.replay_s += time.perf_counter() - started
+                    return CachedRunResult(output=output)
+
+        with recording_writes() as writes:
+            result = await self.agent.run(prompt)
+        if fingerprint is not None:
+            self.cache.store(fingerprint, result.output, writes)
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the cache stats plus the time spent replaying hits."""
+        return {**self.cache.stats(), "replay_s": round(self.replay_s, 3)}
+
+
+def report_cache_hit_rate(
+    path: str = "quote_requests.csv",
+    as_of_date: str = "2025-04-01",
+    agent_latency_s: float = DEFAULT_AGENT_LATENCY_S,
+) -> Dict[str, Any]:
+    """
+    Report how many requests in a CSV the cache would answer and the latency saved.
+
+    Requests are fingerprinted in file order; each miss stores a plan snapshotted
+    against the current database as of `as_of_date`, and each later near-duplicate is
+    looked up (including re-validating its stock figures). Run project_starter.py
+    first so the database exists.
+
+    Args:
+        path: CSV of requests (the request text is in the 'request' or 'response' column).
+        as_of_date: Date to validate stock and cash at.
+        agent_latency_s: Assumed wall time of a full agent run that a hit avoids.
+
+    Returns:
+        Dict with request counts, cache stats, and latency saved in seconds.
+    """
+    import pandas as pd
+
+    requests = pd.read_csv(path)
+    column = "request" if "request" in requests.columns else "response"
+    cache = RequestCache()
+    uncacheable = 0
+    for request in requests[column].dropna():
+        fingerprint = fingerprint_request(request)
+        if fingerprint is None:
+            uncacheable += 1
+            continue
+        if cache.lookup(fingerprint, as_of_date) is None:
+            cache.store(fingerprint, "", as_of_date=as_of_date)
+
+    stats = cache.stats()
+    lookup_s = stats["avg_hit_lookup_ms"] / 1000
+    return {
+        "requests": int(requests[column].notna().sum()),
+        "uncacheable": uncacheable,
+        **stats,
+        "latency_saved_s": round(stats["hits"] * (agent_latency_s - lookup_s), 2),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report near-duplicate cache hit rate over a request CSV")
+    parser.add_argument("path", nargs="?", default="quote_requests.csv", help="Request CSV (default: quote_requests.csv)")
+    parser.add_argument("--as-of", default="2025-04-01", help="Date to validate stock and cash at")
+    parser.add_argument("--agent-latency", type=float, default=DEFAULT_AGENT_LATENCY_S,
+                        help=f"Assumed seconds per full agent run (default: {DEFAULT_AGENT_LATENCY_S})")
+    args = parser.parse_args()
+
+    report = report_cache_hit_rate(args.path, args.as_of, args.agent_latency)
+    print(f"Requests: {report['requests']} ({report['uncacheable']} without parseable items)")
+    print(f"Hits: {report['hits']}  Misses: {report['misses']}  Stale: {report['stale']}  "
+          f"Hit rate: {report['hit_rate']:.1%}")
+    print(f"Mean lookup: {report['avg_lookup_ms']:.2f} ms "
+          f"({report['avg_hit_lookup_ms']:.2f} ms for hits, incl. stock re-validation)")
+    print(f"Latency saved: {report['latency_saved_s']:.1f}s at {args.agent_latency:.0f}s per agent run")
@@ -0,0 +1,171 @@
+"""
+Tagging of ledger writes with the request that made them.
+
+`run_test_scenarios` and `ingest_requests` persist a result once a request's agent run
+finishes, and skip the requests with a result when resuming after a crash. A request
+that crashed mid-run has no result, so it is run again. But its tools may already
+have committed sales and stock orders, which would then be recorded twice.
+
+Runs inside `tagging_writes(request_key)` therefore tag every row they insert into
+`transactions`. The (request_key, transaction_id) pair goes into `request_writes`
+in the same database transaction as the insert, so a committed row always has its
+tag. The tag is picked up on every write path: `create_transaction`, the oversell-safe
+sales in `reservations.py` and the write-behind `TransactionWriter`, which writes
+each record under the key of the request that submitted it. Before re-running an
+interrupted request, a resume calls `rollback_request_writes` to delete the rows it
+already wrote.
+
+Only writes made through an engine passed to `tag_writes()` are tagged. The shared
+engine is tagged as soon as `get_engine()` creates it. Stock holds in `reservations`
+are not rolled back; an interrupted request's holds expire on their own.
+"""
+from __future__ import annotations
+
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Set
+
+if TYPE_CHECKING:
+    from sqlalchemy import Connection, Engine
+
+REQUEST_WRITES_TABLE = "request_writes"
+
+CREATE_REQUEST_WRITES_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {REQUEST_WRITES_TABLE} (
+    request_key TEXT NOT NULL,
+    transaction_id INTEGER NOT NULL
+)
+"""
+CREATE_REQUEST_WRITES_INDEX = (
+    f"CREATE INDEX IF NOT EXISTS idx_{REQUEST_WRITES_TABLE}_key ON {REQUEST_WRITES_TABLE} (request_key)"
+)
+
+_INSERT_TRANSACTION_RE = re.compile(r"^\s*INSERT\s+INTO\s+[\"`\[]?transactions[\"`\]]?\s", re.IGNORECASE)
+
+_current_request: ContextVar[Optional[str]] = ContextVar("current_request", default=None)
+
+
+def current_request() -> Optional[str]:
+    """Return the key of the request whose writes are being tagged, if any."""
+    return _current_request.get()
+
+
+@contextmanager
+def tagging_writes(request_key: Optional[str]) -> Iterator[None]:
+    """
+    Tag the transactions inserted in this context (and the tasks and threads it starts) with `request_key`.
+
+    Args:
+        request_key: Key of the request, unique within the database. None tags nothing.
+    """
+    token = _current_request.set(request_key)
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+def create_request_writes_table(conn: Connection) -> None:
+    """Create the `request_writes` table and its index if they don't exist."""
+    from sqlalchemy import text
+
+    conn.execute(text(CREATE_REQUEST_WRITES_TABLE))
+    conn.execute(text(CREATE_REQUEST_WRITES_INDEX))
+
+
+def tag_writes(engine: Engine) -> None:
+    """
+    Tag the rows inserted into `transactions` on `engine` with the current request.
+
+    Args:
+        engine: Engine to watch. Calling this again for the same engine does nothing.
+    """
+    from sqlalchemy import event
+
+    if engine.__dict__.get("_request_writes_tagged"):
+        return
+    engine._request_writes_tagged = True
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        request_key = _current_request.get()
+        if request_key is None or cursor.rowcount <= 0 or not _INSERT_TRANSACTION_RE.match(statement):
+            return
+        # Straight on the DB-API connection, so the tag commits (or rolls back) with the
+        # insert. This also keeps the table creation, a no-op once it exists, from
+        # counting as a write for memoization.
+        dbapi_connection = cursor.connection
+        dbapi_connection.execute(CREATE_REQUEST_WRITES_TABLE)
+        dbapi_connection.execute(CREATE_REQUEST_WRITES_INDEX)
+        # lastrowid isn't set by executemany; rows inserted by one statement get consecutive rowids
+        last_id = cursor.lastrowid if not executemany else dbapi_connection.execute("SELECT last_insert_rowid()").fetchone()[0]
+        dbapi_connection.executemany(
+            f"INSERT INTO {REQUEST_WRITES_TABLE} (request_key, transaction_id) VALUES (?, ?)",
+            [(request_key, row_id) for row_id in range(last_id - cursor.rowcount + 1, last_id + 1)],
+        )
+
+    event.listen(engine, "after_cursor_execute", after_execute)
+
+
+def tagged_requests(prefix: str = "", engine: Optional[Engine] = None) -> Set[str]:
+    """
+    Return the keys of the requests with tagged writes.
+
+    Args:
+        prefix: Only return keys starting with this prefix.
+        engine: Engine to query. Defaults to `get_engine()`.
+    """
+    from sqlalchemy import inspect, text
+
+    from project_starter import get_engine
+
+    engine = engine or get_engine()
+    if not inspect(engine).has_table(REQUEST_WRITES_TABLE):
+        return set()
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"SELECT DISTINCT request_key FROM {REQUEST_WRITES_TABLE} WHERE substr(request_key, 1, :n) = :prefix"),
+            {"n": len(prefix), "prefix": prefix},
+        )
+        return {row[0] for row in rows}
+
+
+def rollback_request_writes(request_keys: Iterable[str], engine: Optional[Engine] = None) -> int:
+    """
+    Delete the transactions tagged with any of `request_keys`, and their tags.
+
+    Args:
+        request_keys: Keys of the interrupted requests.
+        engine: Engine to write to. Defaults to `get_engine()`.
+
+    Returns:
+        int: Number of transactions deleted.
+    """
+    from sqlalchemy import bindparam, inspect, text
+
+    from project_starter import get_engine
+
+    engine = engine or get_engine()
+    request_keys = sorted(set(request_keys))
+    if not request_keys or not inspect(engine).has_table(REQUEST_WRITES_TABLE):
+        return 0
+
+    deleted = 0
+    with engine.begin() as conn:
+        for start in range(0, len(request_keys), 500):
+            params = {"keys": request_keys[start:start + 500]}
+            deleted += conn.execute(
+                text(f"""
+                    DELETE FROM transactions WHERE rowid IN (
+                        SELECT transaction_id FROM {REQUEST_WRITES_TABLE} WHERE request_key IN :keys
+                    )
+                """).bindparams(bindparam("keys", expanding=True)),
+                params,
+            ).rowcount
+            conn.execute(
+                text(f"DELETE FROM {REQUEST_WRITES_TABLE} WHERE request_key IN :keys").bindparams(
+                    bindparam("keys", expanding=True)
+                ),
+                params,
+            )
+    return deleted
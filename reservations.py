@@ -0,0 +1,494 @@
+"""
+Stock reservations so concurrent requests can't oversell an item.
+
+A sale used to be a stock read followed, some turns later, by a separate write, so
+two requests running at once could both see the same 500 units and both sell them.
+Here availability is checked and claimed in one conditional statement instead:
+
+    INSERT ... SELECT ... WHERE <available stock> >= :quantity
+
+where available stock is the ledger stock minus the unexpired holds on the item. SQLite
+serializes writers, so the check and the insert are atomic per statement; a statement
+that loses the race simply inserts nothing.
+
+- `reserve_stock()` places an expiring hold in the `reservations` table.
+- `commit_reservation()` turns a live hold into a sales transaction, in the same
+  database transaction as marking the hold committed.
+- `release_reservation()` gives a hold back.
+- `sell_if_available()` records a sale without a prior hold, under the same check.
+
+Holds that are neither committed nor released stop counting once they expire.
+"""
+from __future__ import annotations
+
+import weakref
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Union
+
+from project_starter import get_engine, ledger_table
+
+if TYPE_CHECKING:
+    from sqlalchemy import Connection, Engine
+
+# How long a hold keeps stock aside before it lapses
+DEFAULT_HOLD_SECONDS = 15 * 60
+
+CREATE_RESERVATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_name TEXT NOT NULL,
+        units INTEGER NOT NULL,
+        price FLOAT NOT NULL,
+        request_date TEXT NOT NULL,
+        status TEXT NOT NULL,            -- 'held', 'committed', 'released' or 'expired'
+        created_at TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        transaction_id INTEGER
+    )
+"""
+CREATE_RESERVATIONS_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_reservations_item_status ON reservations (item_name, status, expires_at)"
+)
+
+# Expiry is evaluated with the database clock inside each statement, so a caller that
+# waited on the write lock can't act on a hold that lapsed in the meantime
+_SQL_NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+# Stock the item has as of :as_of and across the whole ledger (which also counts sales
+# already recorded for later dates), each less the units held by unexpired reservations.
+_HELD_UNITS = f"""
+    (SELECT COALESCE(SUM(units), 0) FROM reservations
+     WHERE item_name = :item_name AND status = 'held' AND expires_at > {_SQL_NOW})
+"""
+_LEDGER_STOCK = """
+    (SELECT COALESCE(SUM(CASE
+        WHEN transaction_type = 'stock_orders' THEN units
+        WHEN transaction_type = 'sales' THEN -units
+        ELSE 0
+     END), 0)
+     FROM {table} WHERE item_name = :item_name {date_filter})
+"""
+
+
+def _ledger_stock_queries(engine: Engine, as_of: str) -> Tuple[str, str]:
+    """Return the ledger stock subqueries as of `as_of` and across the whole ledger."""
+    # As-of reads of the shared ledger go through the full ledger before a compaction
+    # cutoff; the whole-ledger totals are the same in the compacted table
+    table = ledger_table(as_of) if engine is get_engine() else "transactions"
+    return (
+        _LEDGER_STOCK.format(table=table, date_filter="AND transaction_date <= :as_of"),
+        _LEDGER_STOCK.format(table="transactions", date_filter=""),
+    )
+
+
+def _available_condition(engine: Engine, as_of: str) -> str:
+    """Return the condition that `:units` of the item are available as of `as_of`."""
+    as_of_stock, total_stock = _ledger_stock_queries(engine, as_of)
+    return f"{as_of_stock} - {_HELD_UNITS} >= :units AND {total_stock} - {_HELD_UNITS} >= :units"
+
+
+def _date_str(date: Union[str, datetime]) -> str:
+    return date.isoformat() if isinstance(date, datetime) else date
+
+
+def create_reservations_table(conn: Connection) -> None:
+    """Create the `reservations` table and its index if they don't exist."""
+    from sqlalchemy import text
+
+    conn.execute(text(CREATE_RESERVATIONS_TABLE))
+    conn.execute(text(CREATE_RESERVATIONS_INDEX))
+
+
+# Engines whose database has the reservations table. Each CREATE ... IF NOT EXISTS counts
+# as a write for memoization, so it runs once per engine rather than on every call.
+_tables_ready: "weakref.WeakSet[Engine]" = weakref.WeakSet()
+
+
+def ensure_reservations_table(engine: Engine) -> None:
+    """Create the `reservations` table in its own transaction, the first time `engine` is used."""
+    if engine in _tables_ready:
+        return
+    with engine.begin() as conn:
+        create_reservations_table(conn)
+    _tables_ready.add(engine)
+
+
+def get_available_stock(item_name: str, as_of_date: Union[str, datetime], engine: Optional[Engine] = None) -> int:
+    """
+    Return the units of an item that can still be sold or reserved as of a date.
+
+    This is the ledger stock (the lower of the stock as of `as_of_date` and across the
+    whole ledger) minus the units held by unexpired reservations.
+
+    Args:
+        item_name (str): The name of the item to look up.
+        as_of_date (str or datetime): The cutoff date (inclusive) for the ledger stock.
+        engine (Engine, optional): Engine to query. Defaults to `get_engine()`.
+
+    Returns:
+        int: Units available, never below 0.
+    """
+    from sqlalchemy import text
+
+    params = {"item_name": item_name, "as_of": _date_str(as_of_date)}
+    engine = engine or get_engine()
+    as_of_stock, total_stock = _ledger_stock_queries(engine, params["as_of"])
+    query = f"SELECT MIN({as_of_stock}, {total_stock}) - {_HELD_UNITS}"
+    ensure_reservations_table(engine)
+    with engine.connect() as conn:
+        available = conn.execute(text(query), params).scalar() or 0
+    return max(int(available), 0)
+
+
+def reserve_stock(
+    item_name: str,
+    quantity: int,
+    request_date: Union[str, datetime],
+    price: float = 0.0,
+    hold_seconds: float = DEFAULT_HOLD_SECONDS,
+    engine: Optional[Engine] = None,
+) -> int:
+    """
+    Atomically hold `quantity` units of an item if that many are available.
+
+    Args:
+        item_name (str): The item to reserve.
+        quantity (int): Units to hold.
+        request_date (str or datetime): Date of the request; the sale is recorded on it.
+        price (float, optional): Total price agreed for the held units.
+        hold_seconds (float, optional): Seconds before the hold lapses.
+        engine (Engine, optional): Engine to write to. Defaults to `get_engine()`.
+
+    Returns:
+        int: The reservation ID.
+
+    Raises:
+        ValueError: If `quantity` is not positive or not enough stock is available.
+    """
+    from sqlalchemy import text
+
+    if quantity <= 0:
+        raise ValueError("Quantity must be positive")
+    params = {
+        "item_name": item_name,
+        "units": quantity,
+        "price": price,
+        "as_of": _date_str(request_date),
+        "hold": f"+{float(hold_seconds)} seconds",
+    }
+    engine = engine or get_engine()
+    ensure_reservations_table(engine)
+    with engine.begin() as conn:
+        result = conn.execute(text(f"""
+            INSERT INTO reservations (item_name, units, price, request_date, status, created_at, expires_at)
+            SELECT :item_name, :units, :price, :as_of, 'held', {_SQL_NOW},
+                   strftime('%Y-%m-%dT%H:%M:%fZ', 'now', :hold)
+            WHERE {_available_condition(engine, params["as_of"])}
+        """), params)
+        if result.rowcount != 1:
+            raise ValueError(f"Insufficient stock to reserve {quantity} units of {item_name}")
+        return result.lastrowid
+
+
+def commit_reservation(
+    reservation_id: int,
+    price: Optional[float] = None,
+    engine: Optional[Engine] = None,
+) -> int:
+    """
+    Record the sale for a live hold and mark the hold committed, atomically.
+
+    Args:
+        reservation_id (int): The reservation to commit.
+        price (float, optional): Total sale price. Defaults to the price given when reserving.
+        engine (Engine, optional): Engine to write to. Defaults to `get_engine()`.
+
+    Returns:
+        int: The ID of the sales transaction.
+
+    Raises:
+        ValueError: If the reservation doesn't exist, has expired, or is no longer held.
+    """
+    from sqlalchemy import text
+
+    engine = engine or get_engine()
+    ensure_reservations_table(engine)
+    with engine.begin() as conn:
+        claimed = conn.execute(
+            text(f"UPDATE reservations SET status = 'committed' WHERE id = :id AND status = 'held' AND expires_at > {_SQL_NOW}"),
+            {"id": reservation_id},
+        )
+        if claimed.rowcount != 1:
+            raise ValueError(f"Reservation {reservation_id} is not held (expired, released or already committed)")
+        held = conn.execute(
+            text("SELECT item_name, units, price, request_date FROM reservations WHERE id = :id"),
+            {"id": reservation_id},
+        ).mappings().one()
+        transaction_id = conn.execute(
+            text(
+                "INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date) "
+                "VALUES (:item_name, 'sales', :units, :price, :request_date)"
+            ),
+            {**held, "price": held["price"] if price is None else price},
+        ).lastrowid
+        conn.execute(
+            text("UPDATE reservations SET transaction_id = :transaction_id WHERE id = :id"),
+            {"transaction_id": transaction_id, "id": reservation_id},
+        )
+    return transaction_id
+
+
+def get_reservation(reservation_id: int, engine: Optional[Engine] = None) -> Dict:
+    """
+    Look up a reservation.
+
+    Args:
+        reservation_id (int): The reservation to look up.
+        engine (Engine, optional): Engine to query. Defaults to `get_engine()`.
+
+    Returns:
+        Dict: The reservation row (item_name, units, price, request_date, status, ...).
+
+    Raises:
+        ValueError: If there is no such reservation.
+    """
+    from sqlalchemy import text
+
+    engine = engine or get_engine()
+    ensure_reservations_table(engine)
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("SELECT * FROM reservations WHERE id = :id"), {"id": reservation_id}
+        ).mappings().first()
+    if row is None:
+        raise ValueError(f"No reservation with id {reservation_id}")
+    return dict(row)
+
+
+def release_reservation(reservation_id: int, engine: Optional[Engine] = None) -> bool:
+    """
+    Give back the units of a live hold.
+
+    Args:
+        reservation_id (int): The reservation to release.
+        engine (Engine, optional): Engine to write to. Defaults to `get_engine()`.
+
+    Returns:
+        bool: True if the hold was released, False if it was no longer held.
+    """
+    from sqlalchemy import text
+
+    engine = engine or get_engine()
+    ensure_reservations_table(engine)
+    with engine.begin() as conn:
+        result = conn.execute(
+            text("UPDATE reservations SET status = 'released' WHERE id = :id AND status = 'held'"),
+            {"id": reservation_id},
+        )
+    return result.rowcount == 1
+
+
+def expire_reservations(engine: Optional[Engine] = None) -> int:
+    """
+    Mark lapsed holds as 'expired'.
+
+    Expired holds already stop counting against availability; this only tidies their status.
+
+    Returns:
+        int: Number of holds marked expired.
+    """
+    from sqlalchemy import text
+
+    engine = engine or get_engine()
+    ensure_reservations_table(engine)
+    with engine.begin() as conn:
+        result = conn.execute(
+            text(f"UPDATE reservations SET status = 'expired' WHERE status = 'held' AND expires_at <= {_SQL_NOW}")
+        )
+    return result.rowcount
+
+
+def sell_if_available(
+    conn: Connection,
+    item_name: str,
+    quantity: int,
+    price: float,
+    date: Union[str, datetime],
+) -> Optional[int]:
+    """
+    Record a sale on `conn` only if enough unreserved stock is available.
+
+    Args:
+        conn (Connection): Open connection, inside the caller's transaction.
+        item_name (str): The item sold.
+        quantity (int): Units sold.
+        price (float): Total sale price.
+        date (str or datetime): Date of the sale.
+
+    Returns:
+        int or None: The transaction ID, or None if the stock wasn't available.
+    """
+    from sqlalchemy import text
+
+    params = {
+        "item_name": item_name,
+        "units": quantity,
+        "price": price,
+        "as_of": _date_str(date),
+    }
+    if conn.engine not in _tables_ready:
+        # Not in a separate transaction: the caller's may already hold the write lock
+        create_reservations_table(conn)
+    result = conn.execute(text(f"""
+        INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date)
+        SELECT :item_name, 'sales', :units, :price, :as_of
+        WHERE {_available_condition(conn.engine, params["as_of"])}
+    """), params)
+    return result.lastrowid if result.rowcount == 1 else None
+
+
+def create_sale(
+    item_name: str,
+    quantity: int,
+    price: float,
+    date: Union[str, datetime],
+    engine: Optional[Engine] = None,
+) -> int:
+    """
+    Record a sale without a prior hold, failing instead of overselling.
+
+    Returns:
+        int: The ID of the sales transaction.
+
+    Raises:
+        ValueError: If not enough unreserved stock is available.
+    """
+    engine = engine or get_engine()
+    ensure_reservations_table(engine)
+    with engine.begin() as conn:
+        transaction_id = sell_if_available(conn, item_name, quantity, price, date)
+    if transaction_id is None:
+        raise ValueError(f"Insufficient stock to sell {quantity} units of {item_name}")
+    return transaction_id
+
+
+def stress_test_reservations(
+    buyers: int = 300,
+    initial_stock: int = 1000,
+    workers: int = 32,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Run many concurrent buyers against one item and check that stock never goes negative.
+
+    Uses a temporary SQLite database seeded with `initial_stock` units of A4 paper.
+    Each buyer wants 1-20 units and reserves, sells directly, or does a naive
+    check-then-sell. Reserving buyers then commit, release, or abandon their hold
+    (which expires). The naive buyers run only in a separate baseline database to show
+    the oversell the API prevents.
+
+    Args:
+        buyers: Concurrent buyers per run.
+        initial_stock: Units on hand before the run.
+        workers: Threads running buyers at the same time.
+        seed: Seed for the buyers' choices.
+
+    Returns:
+        Units sold and final stock with the API, and the final stock of the naive baseline.
+    """
+    import os
+    import random
+    import tempfile
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from sqlalchemy import create_engine, text
+
+    date = "2025-04-01T00:00:00"
+
+    def fresh_engine(path: str) -> Engine:
+        engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30}, pool_size=workers)
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE transactions (id FLOAT, item_name TEXT, transaction_type TEXT, "
+                "units INTEGER, price FLOAT, transaction_date TEXT)"
+            ))
+            conn.execute(text(
+                "INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date) "
+                "VALUES ('A4 paper', 'stock_orders', :units, 0, '2025-01-01T00:00:00')"
+            ), {"units": initial_stock})
+            create_reservations_table(conn)
+        return engine
+
+    def ledger_stock(engine: Engine) -> int:
+        with engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT SUM(CASE WHEN transaction_type = 'stock_orders' THEN units ELSE -units END) "
+                "FROM transactions WHERE item_name = 'A4 paper'"
+            )).scalar()
+
+    def buyer(engine: Engine, rng: random.Random, naive: bool) -> int:
+        quantity = rng.randint(1, 20)
+        if naive:
+            if ledger_stock(engine) < quantity:
+                return 0
+            time.sleep(0.001)  # the gap between check_stock_level and create_order_transaction
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date) "
+                    "VALUES ('A4 paper', 'sales', :units, 0, :date)"
+                ), {"units": quantity, "date": date})
+            return quantity
+
+        try:
+            if rng.random() < 0.25:
+                create_sale("A4 paper", quantity, 0.0, date, engine=engine)
+                return quantity
+            reservation_id = reserve_stock("A4 paper", quantity, date, hold_seconds=0.05, engine=engine)
+        except ValueError:
+            return 0
+        time.sleep(0.001)
+        outcome = rng.random()
+        if outcome < 0.7:
+            try:
+                commit_reservation(reservation_id, engine=engine)
+                return quantity
+            except ValueError:
+                return 0  # held past expiry
+        if outcome < 0.9:
+            release_reservation(reservation_id, engine=engine)
+        return 0  # released, or abandoned until it expires
+
+    report: Dict[str, int] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("reservations", "naive"):
+            engine = fresh_engine(os.path.join(tmp, f"{mode}.db"))
+            rngs = [random.Random(seed * 100_000 + i) for i in range(buyers)]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                sold = sum(pool.map(lambda rng: buyer(engine, rng, mode == "naive"), rngs))
+            report[f"{mode}_units_sold"] = sold
+            report[f"{mode}_final_stock"] = ledger_stock(engine)
+            if mode == "reservations":
+                assert report["reservations_final_stock"] == initial_stock - sold
+                assert report["reservations_final_stock"] >= 0, "stock went negative"
+                with engine.connect() as conn:
+                    report["holds_committed"] = conn.execute(
+                        text("SELECT COUNT(*) FROM reservations WHERE status = 'committed'")
+                    ).scalar()
+            engine.dispose()
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stress-test stock reservations with concurrent buyers")
+    parser.add_argument("--buyers", type=int, default=300, help="Concurrent buyers (default: 300)")
+    parser.add_argument("--stock", type=int, default=1000, help="Initial units on hand (default: 1000)")
+    args = parser.parse_args()
+
+    report = stress_test_reservations(args.buyers, args.stock)
+    print(f"With reservations: sold {report['reservations_units_sold']} units, "
+          f"final stock {report['reservations_final_stock']} ({report['holds_committed']} holds committed)")
+    print(f"Naive check-then-sell: sold {report['naive_units_sold']} units, "
+          f"final stock {report['naive_final_stock']}")
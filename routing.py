@@ -0,0 +1,394 @@
+"""
+Tiered model routing for the orchestration agent.
+
+Incoming requests are classified with cheap local heuristics (number of requested
+items, presence of a deadline, and how confidently the items map to the catalog).
+Easy requests go to a small, fast model and hard ones to a stronger model. If a run
+on the fast tier fails tool validation, it is escalated to the strong tier, which
+continues from the messages the fast run had already exchanged. Tool calls that
+already succeeded (such as recorded transactions), including those in the response
+that failed, are kept with their results, so they are not repeated.
+
+The router records latency, token usage and estimated cost per tier, including the
+tokens spent on failed attempts. Any pydantic_ai
+model can be used for either tier, e.g. `TestModel` or `FunctionModel` to run offline.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from project_starter import paper_supplies
+from inventory_agents import build_agents, load_env
+from rate_limit import rate_limited_openai_model
+
+# Default model names per tier (override with OPENAI_FAST_MODEL / OPENAI_STRONG_MODEL)
+DEFAULT_FAST_MODEL = "gpt-4.1-nano"
+DEFAULT_STRONG_MODEL = "gpt-4.1"
+
+# USD per million (input, output) tokens, used for the cost split
+MODEL_PRICES = {
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# A request is routed to the strong tier if any of these thresholds is crossed
+MAX_EASY_ITEMS = 3
+MIN_EASY_CONFIDENCE = 0.6
+# Bulk orders have the longest supplier lead time, so a deadline makes them harder
+MAX_EASY_QUANTITY_WITH_DEADLINE = 1000
+
+_UNIT_WORDS = (
+    r"sheets?|reams?|rolls?|units?|packs?|packets?|boxes?|pieces?|cards?|cups?|plates?|"
+    r"napkins?|posters?|flyers?|envelopes?|folders?|pads?|notepads?|tags?|bags?|banners?|"
+    r"covers?|streamers?|sets?"
+)
+# The description runs to the end of the clause, or to the next "and"/quantity
+_QUANTITY_RE = re.compile(
+    rf"\b(\d[\d,]*)\s+((?:{_UNIT_WORDS})\b(?:(?!\s+and\b|\s+\d)[^\n,;.])*)", re.IGNORECASE
+)
+_DEADLINE_RE = re.compile(
+    r"\b(?:by|before|no later than|deadline|due)\b[^.\n]*?"
+    r"\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}"
+    r"|\b\d{4}-\d{2}-\d{2}\b|\bdeadline\b|\burgent(?:ly)?\b|\basap\b",
+    re.IGNORECASE,
+)
+_STOP_WORDS = {"paper", "of", "the", "and", "with", "in", "for", "a", "an", "sheets", "sheet", "x", "lb", "gsm"}
+
+
+@dataclass
+class RequestClassification:
+    """Result of classifying a request for routing."""
+    item_count: int
+    has_deadline: bool
+    parse_confidence: float
+    tier: str  # 'fast' or 'strong'
+    reasons: List[str] = field(default_factory=list)
+
+
+def _catalog_keywords() -> List[set]:
+    keywords = []
+    for item in paper_supplies:
+        words = {w for w in re.findall(r"[a-z0-9]+", item["item_name"].lower()) if w not in _STOP_WORDS}
+        keywords.append(words or {item["item_name"].lower()})
+    return keywords
+
+
+_CATALOG_KEYWORDS = _catalog_keywords()
+
+
+def _matches_catalog(description: str) -> bool:
+    words = set(re.findall(r"[a-z0-9]+", description.lower())) - _STOP_WORDS
+    return any(keywords & words for keywords in _CATALOG_KEYWORDS)
+
+
+def extract_items(request: str) -> List[Tuple[int, str]]:
+    """
+    Parse the "<quantity> <unit> of <item>" mentions in a request.
+
+    Args:
+        request (str): The customer request text.
+
+    Returns:
+        List of (quantity, description) tuples; the description starts with the unit word.
+    """
+    return [(int(quantity.replace(",", "")), description.strip()) for quantity, description in _QUANTITY_RE.findall(request)]
+
+
+def match_catalog_item(description: str) -> Optional[str]:
+    """
+    Return the catalog item sharing the most keywords with an item description, if any.
+
+    Args:
+        description (str): Item description, e.g. "reams of A4 paper".
+
+    Returns:
+        str or None: The catalog item name, or None if no keyword matches.
+    """
+    words = set(re.findall(r"[a-z0-9]+", description.lower())) - _STOP_WORDS
+    overlap, index = max((len(keywords & words), i) for i, keywords in enumerate(_CATALOG_KEYWORDS))
+    return paper_supplies[index]["item_name"] if overlap else None
+
+
+def classify_request(request: str) -> RequestClassification:
+    """
+    Classify a customer request as easy ('fast' tier) or hard ('strong' tier).
+
+    Heuristics:
+        - item_count: number of "<quantity> <unit> of <item>" mentions
+        - has_deadline: whether the request mentions a delivery date or urgency
+        - parse_confidence: fraction of mentioned items that share a keyword with a
+          catalog item (0 if no quantities could be parsed at all)
+
+    A request is hard if it has more than MAX_EASY_ITEMS items, a parse confidence below
+    MIN_EASY_CONFIDENCE, or a deadline together with a quantity above
+    MAX_EASY_QUANTITY_WITH_DEADLINE.
+
+    Args:
+        request (str): The customer request text.
+
+    Returns:
+        RequestClassification: The heuristics, the chosen tier and the reasons for it.
+    """
+    mentions = extract_items(request)
+    item_count = len(mentions)
+    max_quantity = max((quantity for quantity, _ in mentions), default=0)
+    has_deadline = bool(_DEADLINE_RE.search(request))
+    matched = sum(1 for _, description in mentions if _matches_catalog(description))
+    confidence = matched / item_count if item_count else 0.0
+
+    reasons = []
+    if item_count > MAX_EASY_ITEMS:
+        reasons.append(f"{item_count} items > {MAX_EASY_ITEMS}")
+    if confidence < MIN_EASY_CONFIDENCE:
+        reasons.append(f"parse confidence {confidence:.2f} < {MIN_EASY_CONFIDENCE}")
+    if has_deadline and max_quantity > MAX_EASY_QUANTITY_WITH_DEADLINE:
+        reasons.append(f"deadline with quantity {max_quantity} > {MAX_EASY_QUANTITY_WITH_DEADLINE}")
+
+    return RequestClassification(
+        item_count=item_count,
+        has_deadline=has_deadline,
+        parse_confidence=confidence,
+        tier="strong" if reasons else "fast",
+        reasons=reasons,
+    )
+
+
+@dataclass
+class TierStats:
+    """Accumulated latency, usage and cost for one routing tier."""
+    runs: int = 0
+    failures: int = 0
+    latency_s: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost_usd: float = 0.0
+
+
+def _result_usage(result) -> Tuple[int, int]:
+    usage = result.usage() if callable(getattr(result, "usage", None)) else result.usage
+    return getattr(usage, "input_tokens", 0) or 0, getattr(usage, "output_tokens", 0) or 0
+
+
+def _model_label(model: Any) -> str:
+    if isinstance(model, str):
+        return model.split(":", 1)[-1]
+    return getattr(model, "model_name", type(model).__name__)
+
+
+def _completed_tool_calls():
+    """
+    Hooks that record the result of every tool call that completes.
+
+    Returns:
+        (Hooks, dict): The capability to pass to `Agent.run`, and the results it records,
+        keyed by tool call id.
+    """
+    from pydantic_ai.capabilities import Hooks
+
+    hooks = Hooks()
+    completed: Dict[str, Any] = {}
+
+    @hooks.on.tool_execute
+    async def record_result(ctx, *, call, tool_def, args, handler):
+        execution = asyncio.ensure_future(handler(args))
+        try:
+            result = await asyncio.shield(execution)
+        except asyncio.CancelledError:
+            # Another call in the same response failed and the run is being torn down.
+            # A tool already running in a thread finishes (and commits) regardless, so
+            # wait for it and keep its result rather than lose track of the write.
+            try:
+                completed[call.tool_call_id] = await execution
+            except Exception:
+                pass
+            raise
+        completed[call.tool_call_id] = result
+        return result
+
+    return hooks, completed
+
+
+def _resumable_history(messages: list, completed: Dict[str, Any]) -> list:
+    """
+    Trim the messages of a failed run so another run can continue from them.
+
+    The run fails while processing the tool calls of its last model response, so those
+    calls have no returns in the history. The calls that completed anyway (e.g. a
+    transaction that was recorded) are kept together with their results, so they are
+    not repeated; the calls that failed or never ran are dropped.
+
+    Args:
+        messages: Messages captured from the failed run.
+        completed: Results of the completed tool calls, keyed by tool call id.
+
+    Returns:
+        The history to continue from, or an empty list if the model never responded.
+    """
+    from dataclasses import replace
+
+    from pydantic_ai.messages import ModelRequest, ModelResponse, ToolCallPart, ToolReturnPart
+
+    messages = list(messages)
+    if not any(isinstance(m, ModelResponse) for m in messages):
+        return []
+
+    # Returns already added for the last response, before the request was cut short
+    answered = {}
+    if isinstance(messages[-1], ModelRequest):
+        answered = {p.tool_call_id: p for p in messages.pop().parts if isinstance(p, ToolReturnPart)}
+
+    response = messages[-1]
+    if not any(isinstance(p, ToolCallPart) for p in response.parts):
+        return messages
+    messages.pop()
+
+    returns = []
+    for part in response.parts:
+        if not isinstance(part, ToolCallPart):
+            continue
+        if part.tool_call_id in answered:
+            returns.append(answered[part.tool_call_id])
+        elif part.tool_call_id in completed:
+            returns.append(ToolReturnPart(part.tool_name, completed[part.tool_call_id], tool_call_id=part.tool_call_id))
+    if returns:
+        returned = {p.tool_call_id for p in returns}
+        parts = [p for p in response.parts if not isinstance(p, ToolCallPart) or p.tool_call_id in returned]
+        messages.append(replace(response, parts=parts))
+        messages.append(ModelRequest(parts=returns))
+    return messages
+
+
+def _response_usage(messages: list) -> Tuple[int, int]:
+    """Sum the (input, output) tokens of the model responses in `messages`."""
+    from pydantic_ai.messages import ModelResponse
+
+    responses = [m for m in messages if isinstance(m, ModelResponse)]
+    return (
+        sum(m.usage.input_tokens or 0 for m in responses),
+        sum(m.usage.output_tokens or 0 for m in responses),
+    )
+
+
+class ModelRouter:
+    """
+    Route requests to a fast or strong orchestration agent, escalating on tool validation failure.
+
+    `run(prompt)` has the same shape as `Agent.run`, so a router can be passed wherever an
+    orchestration agent is expected (e.g. `run_test_scenarios(agent=router)`).
+    """
+
+    def __init__(self, fast_model: Optional[Any] = None, strong_model: Optional[Any] = None):
+        """
+        Args:
+            fast_model: Model for easy requests (pydantic_ai model or name). Defaults to
+                        OPENAI_FAST_MODEL or gpt-4.1-nano, behind the shared rate limiter.
+            strong_model: Model for hard and escalated requests. Defaults to
+                          OPENAI_STRONG_MODEL or gpt-4.1.
+        """
+        if fast_model is None or strong_model is None:
+            load_env()
+            if not os.getenv("OPENAI_API_KEY"):
+                raise ValueError("OPENAI_API_KEY not found in environment variables. Please check your .env file.")
+        if fast_model is None:
+            fast_model = rate_limited_openai_model(os.getenv("OPENAI_FAST_MODEL", DEFAULT_FAST_MODEL))
+        if strong_model is None:
+            strong_model = rate_limited_openai_model(os.getenv("OPENAI_STRONG_MODEL", DEFAULT_STRONG_MODEL))
+
+        self.models = {"fast": fast_model, "strong": strong_model}
+        self.agents = {
+            "fast": build_agents(fast_model)["orchestration_agent"],
+            "strong": build_agents(strong_model)["orchestration_agent"],
+        }
+        self.stats = {"fast": TierStats(), "strong": TierStats()}
+        self.escalations = 0
+        self.routed = {"fast": 0, "strong": 0}
+
+    def _record(self, tier: str, started: float, tokens: Tuple[int, int] = (0, 0), failed: bool = False) -> None:
+        stats = self.stats[tier]
+        stats.runs += 1
+        stats.failures += int(failed)
+        stats.latency_s += time.perf_counter() - started
+        input_tokens, output_tokens = tokens
+        stats.input_tokens += input_tokens
+        stats.output_tokens += output_tokens
+        in_price, out_price = MODEL_PRICES.get(_model_label(self.models[tier]), (0.0, 0.0))
+        stats.cost_usd += (input_tokens * in_price + output_tokens * out_price) / 1_000_000
+
+    async def run(self, prompt: str, tier: Optional[str] = None):
+        """
+        Classify the request, run it on the chosen tier, and escalate to the strong tier on failure.
+
+        Args:
+            prompt (str): The request text.
+            tier (str, optional): Force 'fast' or 'strong' instead of classifying.
+
+        Returns:
+            The AgentRunResult of the tier that completed the request.
+        """
+        from pydantic_ai import capture_run_messages
+        from pydantic_ai.exceptions import UnexpectedModelBehavior
+
+        tier = tier or classify_request(prompt).tier
+        self.routed[tier] += 1
+
+        hooks, completed = _completed_tool_calls()
+        with capture_run_messages() as messages:
+            started = time.perf_counter()
+            try:
+                result = await self.agents[tier].run(prompt, capabilities=[hooks])
+            except (UnexpectedModelBehavior, ValueError):
+                # Tool arguments failed validation (or a tool rejected them) more often than
+                # the retry budget allows; escalate unless we're already on the strong tier.
+                # The failed attempt's requests are still billed.
+                self._record(tier, started, _response_usage(messages), failed=True)
+                if tier == "strong":
+                    raise
+            else:
+                self._record(tier, started, _result_usage(result))
+                return result
+
+        self.escalations += 1
+        history = _resumable_history(messages, completed)
+        with capture_run_messages() as messages:
+            started = time.perf_counter()
+            try:
+                if history:
+                    result = await self.agents["strong"].run(
+                        "The previous attempt at this request failed tool validation. Continue handling "
+                        "the request above; do not repeat tool calls that already succeeded.",
+                        message_history=history,
+                    )
+                else:
+                    result = await self.agents["strong"].run(prompt)
+            except Exception:
+                self._record("strong", started, _response_usage(messages[len(history):]), failed=True)
+                raise
+        self._record("strong", started, _result_usage(result))
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        """Return routing counts, escalations and the latency/usage/cost split per tier."""
+        return {
+            "routed": dict(self.routed),
+            "escalations": self.escalations,
+            "tiers": {
+                tier: {
+                    "model": _model_label(self.models[tier]),
+                    "runs": s.runs,
+                    "failures": s.failures,
+                    "avg_latency_s": s.latency_s / s.runs if s.runs else 0.0,
+                    "input_tokens": s.input_tokens,
+                    "output_tokens": s.output_tokens,
+                    "cost_usd": round(s.cost_usd, 6),
+                }
+                for tier, s in self.stats.items()
+            },
+        }
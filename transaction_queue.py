@@ -0,0 +1,334 @@
+"""
+Write-behind transaction queue with micro-batched commits.
+
+With many agent runs recording sales and stock orders at once, committing every
+`create_transaction` call on its own makes them queue up on SQLite's write lock, and
+each commit pays for its own fsync. `TransactionWriter` is a single async writer
+instead: callers `await writer.submit(...)` and get the transaction id back, while the
+writer inserts everything pending (up to `max_batch` rows) in one commit. Records that
+arrive while a commit is in progress join the next one, so batches grow with load and
+a lone caller is not delayed. A positive `max_delay_ms` additionally holds each batch
+open for that long when other callers are submitting, trading latency for fewer
+commits.
+
+Durability: a submit only resolves after the commit containing its record has
+returned, so every id handed out is on disk. `close()` (or leaving `async with`) stops
+new submissions, drains everything already queued and commits it before returning. If
+a batch fails, its rows are retried one commit each so a single bad record only fails
+its own caller. Sales are inserted only if enough unreserved stock is available (see
+`reservations.py`); a sale that would oversell fails its caller with ValueError.
+
+While a writer is running, the agents' `create_order_transaction` tool routes through
+it (see `active_writer()`); otherwise it calls `create_transaction` directly. Each
+record is written under the request key of its caller, so the rows stay tagged with
+the request that made them (see `request_writes.py`).
+"""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+from project_starter import get_engine
+
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+
+INSERT_TRANSACTION = (
+    "INSERT INTO transactions (item_name, transaction_type, units, price, transaction_date) "
+    "VALUES (:item_name, :transaction_type, :units, :price, :transaction_date)"
+)
+
+_STOP = object()
+_active: Optional["TransactionWriter"] = None
+
+
+def active_writer() -> Optional["TransactionWriter"]:
+    """Return the writer running on the current event loop, if any."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    if _active is not None and _active._loop is loop and not _active.closed:
+        return _active
+    return None
+
+
+def _transaction_record(
+    item_name: str, transaction_type: str, quantity: int, price: float, date: Union[str, datetime]
+) -> Dict:
+    if transaction_type not in {"stock_orders", "sales"}:
+        raise ValueError("Transaction type must be 'stock_orders' or 'sales'")
+    return {
+        "item_name": item_name,
+        "transaction_type": transaction_type,
+        "units": quantity,
+        "price": price,
+        "transaction_date": date.isoformat() if isinstance(date, datetime) else date,
+    }
+
+
+class TransactionWriter:
+    """Single async writer that coalesces submitted transactions into batched commits."""
+
+    def __init__(self, engine: Optional[Engine] = None, max_batch: int = 200, max_delay_ms: float = 0.0):
+        """
+        Args:
+            engine: Engine to write to. Defaults to the shared `get_engine()`.
+            max_batch: Most records committed together.
+            max_delay_ms: How long to hold a batch open for more records while other
+                          callers are submitting (0 commits as soon as the writer is free).
+        """
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.closed = False
+        self.commits = 0
+        self.rows = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+        self._failure: Optional[BaseException] = None
+
+    async def start(self) -> "TransactionWriter":
+        """Start the writer task on the running event loop and make it the active writer."""
+        global _active
+        if self._task is not None:
+            raise RuntimeError("TransactionWriter already started")
+        self.engine = self.engine or get_engine()
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        _active = self
+        return self
+
+    async def submit(
+        self,
+        item_name: str,
+        transaction_type: str,
+        quantity: int,
+        price: float,
+        date: Union[str, datetime],
+    ) -> int:
+        """
+        Queue a transaction and wait until it is committed.
+
+        Takes the same arguments as `create_transaction`.
+
+        Returns:
+            int: The ID of the committed transaction.
+
+        Raises:
+            ValueError: If `transaction_type` is not 'stock_orders' or 'sales'.
+            RuntimeError: If the writer is not running, or stopped on an unexpected error.
+        """
+        if self._task is None or self.closed:
+            raise RuntimeError("TransactionWriter is not running") from self._failure
+        from request_writes import current_request
+
+        record = _transaction_record(item_name, transaction_type, quantity, price, date)
+        future = self._loop.create_future()
+        self._queue.put_nowait((record, current_request(), future))
+        return await future
+
+    async def close(self) -> None:
+        """Stop accepting submissions, then commit everything already queued."""
+        global _active
+        if self._task is None or self.closed:
+            return
+        self.closed = True
+        self._queue.put_nowait(_STOP)
+        await self._task
+        if _active is self:
+            _active = None
+
+    async def __aenter__(self) -> "TransactionWriter":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def _run(self) -> None:
+        batch: List = []
+        try:
+            stopping = False
+            while not stopping:
+                item = await self._queue.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                # If other callers are submitting too, give them a moment to join this commit;
+                # a lone caller is written straight away instead of paying the delay
+                await asyncio.sleep(0)
+                if self.max_delay and 0 < self._queue.qsize() < self.max_batch - 1 and not self.closed:
+                    await asyncio.sleep(self.max_delay)
+                while len(batch) < self.max_batch and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                results = await asyncio.to_thread(
+                    self._write_batch, [record for record, _, _ in batch], [key for _, key, _ in batch]
+                )
+                for (_, _, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                batch = []
+        except BaseException as e:
+            # Fail every caller still waiting instead of leaving them hanging, and refuse new ones
+            global _active
+            if _active is self:
+                _active = None
+            self.closed = True
+            self._failure = e
+            print(f"Transaction writer stopped: {e!r}")
+            pending = [future for _, _, future in batch]
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    pending.append(item[2])
+            for future in pending:
+                if not future.done():
+                    error = RuntimeError(f"TransactionWriter stopped: {e!r}")
+                    error.__cause__ = e
+                    future.set_exception(error)
+            if isinstance(e, (asyncio.CancelledError, KeyboardInterrupt, SystemExit)):
+                raise
+
+    def _write_batch(self, records: List[Dict], request_keys: List[Optional[str]]) -> List[Union[int, Exception]]:
+        from sqlalchemy import text
+
+        from request_writes import tagging_writes
+        from reservations import ensure_reservations_table, sell_if_available
+
+        insert = text(INSERT_TRANSACTION)
+        try:
+            ensure_reservations_table(self.engine)
+            ids: List[Union[int, Exception]] = []
+            with self.engine.begin() as conn:
+                for record, request_key in zip(records, request_keys):
+                    with tagging_writes(request_key):
+                        if record["transaction_type"] == "sales":
+                            # Conditional on unreserved stock, which includes earlier sales in this batch
+                            transaction_id = sell_if_available(
+                                conn, record["item_name"], record["units"], record["price"], record["transaction_date"]
+                            )
+                            ids.append(transaction_id if transaction_id is not None else ValueError(
+                                f"Insufficient stock to sell {record['units']} units of {record['item_name']}"
+                            ))
+                        else:
+                            ids.append(conn.execute(insert, record).lastrowid)
+            self.commits += 1
+            self.rows += sum(1 for i in ids if not isinstance(i, Exception))
+            return ids
+        except Exception as e:
+            if len(records) == 1:
+                print(f"Error creating transaction: {e}")
+                return [e]
+
+        # Isolate the failing record(s): one commit per row
+        results: List[Union[int, Exception]] = []
+        for record, request_key in zip(records, request_keys):
+            results.extend(self._write_batch([record], [request_key]))
+        return results
+
+
+def benchmark_commits(n_transactions: int = 2000, concurrency: int = 16, max_delay_ms: float = 0.0) -> Dict[str, float]:
+    """
+    Compare commits per second of direct per-call inserts vs the write-behind queue.
+
+    Both run against a fresh temporary SQLite database with `concurrency` callers in
+    flight. The direct path commits each transaction on its own from a worker thread,
+    like concurrent `create_transaction` calls; the queued path submits through a
+    `TransactionWriter`.
+
+    Args:
+        n_transactions: Transactions to record in each mode.
+        concurrency: Callers recording transactions at the same time.
+        max_delay_ms: `max_delay_ms` of the writer under test.
+
+    Returns:
+        Transactions per second and commit counts for each mode.
+    """
+    import os
+    import tempfile
+    import time
+
+    from sqlalchemy import create_engine, text
+
+    args = ("A4 paper", "stock_orders", 10, 0.5, "2025-04-01T00:00:00")
+    record = _transaction_record(*args)
+    report: Dict[str, float] = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def fresh_engine(name: str) -> Engine:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, name)}")
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "CREATE TABLE transactions (id FLOAT, item_name TEXT, transaction_type TEXT, "
+                    "units INTEGER, price FLOAT, transaction_date TEXT)"
+                ))
+            return engine
+
+        def direct_insert(engine: Engine) -> int:
+            with engine.begin() as conn:
+                return conn.execute(text(INSERT_TRANSACTION), record).lastrowid
+
+        async def run_direct(engine: Engine) -> None:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with semaphore:
+                    return await asyncio.to_thread(direct_insert, engine)
+
+            await asyncio.gather(*(one() for _ in range(n_transactions)))
+
+        async def run_queued(engine: Engine) -> TransactionWriter:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async with TransactionWriter(engine, max_delay_ms=max_delay_ms) as writer:
+                async def one():
+                    async with semaphore:
+                        return await writer.submit(*args)
+
+                ids = await asyncio.gather(*(one() for _ in range(n_transactions)))
+            assert len(set(ids)) == n_transactions
+            return writer
+
+        for mode in ("direct", "queued"):
+            engine = fresh_engine(f"{mode}.db")
+            started = time.perf_counter()
+            if mode == "direct":
+                asyncio.run(run_direct(engine))
+                commits = n_transactions
+            else:
+                commits = asyncio.run(run_queued(engine)).commits
+            elapsed = time.perf_counter() - started
+            with engine.connect() as conn:
+                assert conn.execute(text("SELECT COUNT(*) FROM transactions")).scalar() == n_transactions
+            engine.dispose()
+            report[f"{mode}_tx_per_s"] = n_transactions / elapsed
+            report[f"{mode}_commits"] = commits
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark direct inserts vs the write-behind transaction queue")
+    parser.add_argument("-n", type=int, default=2000, help="Transactions per mode (default: 2000)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent callers (default: 16)")
+    parser.add_argument("--max-delay-ms", type=float, default=0.0, help="Writer batch delay (default: 0)")
+    args = parser.parse_args()
+
+    report = benchmark_commits(args.n, args.concurrency, args.max_delay_ms)
+    print(f"Direct inserts: {report['direct_tx_per_s']:8.0f} tx/s ({report['direct_commits']:.0f} commits)")
+    print(f"Write-behind:   {report['queued_tx_per_s']:8.0f} tx/s ({report['queued_commits']:.0f} commits)")
+    print(f"Speedup: {report['queued_tx_per_s'] / report['direct_tx_per_s']:.1f}x")